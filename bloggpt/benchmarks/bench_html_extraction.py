@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the HTML text extraction engine against the previous extraction code.
+
+Run it from the bloggpt directory:
+
+    python benchmarks/bench_html_extraction.py [FIXTURE_DIR] [--repeat N] [--scale N]
+
+Every saved page in FIXTURE_DIR (default: benchmarks/fixtures) is extracted N times with both
+implementations. --scale repeats the body of each page to simulate big pages.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chardet
+from bs4 import BeautifulSoup
+
+from utils.text_extraction import HTML_PARSER, decode_content, html_to_text
+
+
+def legacy_clean_text(text):
+    text = text.strip()
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\n+", "\n", text)
+    return text
+
+
+def legacy_extract(content):
+    """The extraction code used before the extraction engine."""
+    encoding = chardet.detect(content)["encoding"]
+    decoded_content = content.decode(encoding)
+    soup = BeautifulSoup(decoded_content, "html.parser")
+    lines = soup.get_text().splitlines()
+    return " ".join(legacy_clean_text(line) for line in lines)
+
+
+def engine_extract(content):
+    """The extraction engine, as used by the document loader."""
+    return html_to_text(decode_content(content, "text/html"))
+
+
+def time_extraction(extract, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = extract(content)
+    return (time.perf_counter() - start) / repeat, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "fixture_dir",
+        nargs="?",
+        default=os.path.join(os.path.dirname(__file__), "fixtures"),
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"Parser backend: {HTML_PARSER}")
+    for path in sorted(glob.glob(os.path.join(args.fixture_dir, "*.htm*"))):
+        with open(path, "rb") as f:
+            content = f.read()
+        if args.scale > 1:
+            head, _, rest = content.partition(b"<body>")
+            body, _, tail = rest.partition(b"</body>")
+            content = head + b"<body>" + body * args.scale + b"</body>" + tail
+
+        legacy_seconds, legacy_text = time_extraction(
+            legacy_extract, content, args.repeat
+        )
+        engine_seconds, engine_text = time_extraction(
+            engine_extract, content, args.repeat
+        )
+        print(
+            f"{os.path.basename(path)} ({len(content) / 1024:.0f} KiB): "
+            f"legacy {legacy_seconds * 1000:.1f} ms, {len(legacy_text.split())} words | "
+            f"engine {engine_seconds * 1000:.1f} ms, {len(engine_text.split())} words | "
+            f"speedup {legacy_seconds / engine_seconds:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of sequential against process-pool PDF text extraction.
+
+Run it from the bloggpt directory:
+
+    python benchmarks/bench_pdf_extraction.py [--pages N ...] [--workers N] [--max-words N]
+
+A synthetic PDF of N pages of text is extracted page by page in the calling
+process, and on a process pool in page ranges read from a temporary file, both
+with the word budget of extract_pdf_text (0 reads every page). The pool is
+started before timing, as it is shared by a whole run.
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PyPDF2
+
+from tests.pdf_samples import make_pdf
+from utils import pdf_extraction
+from utils.pdf_extraction import PDF_MAX_WORDS
+
+
+def time_sequential(content, max_words):
+    start = time.perf_counter()
+    pdf = PyPDF2.PdfReader(BytesIO(content))
+    pages, _ = pdf_extraction._extract_sequentially(pdf, len(pdf.pages), max_words)
+    return time.perf_counter() - start, len(pages)
+
+
+def time_parallel(content, max_words):
+    start = time.perf_counter()
+    num_pages = len(PyPDF2.PdfReader(BytesIO(content)).pages)
+    pages, _ = pdf_extraction._extract_rest_in_parallel(
+        content, 0, num_pages, max_words
+    )
+    return time.perf_counter() - start, len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[40, 100, 300])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-words", type=int, nargs="+", default=[PDF_MAX_WORDS, 0])
+    args = parser.parse_args()
+
+    pdf_extraction.PDF_WORKERS = args.workers
+    # Start the pool and import PyPDF2 in every worker before timing
+    pool = pdf_extraction.get_pdf_pool()
+    list(pool.map(abs, range(args.workers)))
+
+    print(f"{os.cpu_count()} CPUs, {args.workers} workers")
+    for num_pages in args.pages:
+        content = make_pdf(num_pages)
+        for max_words in args.max_words:
+            sequential, sequential_pages = time_sequential(content, max_words)
+            parallel, parallel_pages = time_parallel(content, max_words)
+            print(
+                f"{num_pages} pages, budget {max_words or 'none'}: "
+                f"sequential {sequential:.2f}s ({sequential_pages} pages) | "
+                f"pool {parallel:.2f}s ({parallel_pages} pages) | "
+                f"speedup {sequential / parallel:.2f}x"
+            )
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
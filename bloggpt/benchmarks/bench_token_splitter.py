@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the tokenize-once splitter against langchain's TokenTextSplitter.
+
+Run it from the bloggpt directory:
+
+    python benchmarks/bench_token_splitter.py [FIXTURE_DIR] [--repeat N] [--scale N]
+
+The text of every saved page in FIXTURE_DIR (default: benchmarks/fixtures) is joined into one
+corpus, repeated --scale times, and split N times into 300-token chunks with a 100-token overlap,
+as the recurrent RQNA runner does.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.text_splitter import TokenTextSplitter
+
+from utils.ingestion import EMBED_MODEL
+from utils.text_extraction import decode_content, html_to_text
+from utils.token_utils import iter_token_windows, split_token_windows
+
+CHUNK_TOKENS = 300
+OVERLAP_TOKENS = 100
+
+
+def legacy_split(corpus):
+    """The splitting code used before the tokenize-once splitter."""
+    corpus = corpus.replace("<|endoftext|>", " ")
+    text_splitter = TokenTextSplitter(
+        chunk_size=CHUNK_TOKENS, chunk_overlap=OVERLAP_TOKENS
+    )
+    return text_splitter.split_text(corpus)
+
+
+def window_split(corpus):
+    """The tokenize-once splitter, as used by the recurrent RQNA runner."""
+    return split_token_windows(corpus, CHUNK_TOKENS, OVERLAP_TOKENS, EMBED_MODEL)
+
+
+def streaming_split(corpus):
+    """The streaming variant, fed with 64 KiB pieces of the corpus."""
+    pages = (corpus[i : i + 65536] for i in range(0, len(corpus), 65536))
+    return list(iter_token_windows(pages, CHUNK_TOKENS, OVERLAP_TOKENS, EMBED_MODEL))
+
+
+def time_split(split, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = split(corpus)
+    return (time.perf_counter() - start) / repeat, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "fixture_dir",
+        nargs="?",
+        default=os.path.join(os.path.dirname(__file__), "fixtures"),
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=20)
+    args = parser.parse_args()
+
+    texts = []
+    for path in sorted(glob.glob(os.path.join(args.fixture_dir, "*.htm*"))):
+        with open(path, "rb") as f:
+            texts.append(html_to_text(decode_content(f.read(), "text/html")))
+    corpus = "\n\n".join(texts * args.scale)
+
+    legacy_seconds, legacy_chunks = time_split(legacy_split, corpus, args.repeat)
+    print(
+        f"Corpus: {len(corpus) / 1024:.0f} KiB | "
+        f"TokenTextSplitter {legacy_seconds * 1000:.1f} ms, {len(legacy_chunks)} chunks"
+    )
+    for name, split in [("windows", window_split), ("streaming", streaming_split)]:
+        seconds, chunks = time_split(split, corpus, args.repeat)
+        print(
+            f"{name} {seconds * 1000:.1f} ms, {len(chunks)} chunks | "
+            f"speedup {legacy_seconds / seconds:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
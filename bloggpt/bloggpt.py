@@ -3,15 +3,18 @@
 import logging
 import os
 import sys
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import streamlit as st
 from ansi2html import Ansi2HTMLConverter
 from dotenv import load_dotenv
 from langchain.agents import AgentType, Tool, initialize_agent
-from langchain.chat_models import ChatOpenAI
+from langchain.agents.mrkl.output_parser import FINAL_ANSWER_ACTION
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 from prompts.prompts import (
     BLOG_SECTION_AGENT_SYSTEM_PROMPT,
@@ -19,7 +22,17 @@ from prompts.prompts import (
     REWRITE_PROMPT,
     TOPIC_PROMPT,
 )
-from utils.logging_utils import StreamlitPrint
+from utils.context_budget import (
+    SECTION_CONTEXT_TOKENS,
+    ContextPiece,
+    get_prompt_token_recorder,
+    prompt_token_usage,
+    record_prompt_tokens,
+    reset_prompt_token_usage,
+    set_prompt_token_recorder,
+)
+from utils.llm_utils import llm_cache_stats
+from utils.logging_utils import StreamlitPrint, StreamlitTokenHandler
 from utils.main_utils import (
     bprint,
     combine_drafts,
@@ -28,6 +41,13 @@ from utils.main_utils import (
     rprint,
     split_outline_prompt,
 )
+from utils.model_registry import (
+    ModelProfile,
+    get_chat_model,
+    get_task_profile,
+    route_task,
+)
+from utils.ranking import rank_texts
 from utils.web_utils import search_and_summarize_web_url
 
 sys.stdout = StreamlitPrint()
@@ -37,23 +57,49 @@ load_dotenv(".")
 
 # Use the environment variables
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Number of blog sections generated concurrently (1 = one after another)
+SECTION_WORKERS = int(os.getenv("SECTION_WORKERS", "4"))
+# Render section drafts and the final blog token by token as they are generated
+STREAM_OUTPUT = os.getenv("STREAM_OUTPUT", "true").lower() == "true"
 
 tools = [search_and_summarize_web_url]
 
-chat_model = ChatOpenAI(
-    model_name="gpt-4-0613",
-    temperature=0,
-    openai_api_key=OPENAI_API_KEY,
-)
 
-# https://github.com/hwchase17/langchain/issues/6025
-blog_agent = initialize_agent(
-    tools,
-    chat_model,
-    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    verbose=True,
-    max_iterations=4,
-)
+def make_blog_agent(profile: ModelProfile, streaming: bool = False):
+    """
+    Create a blog agent for one blog section.
+
+    Each section runs its own agent, so concurrent sections share nothing but
+    the chat client, and callbacks are passed to each run.
+
+    Args:
+        profile: The model profile the agent runs with.
+        streaming: Whether the completions of the agent are streamed.
+
+    Returns:
+        The blog agent.
+    """
+    # https://github.com/hwchase17/langchain/issues/6025
+    return initialize_agent(
+        tools,
+        get_chat_model(profile, streaming=streaming, openai_api_key=OPENAI_API_KEY),
+        agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+        verbose=True,
+        max_iterations=4,
+    )
+
+
+def make_section_stream_handler(placeholder) -> StreamlitTokenHandler:
+    """
+    Create the handler that streams the final answer of a section agent.
+
+    Args:
+        placeholder: The Streamlit placeholder of the section.
+
+    Returns:
+        A handler that hides the thoughts and actions of the agent.
+    """
+    return StreamlitTokenHandler(placeholder, answer_prefix=FINAL_ANSWER_ACTION)
 
 
 def get_topic_context(topic: str) -> Optional[str]:
@@ -79,6 +125,88 @@ def get_topic_context(topic: str) -> Optional[str]:
     return context
 
 
+def log_stream_timings(name: str, stream_handler: Optional[StreamlitTokenHandler]):
+    """
+    Log the time to first token and the total generation time of a streamed output.
+
+    Args:
+        name: A string naming the generated output.
+        stream_handler: The handler the output was streamed to, if any.
+    """
+    if stream_handler is None or stream_handler.total_time is None:
+        return
+    ttft = stream_handler.time_to_first_token
+    total_time = stream_handler.total_time
+    if ttft is None:
+        logging.info(f"{name}: generated in {total_time:.2f}s (nothing streamed)")
+    else:
+        logging.info(
+            f"{name}: first token after {ttft:.2f}s, generated in {total_time:.2f}s"
+        )
+
+
+def run_section_agent(
+    header: str,
+    blog_section: str,
+    context: str,
+    stream_handler: Optional[StreamlitTokenHandler] = None,
+) -> str:
+    """
+    Run the blog agent for a single blog section without touching the page layout.
+
+    The paragraphs of the context most relevant to the blog section are packed
+    into the token budget of the prompt.
+
+    Args:
+        header: A string representing the header.
+        blog_section: A string representing the blog section.
+        context: A string representing the context.
+        stream_handler: If given, the final answer of the agent is streamed to
+            this handler.
+
+    Returns:
+        A string representing the generated blog section.
+    """
+    budget = get_task_profile("section_draft").budget()
+    max_context_tokens = min(
+        SECTION_CONTEXT_TOKENS,
+        budget.remaining(
+            BLOG_SECTION_AGENT_SYSTEM_PROMPT.format(
+                TOPIC_PROMPT=TOPIC_PROMPT,
+                BLOG_SECTION_OUTLINE_PROMPT=blog_section,
+                CONTEXT="",
+            )
+        ),
+    )
+    paragraphs = [p for p in (context or "").split("\n\n") if p.strip()]
+    scores = dict(rank_texts(blog_section, paragraphs))
+    packed_context = budget.pack(
+        [ContextPiece(p, scores[i]) for i, p in enumerate(paragraphs)],
+        max_context_tokens,
+        separator="\n\n",
+        keep_order=True,
+    )
+    logging.info(f"Context of {header}: {packed_context.summary()}")
+
+    GENERATE_BLOG_SECTION_PROMPT = BLOG_SECTION_AGENT_SYSTEM_PROMPT.format(
+        TOPIC_PROMPT=TOPIC_PROMPT,
+        BLOG_SECTION_OUTLINE_PROMPT=blog_section,
+        CONTEXT=packed_context.text,
+    )
+    logging.debug(GENERATE_BLOG_SECTION_PROMPT)
+    prompt_tokens = budget.count(GENERATE_BLOG_SECTION_PROMPT)
+    profile = route_task("section_draft", prompt_tokens)
+    record_prompt_tokens(
+        "Blog section", GENERATE_BLOG_SECTION_PROMPT, profile.model_name, prompt_tokens
+    )
+    rprint(f"Generating Blog Section: {header}")
+    callbacks = [stream_handler] if stream_handler is not None else None
+    agent = make_blog_agent(profile, streaming=stream_handler is not None)
+    generated_blog = agent.run(GENERATE_BLOG_SECTION_PROMPT, callbacks=callbacks)
+    log_stream_timings(f"Blog section {header}", stream_handler)
+    return generated_blog
+
+
 def generate_blog_section(
     header: str, blog_section: str, context: str
 ) -> Optional[str]:
@@ -96,14 +224,12 @@ def generate_blog_section(
     """
     try:
         with st.expander(f"Generating Blog Section: {header}"):
-            GENERATE_BLOG_SECTION_PROMPT = BLOG_SECTION_AGENT_SYSTEM_PROMPT.format(
-                TOPIC_PROMPT=TOPIC_PROMPT,
-                BLOG_SECTION_OUTLINE_PROMPT=blog_section,
-                CONTEXT=context,
+            stream_handler = (
+                make_section_stream_handler(st.empty()) if STREAM_OUTPUT else None
+            )
+            generated_blog = run_section_agent(
+                header, blog_section, context, stream_handler
             )
-            logging.debug(GENERATE_BLOG_SECTION_PROMPT)
-            rprint(f"Generating Blog Section: {header}")
-            generated_blog = blog_agent.run(GENERATE_BLOG_SECTION_PROMPT)
     except Exception as e:
         st.error(f"Error occurred while generating blog section {header}: {e}")
         st.error(traceback.format_exc())
@@ -111,6 +237,72 @@ def generate_blog_section(
     return generated_blog
 
 
+def generate_blog_sections_concurrently(
+    headers: List[str],
+    blog_sections: List[str],
+    context: str,
+    max_workers: int = SECTION_WORKERS,
+) -> Tuple[List[Optional[str]], Dict[str, Exception]]:
+    """
+    Generate all blog sections concurrently with a bounded number of workers.
+
+    Each section gets a placeholder in outline order, which is filled in as soon
+    as that section finishes, so the page layout does not depend on which agent
+    run completes first. A failing section does not stop the others.
+
+    Args:
+        headers: A list of strings representing the headers.
+        blog_sections: A list of strings representing the blog sections.
+        context: A string representing the context.
+        max_workers: The maximum number of sections generated at the same time.
+
+    Returns:
+        A list with the generated blog sections in outline order (None for the
+        sections that failed), and a dict mapping failed headers to their errors.
+    """
+    sections = list(zip(headers, blog_sections))
+    placeholders = [st.empty() for _ in sections]
+    generated_blogs: List[Optional[str]] = [None] * len(sections)
+    failures: Dict[str, Exception] = {}
+
+    # Worker threads need the script context to be able to print to the page,
+    # and the prompt token recorder of the run
+    script_run_ctx = get_script_run_ctx()
+    prompt_token_recorder = get_prompt_token_recorder()
+
+    def _worker(i: int, header: str, blog_section: str) -> str:
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+        set_prompt_token_recorder(prompt_token_recorder)
+        # Stream the draft into the section placeholder until it is done
+        stream_handler = (
+            make_section_stream_handler(placeholders[i]) if STREAM_OUTPUT else None
+        )
+        return run_section_agent(header, blog_section, context, stream_handler)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(_worker, i, header, blog_section): i
+            for i, (header, blog_section) in enumerate(sections)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            header = sections[i][0]
+            with placeholders[i].container():
+                try:
+                    generated_blogs[i] = future.result()
+                except Exception as e:
+                    failures[header] = e
+                    st.error(
+                        f"Error occurred while generating blog section {header}: {e}"
+                    )
+                    st.error("".join(traceback.format_exception(e)))
+                    continue
+                with st.expander(f"Blog Section: {header}"):
+                    st.write(generated_blogs[i])
+
+    return generated_blogs, failures
+
+
 def save_blog_section(generated_blog: str, header: str, num_generated: int) -> None:
     """
     Save a generated blog section.
@@ -154,35 +346,59 @@ def combine_and_finalize_draft(generated_blogs: List[str]) -> None:
         # entire_draft = combine_drafts("outputs/")
         with st.expander("Final Blog"):
             rprint("Generating Final Blog")
-            final_blog = generate_final_blog(entire_draft, TOPIC_PROMPT, OPENAI_API_KEY)
+            final_blog_placeholder = st.empty()
+            stream_handler = (
+                StreamlitTokenHandler(final_blog_placeholder) if STREAM_OUTPUT else None
+            )
+            final_blog = generate_final_blog(
+                entire_draft, TOPIC_PROMPT, OPENAI_API_KEY, stream_handler
+            )
+            log_stream_timings("Final blog", stream_handler)
+            logging.info(f"Prompt tokens: {prompt_token_usage()}")
+            logging.info(f"LLM cache stats: {llm_cache_stats()}")
             gprint("Done!")
-            st.write(final_blog)
+            final_blog_placeholder.write(final_blog)
     except Exception as e:
         logging.error(f"Error occurred while finalizing blog: {e}")
         st.error(traceback.format_exc())
 
 
 @st.cache_data()
-def run_bloggpt(topic_str: str, blog_outline: str) -> None:
+def run_bloggpt(
+    topic_str: str, blog_outline: str, max_workers: int = SECTION_WORKERS
+) -> None:
     """
     Run bloggpt to generate a blog from provided topic and blog outline.
         topic_str: A string representing the topic.
         blog_outline: A string representing the blog outline.
+        max_workers: The number of blog sections generated concurrently. With 1
+            the sections are generated one after another.
 
     Returns:
         None.
     """
+    reset_prompt_token_usage()
     topic = topic_str.split(":")[1].strip()
     context = get_topic_context(topic)
     headers, blog_sections = split_outline_prompt(blog_outline)
     generated_blogs = []
-    for num_generated, (header, blog_section) in enumerate(zip(headers, blog_sections)):
-        generated_blog = generate_blog_section(header, blog_section, context)
-        if generated_blog is not None:
-            generated_blogs.append(generated_blog)
-            with st.expander(f"Blog Section: {header}"):
-                st.write(generated_blog)
-            # save_blog_section(generated_blog, header, num_generated)
+    if max_workers > 1:
+        section_drafts, failures = generate_blog_sections_concurrently(
+            headers, blog_sections, context, max_workers=max_workers
+        )
+        if failures:
+            rprint(f"Failed to generate blog sections: {', '.join(failures)}")
+        generated_blogs = [draft for draft in section_drafts if draft is not None]
+    else:
+        for num_generated, (header, blog_section) in enumerate(
+            zip(headers, blog_sections)
+        ):
+            generated_blog = generate_blog_section(header, blog_section, context)
+            if generated_blog is not None:
+                generated_blogs.append(generated_blog)
+                with st.expander(f"Blog Section: {header}"):
+                    st.write(generated_blog)
+                # save_blog_section(generated_blog, header, num_generated)
     combine_and_finalize_draft(generated_blogs)
 
 
@@ -142,4 +142,14 @@ SUMMARIZE_PROMPT = """Write a detailed summary that captures all relevant inform
 "{text}"
 
 
+DETAILED SUMMARY:"""
+
+
+SUMMARIZE_REDUCE_PROMPT = """The following are summaries of consecutive parts of one text.
+Combine them into a single detailed summary that captures all relevant information of the text:
+
+
+"{text}"
+
+
 DETAILED SUMMARY:"""
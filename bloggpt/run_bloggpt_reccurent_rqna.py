@@ -1,20 +1,23 @@
 """
 This is a module that runs bloggpt as a recurrent RAG (retrieval augmented generation) chain. It utilizes pinecone as a 
-vector database to store and retrieve documents. It also uses the openai API to generate the blog.
+vector database to store and retrieve documents, or a local in-process vector store when VECTOR_STORE=local.
+It also uses the openai API to generate the blog.
 """
+import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from functools import partial
 from pprint import pprint
 
 import pinecone
 from dotenv import load_dotenv
 from langchain.callbacks import get_openai_callback
 from langchain.chains import LLMChain, RetrievalQA
-from langchain.chat_models import ChatOpenAI
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.prompts import PromptTemplate
-from langchain.text_splitter import TokenTextSplitter
-from langchain.vectorstores import Pinecone
 
 from prompts.prompts import (
     OUTLINE_PROMPT,
@@ -22,8 +25,33 @@ from prompts.prompts import (
     REWRITE_PROMPT,
     TOPIC_PROMPT,
 )
+from utils.context_budget import (
+    SECTION_CONTEXT_TOKENS,
+    ContextPiece,
+    get_prompt_token_recorder,
+    prompt_token_usage,
+    record_prompt_tokens,
+    reset_prompt_token_usage,
+    set_prompt_token_recorder,
+)
+from utils.dedup import make_deduplicator
+from utils.embedding_cache import get_cached_embeddings
+from utils.fetch_scheduler import FetchReport
+from utils.index_manifest import INCREMENTAL_INDEX, chunk_id, get_index_manifest
+from utils.ingestion import EMBED_MODEL, get_ingestion_embeddings, ingest_texts
+from utils.llm_utils import llm_cache_stats
 from utils.main_utils import bprint, generate_final_blog, gprint, rprint
-from utils.web_utils import search_and_extract_web_url
+from utils.model_registry import get_chat_model, get_task_profile, route_task
+from utils.retrieval import BatchedRetriever, embed_queries, search_pinecone
+from utils.streaming import (
+    RESEARCH_SPILL_DIR,
+    bounded_prefetch,
+    new_run_id,
+    spill_pages,
+)
+from utils.token_utils import iter_token_windows
+from utils.vector_store import VECTOR_STORE_DIR, LocalVectorStore, namespace_dirname
+from utils.web_utils import iter_search_pages
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,6 +60,17 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENV = os.getenv("PINECONE_ENV")
+# "pinecone" or "local"
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone").lower()
+PINECONE_UPSERT_BATCH_SIZE = 100
+# Size and overlap of the chunks the research corpus is split into
+CHUNK_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 100
+# Number of sections processed at the same time, and in each stage of the pipeline
+RQNA_SECTION_WORKERS = int(os.getenv("RQNA_SECTION_WORKERS", "4"))
+RQNA_RESEARCH_WORKERS = int(os.getenv("RQNA_RESEARCH_WORKERS", "2"))
+RQNA_EMBED_WORKERS = int(os.getenv("RQNA_EMBED_WORKERS", "2"))
+RQNA_DRAFT_WORKERS = int(os.getenv("RQNA_DRAFT_WORKERS", "2"))
 
 
 def save_doc_list_to_file(lst, filename):
@@ -72,24 +111,51 @@ def split_outline_prompt(OUTLINE_PROMPT):
     return headers, blog_sections
 
 
-def generate_blog_section(blog_section, namespace, docsearch, draft_llm_chain, topic):
+def generate_blog_section(blog_section, context_pack, draft_prompt, topic):
     """
-    This function generates a blog post based on the given blog section and namespace.
+    This function generates a blog post based on the given blog section and its retrieved context.
+
+    The most similar retrieved chunks are packed into the token budget of the prompt, and the
+    overlaps between neighbouring chunks are removed. The prompt is then routed to the model
+    profile of the section drafts.
 
     Parameters:
     blog_section (str): The section of the blog to generate.
-    namespace (str): The namespace to use for the generation.
-    docsearch (Pinecone): The Pinecone instance to use for document search.
-    draft_llm_chain (LLMChain): The LLMChain instance to use for draft generation.
+    context_pack (ContextPack): The context retrieved for the blog section.
+    draft_prompt (PromptTemplate): The prompt template of the section drafts.
     topic (str): The topic of the blog post.
 
     Returns:
     tuple: The draft output and the retrieved documents.
     """
-    docs = docsearch.similarity_search_with_score(topic, k=10, namespace=namespace)
+    docs = context_pack.docs
     print("docs: ", docs)
-    full_context = "\n".join([doc[0].page_content for doc in docs if doc[1] > 0.85])
-    inputs = {"context": full_context, "topic": topic, "blog_section": blog_section}
+    inputs = {
+        "context": "",
+        "topic": topic,
+        "blog_section": blog_section,
+    }
+
+    budget = get_task_profile("rqna_section_draft").budget()
+    max_context_tokens = min(
+        SECTION_CONTEXT_TOKENS, budget.remaining(draft_prompt.format(**inputs))
+    )
+    packed_context = budget.pack(
+        [ContextPiece(doc.page_content, score) for doc, score in docs],
+        max_context_tokens,
+    )
+    print(f"Context: {packed_context.summary()}")
+    inputs["context"] = packed_context.text
+
+    prompt = draft_prompt.format(**inputs)
+    prompt_tokens = budget.count(prompt)
+    profile = route_task("rqna_section_draft", prompt_tokens)
+    record_prompt_tokens("Section draft", prompt, profile.model_name, prompt_tokens)
+    draft_llm_chain = LLMChain(
+        llm=get_chat_model(profile, openai_api_key=OPENAI_API_KEY),
+        prompt=draft_prompt,
+        verbose=True,
+    )
 
     with get_openai_callback() as cb:
         draft_llm_output = draft_llm_chain(inputs)
@@ -99,22 +165,27 @@ def generate_blog_section(blog_section, namespace, docsearch, draft_llm_chain, t
     return draft_llm_output, docs
 
 
-def setup_pinecone_index(index_name):
+def setup_pinecone_index(index_name, incremental=INCREMENTAL_INDEX):
     """
     This function sets up the Pinecone instance and handles the creation of a new index if necessary.
 
+    In incremental mode an existing index is kept, otherwise it is deleted and created again.
+
     Parameters:
     index_name (str): The name of the index.
-    embeddings (OpenAIEmbeddings): The OpenAIEmbeddings instance to use.
+    incremental (bool): Whether to keep the existing index.
 
     Returns:
     Pinecone: The Pinecone instance.
     """
-    if index_name in pinecone.list_indexes():
-        rprint("Creating New Index")
+    if index_name in pinecone.list_indexes() and not incremental:
+        rprint("Deleting Existing Index")
 
         # Delete existing index
-        pinecone.delete_index("bloggpt")
+        pinecone.delete_index(index_name)
+
+    if index_name not in pinecone.list_indexes():
+        rprint("Creating New Index")
 
         # Create fresh index
         pinecone.create_index(
@@ -123,6 +194,10 @@ def setup_pinecone_index(index_name):
             metric="cosine",
             pods=1,
         )
+        # Nothing recorded for a previous index is in the new one
+        get_index_manifest().delete_index(index_name)
+    else:
+        rprint("Reusing Existing Index")
 
     # Wait for the index to become active
     while True:
@@ -145,142 +220,387 @@ def setup_pinecone_index(index_name):
     return
 
 
-def combine_drafts(directory):
+def setup_vector_store(index_name, embeddings):
     """
-    This function combines all the markdown generated blogs into one file.
+    This function sets up the selected vector store, and garbage-collects its old namespaces.
+
+    The index of the previous runs is kept in incremental mode, otherwise a fresh index is created.
 
     Parameters:
-    directory (str): The directory where the drafts are stored.
+    index_name (str): The name of the index.
+    embeddings (OpenAIEmbeddings): The OpenAIEmbeddings instance to use.
 
     Returns:
-    entire_draft (str): The entire draft of the blog.
+    LocalVectorStore: The local vector store, or None when Pinecone is used.
     """
-    # Define the name of the output file
-    output_file = directory + "complete_draft.md"
+    if VECTOR_STORE == "local":
+        rprint("Setting Up Local VectorDB")
+        persist_directory = os.path.join(VECTOR_STORE_DIR, index_name)
+        vector_store = LocalVectorStore(embeddings, persist_directory)
+        if not INCREMENTAL_INDEX or not os.path.isdir(persist_directory):
+            vector_store.reset()
+            get_index_manifest().delete_index(index_name)
+        collect_garbage(index_name, vector_store)
+        return vector_store
 
-    # Get a list of all draft files
-    draft_files = [
-        f for f in os.listdir(directory) if f.startswith("draft_") and f.endswith(".md")
-    ]
+    # initialize pinecone
+    pinecone.init(
+        api_key=PINECONE_API_KEY,  # find at app.pinecone.io
+        environment=PINECONE_ENV,  # next to api key
+    )
 
-    # Sort the files by their number to maintain the order
-    draft_files.sort(key=lambda x: int(x.split("_")[1].split(".")[0]))
+    rprint("Setting Up VectorDB")
+    setup_pinecone_index(index_name)
+    collect_garbage(index_name)
+    return None
 
-    # Initialize an empty string to store the entire draft
-    entire_draft = ""
 
-    # Open the output file in write mode
-    with open(output_file, "w") as outfile:
-        # Iterate over each draft file
-        for filename in draft_files:
-            # Open the draft file in read mode
-            with open(directory + filename, "r") as infile:
-                # Read the contents of the draft file
-                contents = infile.read()
+def collect_garbage(index_name, vector_store=None):
+    """
+    This function deletes the namespaces that were not used for a while, or that make the index too large.
 
-                # Write the contents of the draft file to the output file
-                outfile.write(contents)
+    Parameters:
+    index_name (str): The name of the index.
+    vector_store (LocalVectorStore): The local vector store, or None to use Pinecone.
+
+    Returns:
+    None
+    """
+    manifest = get_index_manifest()
+    for namespace in manifest.expired_namespaces(index_name):
+        bprint(f"Deleting expired namespace {namespace}")
+        if vector_store is not None:
+            vector_store.delete_namespace(namespace)
+        else:
+            pinecone.Index(index_name).delete(delete_all=True, namespace=namespace)
+        manifest.delete_namespace(index_name, namespace)
+    bprint(f"Index {index_name}: {manifest.stats(index_name)}")
+
+
+def index_texts(texts, embeddings, index_name, namespace, vector_store=None):
+    """
+    This function embeds the texts and stores them in a namespace of the vector store.
+
+    The texts are embedded in adaptive batches, and each batch is upserted while the next one
+    is embedded. Chunks that are already in the namespace are skipped.
+
+    Parameters:
+    texts (iterable): The texts to index, possibly a generator.
+    embeddings (OpenAIEmbeddings): The OpenAIEmbeddings instance to use.
+    index_name (str): The name of the index.
+    namespace (str): The namespace to store the texts in.
+    vector_store (LocalVectorStore): The local vector store, or None to use Pinecone.
+
+    Returns:
+    IngestionStats: The counters of the ingestion.
+    """
+    manifest = get_index_manifest()
+    new_texts = manifest.new_chunks(index_name, namespace, texts)
+
+    if vector_store is not None:
+
+        def store(batch, vectors):
+            vector_store.add_texts(batch, namespace=namespace, embeddings=vectors)
+
+    else:
+        index = pinecone.Index(index_name)
+
+        def store(batch, vectors):
+            # Chunks are identified by their content hash, so upserts are idempotent
+            records = [
+                (chunk_id(text), vector, {"text": text})
+                for text, vector in zip(batch, vectors)
+            ]
+            # Keep Pinecone requests under their size limit
+            for i in range(0, len(records), PINECONE_UPSERT_BATCH_SIZE):
+                index.upsert(
+                    vectors=records[i : i + PINECONE_UPSERT_BATCH_SIZE],
+                    namespace=namespace,
+                )
+
+    def upsert(batch, vectors):
+        store(batch, vectors)
+        manifest.add_chunks(index_name, namespace, batch)
+
+    stats = ingest_texts(new_texts, embeddings, upsert)
+    bprint(
+        f"Indexed {stats.chunks} new chunks in {stats.seconds:.1f}s "
+        f"({stats.chunks_per_second:.1f} chunks/s)"
+    )
+    return stats
 
-                # Add the contents of the draft file to the entire draft string
-                entire_draft += contents
 
-                # Add a newline to separate the contents of different draft files
-                outfile.write("\n\n")
-                entire_draft += "\n\n"
+def combine_drafts(drafts, directory):
+    """
+    This function combines the generated section drafts into one file.
+
+    Parameters:
+    drafts (list): The drafts of the sections, in outline order.
+    directory (str): The directory where the combined draft is written.
+
+    Returns:
+    entire_draft (str): The entire draft of the blog.
+    """
+    # Define the name of the output file
+    output_file = directory + "complete_draft.md"
+
+    # Separate the contents of the different drafts with a blank line
+    entire_draft = "".join(draft + "\n\n" for draft in drafts)
+
+    with open(output_file, "w") as outfile:
+        outfile.write(entire_draft)
 
     gprint(f"All drafts have been combined into {output_file}.")
     return entire_draft
 
 
-def main():
+def research_section(topic, header, index_name, report=None):
     """
-    The main function to run the script.
+    This function searches the web for a blog section and streams its own research corpus.
+
+    In incremental mode the URLs recently indexed for the section are not scraped again.
+
+    Parameters:
+    topic (str): The topic of the blog post.
+    header (str): The header of the blog section.
+    index_name (str): The name of the index.
+    report (FetchReport): Filled with the URLs that succeeded, failed, timed out or were skipped.
 
     Returns:
-    None
+    iterator: The URL and the extracted text of each page, empty for the skipped pages.
     """
-    topic = TOPIC_PROMPT.split(":")[1].strip()
-    print("topic: ", topic)
+    manifest = get_index_manifest()
 
-    headers, blog_sections = split_outline_prompt(OUTLINE_PROMPT)
+    def skip_url(url):
+        return INCREMENTAL_INDEX and manifest.is_fresh_url(index_name, header, url)
 
-    # initialize pinecone
-    pinecone.init(
-        api_key=PINECONE_API_KEY,  # find at app.pinecone.io
-        environment=PINECONE_ENV,  # next to api keySorry for the abrupt cut-off. Here's the continuation of the refactored code:
-    )
+    rprint(f"Searching Google for {topic}, {header}")
+    return iter_search_pages(f"{topic}, {header}", skip_url=skip_url, report=report)
 
-    rprint("Creating VectorDB")
-    index_name = "bloggpt"
-    embeddings = OpenAIEmbeddings()
 
-    setup_pinecone_index(index_name)
+def index_section(pages, embeddings, index_name, header, vector_store):
+    """
+    This function splits the research corpus of a blog section and indexes it in the section namespace.
 
-    num_generated = 0
-    for header, blog_section in zip(headers, blog_sections):
-        rprint(f"Searching Google for {topic}, {header}")
-        search_and_extract_web_url(f"{topic}, {header}")
+    The pages stream through splitting, deduplication and embedding, so the corpus is never
+    held in memory as a whole.
 
-        with open("outputs/web_search_texts.txt") as f:
-            web_search_texts: str = f.read()
+    Parameters:
+    pages (iterable): The URL and the extracted text of each page of the blog section.
+    embeddings (OpenAIEmbeddings): The OpenAIEmbeddings instance to use.
+    index_name (str): The name of the index.
+    header (str): The header of the blog section, used as namespace.
+    vector_store (LocalVectorStore): The local vector store, or None to use Pinecone.
 
-        # Remove special tokenizer tokens from text
-        web_search_texts = web_search_texts.replace("<|endoftext|>", " ")
+    Returns:
+    None
+    """
+    indexed_urls = []
 
-        text_splitter = TokenTextSplitter(chunk_size=300, chunk_overlap=100)
+    def page_texts():
+        for url, text in pages:
+            if text:
+                indexed_urls.append(url)
+                yield text + "\n\n"
 
-        # # This is a hack to get around the fact that the tokenizer doesn't like special tokens
-        # text_splitter._disallowed_special = (
-        #     text_splitter._tokenizer.special_tokens_set - {"<|endoftext|>"}
-        # )
+    # The corpus is tokenized once, and special tokens such as <|endoftext|> are dropped
+    texts = iter_token_windows(
+        page_texts(), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, EMBED_MODEL
+    )
 
-        texts = text_splitter.split_text(web_search_texts)
-        docsearch = Pinecone.from_texts(
-            texts, embeddings, index_name=index_name, namespace=header, batch_size=16
-        )
+    # Drop the chunks repeated across pages (boilerplate, syndicated copies)
+    deduplicator = make_deduplicator(EMBED_MODEL)
+    if deduplicator is not None:
+        texts = (text for text in texts if not deduplicator.is_duplicate(text))
+
+    index_texts(texts, embeddings, index_name, header, vector_store)
+
+    if deduplicator is not None:
+        bprint(f"Chunk deduplication for {header}: {deduplicator.stats()}")
+    get_index_manifest().add_urls(index_name, header, indexed_urls)
+
+
+def process_section(
+    num_generated,
+    header,
+    blog_section,
+    topic,
+    embeddings,
+    index_name,
+    vector_store,
+    draft_prompt,
+    stage_slots,
+    retriever,
+    query_vector,
+    spill_dir=None,
+):
+    """
+    This function researches, indexes and drafts one blog section.
 
-        blog_section_rqna_prompt = PromptTemplate(
-            template=RECURRENT_RQNA_SYSTEM_PROMPT,
-            input_variables=["context", "topic", "blog_section"],
-        )
+    Each stage waits for a slot of its own semaphore, so the number of sections in the same
+    stage is bounded while different sections run different stages at the same time.
+    The pages of the research stage stream into the embed stage through a bounded queue.
+    The context of the section is retrieved together with the other sections indexed by then.
 
-        draft_llm = ChatOpenAI(
-            model_name="gpt-4-0613",
-            openai_api_key=OPENAI_API_KEY,
-        )
+    Parameters:
+    num_generated (int): The position of the section in the outline.
+    header (str): The header of the blog section.
+    blog_section (str): The section of the blog to generate.
+    topic (str): The topic of the blog post.
+    embeddings (OpenAIEmbeddings): The OpenAIEmbeddings instance to use.
+    index_name (str): The name of the index.
+    vector_store (LocalVectorStore): The local vector store, or None to use Pinecone.
+    draft_prompt (PromptTemplate): The prompt template of the section drafts.
+    stage_slots (dict): The semaphore of each stage ("research", "embed", "draft").
+    retriever (BatchedRetriever): The retriever shared by the sections.
+    query_vector (list): The embedding of the blog section, its retrieval query.
+    spill_dir (str): The directory of the run's spill files, or None to not write them.
 
-        draft_llm_chain = LLMChain(
-            llm=draft_llm,
-            prompt=blog_section_rqna_prompt,
-            verbose=True,
-        )
+    Returns:
+    str: The generated blog section.
+    """
+    get_index_manifest().touch_namespace(index_name, header)
+
+    report = FetchReport()
+
+    def researched_pages():
+        with stage_slots["research"]:
+            yield from research_section(topic, header, index_name, report)
+
+    # The embed slot is taken first: a section that holds a research slot always has a
+    # consumer for its pages, so full queues cannot block the other sections forever
+    with stage_slots["embed"]:
+        spill_file = None
+        if spill_dir:
+            spill_file = os.path.join(spill_dir, f"{namespace_dirname(header)}.txt")
+        pages = spill_pages(bounded_prefetch(researched_pages()), spill_file)
+        index_section(pages, embeddings, index_name, header, vector_store)
+    bprint(f"Research for {header}: {report.summary()}")
+    with open(f"outputs/research_report_{num_generated}.json", "w") as f:
+        json.dump(asdict(report), f, indent=2)
+    retriever.add(num_generated, blog_section, query_vector, header)
+
+    with stage_slots["draft"]:
+        context_pack = retriever.get(num_generated)
 
         # Generate the blog with the agent
-        rprint("Generating First Draft")
+        rprint(f"Generating First Draft: {header}")
         draft_llm_output, retrieved_docs = generate_blog_section(
-            blog_section, header, docsearch, draft_llm_chain, topic
+            blog_section, context_pack, draft_prompt, topic
         )
-        print(draft_llm_output["text"])
+    print(draft_llm_output["text"])
 
-        generated_blog = draft_llm_output["text"]
+    generated_blog = draft_llm_output["text"]
 
-        save_doc_list_to_file(
-            retrieved_docs, f"outputs/retrieved_docs_{num_generated}.txt"
-        )
+    save_doc_list_to_file(retrieved_docs, f"outputs/retrieved_docs_{num_generated}.txt")
+
+    # Save the blog in a markdown file
+    with open(f"outputs/draft_{num_generated}.md", "w") as f:
+        f.write(generated_blog)
+
+    return generated_blog
+
+
+def main():
+    """
+    The main function to run the script.
 
-        # Save the blog in a markdown file
-        with open(f"outputs/draft_{num_generated}.md", "w") as f:
-            f.write(generated_blog)
+    The sections run through a pipeline (research, embed, draft): while one section is drafted,
+    the next ones are already being researched and indexed.
 
-        num_generated += 1
+    Returns:
+    None
+    """
+    reset_prompt_token_usage()
+    topic = TOPIC_PROMPT.split(":")[1].strip()
+    print("topic: ", topic)
+
+    headers, blog_sections = split_outline_prompt(OUTLINE_PROMPT)
+
+    index_name = "bloggpt"
+    openai_embeddings = OpenAIEmbeddings()
+    # Chunks and queries that were already embedded are read from the embedding cache
+    embeddings = get_cached_embeddings(openai_embeddings, openai_embeddings.model)
+    # Research chunks are embedded in the batches of the ingestion pipeline, which
+    # handles rate limits itself
+    ingestion_embeddings = get_cached_embeddings(
+        get_ingestion_embeddings(), openai_embeddings.model
+    )
+
+    vector_store = setup_vector_store(index_name, embeddings)
+
+    # Each section is retrieved with its own text, all embedded in one request
+    query_vectors = embed_queries(embeddings, blog_sections[: len(headers)])
+    if vector_store is not None:
+        search = vector_store.batch_similarity_search_by_vector
+    else:
+        search = partial(search_pinecone, pinecone.Index(index_name))
+    retriever = BatchedRetriever(search)
+
+    # Optionally keep the research corpus of the run on disk, one file per section
+    spill_dir = None
+    if RESEARCH_SPILL_DIR:
+        spill_dir = os.path.join(RESEARCH_SPILL_DIR, new_run_id())
+        bprint(f"Spilling the research corpus to {spill_dir}")
+
+    # The draft model is picked for each section by the model registry
+    draft_prompt = PromptTemplate(
+        template=RECURRENT_RQNA_SYSTEM_PROMPT,
+        input_variables=["context", "topic", "blog_section"],
+    )
+
+    stage_slots = {
+        "research": threading.BoundedSemaphore(RQNA_RESEARCH_WORKERS),
+        "embed": threading.BoundedSemaphore(RQNA_EMBED_WORKERS),
+        "draft": threading.BoundedSemaphore(RQNA_DRAFT_WORKERS),
+    }
+    sections = list(zip(headers, blog_sections))
+    # The section drafts are recorded with the prompts of the run
+    with ThreadPoolExecutor(
+        max_workers=max(1, RQNA_SECTION_WORKERS),
+        initializer=set_prompt_token_recorder,
+        initargs=(get_prompt_token_recorder(),),
+    ) as executor:
+        futures = [
+            executor.submit(
+                process_section,
+                num_generated,
+                header,
+                blog_section,
+                topic,
+                ingestion_embeddings,
+                index_name,
+                vector_store,
+                draft_prompt,
+                stage_slots,
+                retriever,
+                query_vectors[num_generated],
+                spill_dir,
+            )
+            for num_generated, (header, blog_section) in enumerate(sections)
+        ]
+        # Wait for every section, in outline order; a failed section is
+        # reported and left out instead of aborting the others
+        drafts = []
+        for (header, _), future in zip(sections, futures):
+            try:
+                drafts.append(future.result())
+            except Exception as e:
+                rprint(f"Failed to generate the section {header}: {e}")
+    bprint(f"Retrieved {len(sections)} sections in {retriever.batches} searches")
+    if not drafts:
+        rprint("No section could be generated")
+        return
 
     # Combine the markdown generated blogs into one
     rprint("Combining the markdown generated blogs into one")
-    entire_draft = combine_drafts("outputs/")
+    entire_draft = combine_drafts(drafts, "outputs/")
 
     # Refine the generated blog
     rprint("Generating Final Blog")
     generate_final_blog(entire_draft, TOPIC_PROMPT, OPENAI_API_KEY)
+    bprint(f"Prompt tokens: {prompt_token_usage()}")
+    bprint(f"LLM cache stats: {llm_cache_stats()}")
 
 
 if __name__ == "__main__":
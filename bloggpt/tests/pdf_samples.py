@@ -0,0 +1,56 @@
+"""Synthetic PDF files for the tests and benchmarks of the PDF extraction."""
+from io import BytesIO
+
+WORDS = "pick a ripe watermelon by its field spot weight and hollow sound".split()
+
+
+def make_pdf(num_pages: int, words_per_page: int = 400) -> bytes:
+    """
+    Build a PDF of num_pages pages of text, without any PDF writer dependency.
+
+    Args:
+        num_pages: The number of pages.
+        words_per_page: The number of words of each page.
+
+    Returns:
+        The bytes of the PDF file.
+    """
+    page_ids = [4 + 2 * i for i in range(num_pages)]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % i for i in page_ids), num_pages),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page, page_id in enumerate(page_ids):
+        words = [WORDS[(page + i) % len(WORDS)] for i in range(words_per_page)]
+        lines = [" ".join(words[i : i + 12]) for i in range(0, len(words), 12)]
+        stream = b"BT /F1 9 Tf 11 TL 40 800 Td " + b" ".join(
+            b"(%s) Tj T*" % line.encode("ascii") for line in lines
+        )
+        stream += b" ET"
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (page_id + 1)
+        )
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (
+            len(stream),
+            stream,
+        )
+
+    pdf = BytesIO()
+    pdf.write(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = pdf.tell()
+        pdf.write(b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id]))
+    xref_offset = pdf.tell()
+    pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for object_id in sorted(objects):
+        pdf.write(b"%010d 00000 n \n" % offsets[object_id])
+    pdf.write(
+        b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+        % (len(objects) + 1, xref_offset)
+    )
+    return pdf.getvalue()
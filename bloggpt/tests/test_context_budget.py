@@ -0,0 +1,101 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.context_budget import (
+    PromptTokenRecorder,
+    TokenBudget,
+    get_prompt_token_recorder,
+    prompt_token_usage,
+    record_prompt_tokens,
+    reset_prompt_token_usage,
+    set_prompt_token_recorder,
+)
+
+LONG_SECTION = "\n\n".join(
+    f"Paragraph {i} says something. It then says more about it." for i in range(40)
+)
+
+
+def test_shared_sections_are_cut_at_a_paragraph_and_keep_their_headers():
+    sections = [f"# Part one\n\n{LONG_SECTION}", f"# Part two\n\n{LONG_SECTION}"]
+    budget = TokenBudget("gpt-4")
+
+    packed = budget.share(sections, 300)
+
+    assert packed.truncated == 2
+    assert packed.tokens <= 300
+    assert re.search(r"(?m)^# Part two$", packed.text)
+    for text in packed.texts:
+        assert text.endswith("about it.")
+
+
+def test_a_section_without_boundaries_is_cut_at_the_token_limit():
+    budget = TokenBudget("gpt-4")
+    words = " ".join(f"word{i}" for i in range(1000))
+
+    packed = budget.share([words, words], 200)
+
+    assert packed.truncated == 2
+    assert packed.tokens <= 200
+    assert all(text.startswith("word0 word1") for text in packed.texts)
+
+
+def test_recorder_keeps_totals_per_kind_of_prompt():
+    recorder = PromptTokenRecorder()
+    for tokens in (100, 300, 200):
+        recorder.record("Summary", tokens)
+    recorder.record("Final rewrite", 5000)
+
+    assert recorder.usage() == {
+        "Summary": {"prompts": 3, "tokens": 600, "max_tokens": 300},
+        "Final rewrite": {"prompts": 1, "tokens": 5000, "max_tokens": 5000},
+    }
+
+
+def test_prompt_token_usage_only_covers_the_current_run():
+    record_prompt_tokens("Summary", "a previous run", "gpt-4", tokens=10)
+    reset_prompt_token_usage()
+
+    record_prompt_tokens("Summary", "this run", "gpt-4", tokens=20)
+
+    assert prompt_token_usage() == {
+        "Summary": {"prompts": 1, "tokens": 20, "max_tokens": 20}
+    }
+
+
+def test_concurrent_runs_record_their_own_prompts():
+    usages = {}
+
+    def run(name, tokens):
+        reset_prompt_token_usage()
+        recorder = get_prompt_token_recorder()
+        # Worker threads record with the recorder of the run that started them
+        with ThreadPoolExecutor(
+            max_workers=2,
+            initializer=set_prompt_token_recorder,
+            initargs=(recorder,),
+        ) as executor:
+            list(
+                executor.map(
+                    lambda _: record_prompt_tokens(name, name, "gpt-4", tokens),
+                    range(3),
+                )
+            )
+        usages[name] = prompt_token_usage()
+
+    runs = [
+        threading.Thread(target=run, args=("Summary", 10)),
+        threading.Thread(target=run, args=("Final rewrite", 20)),
+    ]
+    for thread in runs:
+        thread.start()
+    for thread in runs:
+        thread.join()
+
+    assert usages == {
+        "Summary": {"Summary": {"prompts": 3, "tokens": 30, "max_tokens": 10}},
+        "Final rewrite": {
+            "Final rewrite": {"prompts": 3, "tokens": 60, "max_tokens": 20}
+        },
+    }
@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+
+from tests.pdf_samples import make_pdf
+from utils import document_loader
+from utils.document_loader import load_document
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {"Content-Type": "application/pdf"}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeHttpClient:
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, headers=None):
+        return FakeResponse(), self.content
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    monkeypatch.setattr(document_loader, "get_web_cache", lambda: None)
+
+    def _serve(content):
+        monkeypatch.setattr(
+            document_loader, "get_http_client", lambda: FakeHttpClient(content)
+        )
+
+    return _serve
+
+
+@pytest.mark.parametrize(
+    "content",
+    [b"%PDF-1.4 not a pdf", make_pdf(3)[:-40]],
+    ids=["garbage", "truncated"],
+)
+def test_unreadable_pdfs_are_skipped_with_their_url(serve, caplog, content):
+    serve(content)
+
+    with caplog.at_level(logging.WARNING):
+        document = load_document("https://example.com/broken.pdf", kind="pdf")
+
+    assert document is None
+    assert "https://example.com/broken.pdf" in caplog.text
+
+
+def test_readable_pdfs_are_loaded(serve):
+    serve(make_pdf(2, words_per_page=20))
+
+    document = load_document("https://example.com/paper.pdf")
+
+    assert document.kind == "pdf"
+    assert len(document.text.split()) == 40
@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.embedding_cache import EmbeddingStore, get_embedding_store
+
+
+def test_one_store_is_shared_per_directory(tmp_path):
+    store = get_embedding_store(str(tmp_path), 2, 10)
+
+    assert get_embedding_store(str(tmp_path / "."), 2, 10) is store
+
+
+def test_writers_of_the_same_directory_never_share_rows(tmp_path):
+    # Two stores on one directory stand for two processes
+    stores = [EmbeddingStore(str(tmp_path), 2, 1000) for _ in range(2)]
+
+    def add(i):
+        stores[i % 2].add_many([str(i)], [[float(i), float(i)]])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add, range(200)))
+
+    keys = [str(i) for i in range(200)]
+    expected = [[float(i), float(i)] for i in range(200)]
+    assert stores[0].get_many(keys) == expected
+    assert stores[1].get_many(keys) == expected
+
+
+def test_readers_map_the_file_again_after_a_compaction(tmp_path):
+    reader = EmbeddingStore(str(tmp_path), 2, 100)
+    writer = EmbeddingStore(str(tmp_path), 2, 2)
+    writer.add_many(["a", "b"], [[1.0, 1.0], [2.0, 2.0]])
+    assert reader.get_many(["b"]) == [[2.0, 2.0]]
+
+    # Over max_vectors, the writer rewrites the file with the recent vectors
+    writer.add_many(["c"], [[3.0, 3.0]])
+
+    assert reader.get_many(["c"]) == [[3.0, 3.0]]
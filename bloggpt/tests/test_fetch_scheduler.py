@@ -0,0 +1,112 @@
+import threading
+import time
+
+from utils.fetch_scheduler import FetchReport, FetchScheduler
+
+
+def test_results_are_accepted_in_yield_order_by_the_consumer():
+    delays = {"a": 0.2, "b": 0.0, "c": 0.0, "d": 0.0}
+    accepted_in = []
+    seen = set()
+
+    def fetch(url):
+        time.sleep(delays[url])
+        # "b" and "c" are the same page, "a" finishes after both
+        return "page-bc" if url in ("b", "c") else f"page-{url}"
+
+    def accept(page):
+        accepted_in.append(threading.current_thread())
+        if page in seen:
+            return False
+        seen.add(page)
+        return True
+
+    report = FetchReport()
+    scheduler = FetchScheduler(
+        fetch, 3, 4, time_budget=None, hedge_after=None, report=report, accept=accept
+    )
+    results = list(scheduler.run(["a", "b", "c", "d"]))
+
+    assert results == ["page-a", "page-bc", "page-d"]
+    assert report.rejected == ["c"]
+    assert set(accepted_in) == {threading.current_thread()}
+
+
+def test_results_of_abandoned_fetches_are_not_accepted():
+    accepted = []
+
+    def fetch(url):
+        return url
+
+    def accept(page):
+        accepted.append(page)
+        return True
+
+    scheduler = FetchScheduler(
+        fetch, 1, 4, time_budget=None, hedge_after=None, accept=accept
+    )
+    results = list(scheduler.run(["a", "b", "c"]))
+
+    assert results == ["a"]
+    assert accepted == ["a"]
+
+
+def test_hedged_fetches_are_replaced_by_the_next_candidates():
+    delays = {"a": 3.0, "b": 3.0, "c": 0.1, "d": 0.1, "e": 0.1, "f": 0.1}
+    started = []
+    arrivals = []
+
+    def fetch(url):
+        started.append(url)
+        time.sleep(delays[url])
+        return url
+
+    report = FetchReport()
+    scheduler = FetchScheduler(
+        fetch, 2, 8, time_budget=None, hedge_after=0.5, report=report
+    )
+    start = time.monotonic()
+    for result in scheduler.run(delays):
+        arrivals.append((result, time.monotonic() - start))
+
+    assert [result for result, _ in arrivals] == ["c", "d"]
+    assert arrivals[-1][1] < 1.5
+    assert report.hedged == ["a", "b"]
+    assert "d" in started
+
+
+def test_worker_threads_run_the_thread_initializer():
+    local = threading.local()
+
+    def initialize():
+        local.name = "initialized"
+
+    scheduler = FetchScheduler(
+        lambda url: getattr(local, "name", None),
+        2,
+        2,
+        time_budget=None,
+        hedge_after=None,
+        thread_initializer=initialize,
+    )
+
+    assert list(scheduler.run(["a", "b"])) == ["initialized", "initialized"]
+
+
+def test_time_spent_by_the_consumer_does_not_count_against_the_budget():
+    def fetch(url):
+        time.sleep(0.1)
+        return url
+
+    report = FetchReport()
+    scheduler = FetchScheduler(
+        fetch, 3, 1, time_budget=0.5, hedge_after=None, report=report
+    )
+
+    results = []
+    for result in scheduler.run(["a", "b", "c"]):
+        results.append(result)
+        time.sleep(0.3)
+
+    assert results == ["a", "b", "c"]
+    assert not report.deadline_hit
@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.http_client import HttpClient, ResponseTooLarge
+
+
+class _Handler(BaseHTTPRequestHandler):
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            with _Handler.lock:
+                _Handler.active += 1
+                _Handler.max_active = max(_Handler.max_active, _Handler.active)
+            time.sleep(0.2)
+            with _Handler.lock:
+                _Handler.active -= 1
+            self._send(b"ok")
+        elif self.path == "/large":
+            self._send(b"x" * 2048)
+        elif self.path == "/large-chunked":
+            # No Content-Length, the limit has to be enforced while reading
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for _ in range(4):
+                self.wfile.write(b"x" * 512)
+            self.close_connection = True
+        else:
+            self._send(b"hello")
+
+    def _send(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_returns_status_headers_and_body(server_url):
+    response, content = HttpClient().get(f"{server_url}/")
+
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == "5"
+    assert content == b"hello"
+
+
+@pytest.mark.parametrize("path", ["/large", "/large-chunked"])
+def test_get_aborts_responses_over_the_size_limit(server_url, path):
+    client = HttpClient(max_response_bytes=1024)
+
+    with pytest.raises(ResponseTooLarge):
+        client.get(f"{server_url}{path}")
+
+
+def test_get_caps_requests_in_flight_per_host(server_url):
+    _Handler.max_active = 0
+    client = HttpClient(max_per_host=2, max_connections=8)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(
+            executor.map(lambda i: client.get(f"{server_url}/slow/{i}"), range(6))
+        )
+
+    assert [content for _, content in results] == [b"ok"] * 6
+    assert _Handler.max_active == 2
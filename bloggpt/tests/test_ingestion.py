@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from utils import ingestion
+from utils.ingestion import get_ingestion_embeddings, ingest_texts
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class FakeEmbeddings:
+    """Embeds texts, and rate limits requests of more than max_request texts."""
+
+    def __init__(self, max_request):
+        self.max_request = max_request
+        self.requests = []
+
+    def embed_documents(self, texts):
+        self.requests.append(len(texts))
+        if len(texts) > self.max_request:
+            raise RateLimitError()
+        return [[float(len(text))] for text in texts]
+
+
+def test_rate_limited_batches_are_split_and_retried(monkeypatch):
+    monkeypatch.setattr(ingestion, "EMBED_BACKOFF_SECONDS", 0)
+    embeddings = FakeEmbeddings(max_request=3)
+    upserted = []
+
+    stats = ingest_texts(
+        (f"text {i}" for i in range(10)),
+        embeddings,
+        lambda batch, vectors: upserted.extend(batch),
+        max_items=8,
+    )
+
+    assert upserted == [f"text {i}" for i in range(10)]
+    assert stats.rate_limited >= 1
+    assert embeddings.requests[0] == 8
+    assert embeddings.requests[1] == 4
+
+
+def test_ingestion_embeddings_send_each_batch_in_one_request_tried_once(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+    embeddings = get_ingestion_embeddings(max_items=500)
+
+    assert embeddings.chunk_size == 500
+    assert embeddings.max_retries == 1
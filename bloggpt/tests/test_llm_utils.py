@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import AIMessage, ChatGeneration, ChatResult, HumanMessage
+
+from utils import llm_utils
+from utils.llm_utils import LLM_CACHE_MAX_TEMPERATURE, CachedChatOpenAI
+
+
+def test_sampled_models_bypass_the_cache_by_default():
+    model = CachedChatOpenAI(
+        temperature=LLM_CACHE_MAX_TEMPERATURE + 0.5, openai_api_key="test"
+    )
+
+    assert model._cache_bypassed()
+
+
+def test_sampled_models_can_opt_in_to_the_cache():
+    model = CachedChatOpenAI(
+        temperature=LLM_CACHE_MAX_TEMPERATURE + 0.5,
+        openai_api_key="test",
+        bypass_cache=False,
+    )
+
+    assert not model._cache_bypassed()
+
+
+def test_api_calls_are_capped_across_threads(monkeypatch):
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def fake_generate(self, messages, stop=None, *args, **kwargs):
+        nonlocal active, max_active
+        with lock:
+            active += 1
+            max_active = max(max_active, active)
+        time.sleep(0.05)
+        with lock:
+            active -= 1
+        return None
+
+    monkeypatch.setattr(ChatOpenAI, "_generate", fake_generate)
+    monkeypatch.setattr(llm_utils, "_llm_slots", threading.BoundedSemaphore(2))
+    model = CachedChatOpenAI(openai_api_key="test", bypass_cache=True)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(
+            executor.map(
+                lambda _: model._generate([HumanMessage(content="hi")]), range(8)
+            )
+        )
+
+    assert max_active == 2
+
+
+class DictCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+class TokenRecorder:
+    def __init__(self):
+        self.tokens = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+
+
+def test_cache_hits_are_streamed_to_the_callbacks(monkeypatch):
+    api_calls = []
+
+    def fake_generate(self, messages, stop=None, run_manager=None, **kwargs):
+        api_calls.append(messages)
+        run_manager.on_llm_new_token("A cached answer")
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content="A cached answer"))]
+        )
+
+    monkeypatch.setattr(ChatOpenAI, "_generate", fake_generate)
+    cache = DictCache()
+    monkeypatch.setattr(llm_utils, "get_llm_cache", lambda: cache)
+    model = CachedChatOpenAI(openai_api_key="test", temperature=0, streaming=True)
+    messages = [HumanMessage(content="hi")]
+
+    model._generate(messages, run_manager=TokenRecorder())
+    replayed = TokenRecorder()
+    result = model._generate(messages, run_manager=replayed)
+
+    assert len(api_calls) == 1
+    assert result.llm_output["cached"]
+    assert replayed.tokens == ["A cached answer"]
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("langchain")
+
+from utils.logging_utils import StreamlitTokenHandler
+
+
+class Placeholder:
+    def __init__(self):
+        self.shown = []
+
+    def markdown(self, text):
+        self.shown.append(text)
+
+
+def stream(handler, tokens):
+    handler.on_llm_start({}, [])
+    for token in tokens:
+        handler.on_llm_new_token(token)
+    handler.on_llm_end(None)
+
+
+def test_only_the_final_answer_of_an_agent_is_shown():
+    placeholder = Placeholder()
+    handler = StreamlitTokenHandler(placeholder, answer_prefix="Final Answer:")
+
+    stream(handler, ["Thought: search\n", "Action: search\n", "Action Input: x"])
+    stream(handler, ["Thought: done\n", "Final", " Answer", ":", " The", " blog"])
+
+    assert placeholder.shown[-1] == "The blog"
+    assert not any("Action" in text or "Thought" in text for text in placeholder.shown)
+
+
+def test_without_a_prefix_the_whole_output_is_shown():
+    placeholder = Placeholder()
+    handler = StreamlitTokenHandler(placeholder)
+
+    stream(handler, ["The", " blog"])
+
+    assert placeholder.shown == ["The▌", "The blog▌", "The blog"]
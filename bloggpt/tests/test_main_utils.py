@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("langchain")
+
+from utils import main_utils
+from utils.main_utils import write_file_atomically
+from utils.token_utils import split_text_by_tokens
+
+
+def test_write_file_atomically_replaces_the_file(tmp_path):
+    filename = tmp_path / "blog.md"
+    filename.write_text("old")
+
+    write_file_atomically(str(filename), "new")
+
+    assert filename.read_text() == "new"
+    assert os.listdir(tmp_path) == ["blog.md"]
+
+
+def test_concurrent_writers_do_not_share_a_temporary_file(tmp_path):
+    filename = str(tmp_path / "blog.md")
+    texts = [str(i) * 100_000 for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda text: write_file_atomically(filename, text), texts))
+
+    assert open(filename).read() in texts
+    assert os.listdir(tmp_path) == ["blog.md"]
+
+
+def test_long_texts_are_summarized_by_chunk_then_reduced(monkeypatch):
+    text = " ".join(f"word{i}" for i in range(40_000))
+    chunks = split_text_by_tokens(text, 2000, main_utils.SUMMARY_MODEL)
+    calls = []
+
+    def run_summary_chain(text, prompt=main_utils.SUMMARIZE_PROMPT):
+        calls.append((text, prompt))
+        if prompt == main_utils.SUMMARIZE_REDUCE_PROMPT:
+            return "final summary"
+        return f"summary {chunks.index(text)}"
+
+    monkeypatch.setattr(main_utils, "run_summary_chain", run_summary_chain)
+    monkeypatch.setattr(main_utils, "SUMMARY_CHUNK_TOKENS", 2000)
+    monkeypatch.setattr(main_utils, "SUMMARY_MAX_CHUNKS", 3)
+
+    summary = main_utils.summarize_text(text)
+
+    prompts = [prompt for _, prompt in calls]
+    assert summary == "final summary"
+    # Only the first SUMMARY_MAX_CHUNKS chunks are summarized, then reduced once
+    assert len(chunks) > 3
+    assert sorted(text for text, _ in calls[:3]) == sorted(chunks[:3])
+    assert prompts == [main_utils.SUMMARIZE_PROMPT] * 3 + [
+        main_utils.SUMMARIZE_REDUCE_PROMPT
+    ]
+    assert calls[3][0] == "summary 0\n\nsummary 1\n\nsummary 2"
+
+
+def test_texts_that_fit_are_summarized_in_one_call(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        main_utils,
+        "run_summary_chain",
+        lambda text, prompt=main_utils.SUMMARIZE_PROMPT: calls.append(text)
+        or "summary",
+    )
+
+    assert main_utils.summarize_text("word " * 5000) == "summary"
+    assert len(calls) == 1
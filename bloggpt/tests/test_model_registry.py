@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from utils.model_registry import get_task_profile, route_task
+
+
+def test_rqna_drafts_keep_the_default_sampling_temperature():
+    profile = route_task("rqna_section_draft", 1000)
+
+    assert profile.temperature == 0.7
+    assert profile.model_name == get_task_profile("section_draft").model_name
+
+
+def test_agent_drafts_are_deterministic():
+    assert route_task("section_draft", 1000).temperature == 0.0
@@ -0,0 +1,37 @@
+from io import BytesIO
+
+import PyPDF2
+import pytest
+
+from tests.pdf_samples import make_pdf
+from utils import pdf_extraction
+from utils.pdf_extraction import extract_pdf_text
+
+
+@pytest.fixture
+def small_parallel_threshold(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "PDF_WORKERS", 2)
+    monkeypatch.setattr(pdf_extraction, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(pdf_extraction, "PDF_PAGES_PER_TASK", 3)
+    yield
+    if pdf_extraction._pool is not None:
+        pdf_extraction._pool.shutdown()
+        pdf_extraction._pool = None
+
+
+def test_stops_at_the_word_budget():
+    text = extract_pdf_text(make_pdf(10, words_per_page=100), max_words=250)
+
+    assert len(text.split()) == 300
+
+
+def test_pages_after_the_threshold_are_extracted_on_the_pool_in_order(
+    small_parallel_threshold,
+):
+    content = make_pdf(12, words_per_page=50)
+    sequential = "\n".join(
+        page.extract_text((0, 90)) for page in PyPDF2.PdfReader(BytesIO(content)).pages
+    )
+
+    assert extract_pdf_text(content, max_words=0) == sequential
+    assert len(extract_pdf_text(content, max_words=325).split()) == 350
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.docstore.document import Document
+
+from utils.retrieval import BatchedRetriever
+
+
+def make_search(fail_first=False):
+    calls = []
+
+    def search(vectors, namespaces, k, score_threshold):
+        calls.append(list(namespaces))
+        if fail_first and len(calls) == 1:
+            raise ConnectionError("index unavailable")
+        return [[(Document(page_content=namespace), 1.0)] for namespace in namespaces]
+
+    return search, calls
+
+
+def test_sections_stay_pending_when_the_search_fails():
+    search, calls = make_search(fail_first=True)
+    retriever = BatchedRetriever(search, coalesce_seconds=0)
+    retriever.add(0, "query 0", [1.0], "a")
+    retriever.add(1, "query 1", [1.0], "b")
+
+    with pytest.raises(ConnectionError):
+        retriever.get(0)
+
+    assert retriever.get(1).context == "b"
+    assert retriever.get(0).context == "a"
+    assert calls == [["a", "b"], ["a", "b"]]
+
+
+def test_get_of_a_section_that_was_not_added_raises_key_error():
+    search, _ = make_search()
+    retriever = BatchedRetriever(search, coalesce_seconds=0)
+
+    with pytest.raises(KeyError):
+        retriever.get(0)
+
+
+def test_sections_added_within_the_coalescing_delay_share_a_search():
+    search, calls = make_search()
+    retriever = BatchedRetriever(search, coalesce_seconds=0.2)
+    packs = {}
+
+    def add_and_get(key):
+        retriever.add(key, f"query {key}", [1.0], str(key))
+        packs[key] = retriever.get(key)
+
+    threads = [threading.Thread(target=add_and_get, args=(key,)) for key in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert retriever.batches == 1
+    assert len(calls) == 1
+    assert {key: pack.context for key, pack in packs.items()} == {
+        0: "0",
+        1: "1",
+        2: "2",
+    }
@@ -0,0 +1,21 @@
+from utils.text_extraction import html_to_text
+
+
+def test_keeps_the_content_of_a_page_wrapped_in_a_form():
+    html = (
+        '<html><body><form runat="server"><article>'
+        "<p>Watermelon ripeness tips here.</p>"
+        "</article></form></body></html>"
+    )
+
+    assert html_to_text(html) == "Watermelon ripeness tips here."
+
+
+def test_drops_form_controls_and_non_content_elements():
+    html = (
+        "<html><body><nav>Home</nav><form><p>Pick a heavy melon.</p>"
+        "<select><option>Small</option></select><textarea>Comment</textarea>"
+        "<input value='Search'></form><script>var x;</script></body></html>"
+    )
+
+    assert html_to_text(html) == "Pick a heavy melon."
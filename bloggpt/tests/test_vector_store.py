@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain")
+
+from utils.vector_store import LocalVectorStore, _Namespace
+
+
+def test_add_appends_rows_without_rewriting_the_file(tmp_path):
+    namespace = _Namespace(str(tmp_path))
+    namespace.add(np.eye(3, dtype=np.float32)[:2], [{"text": "a"}, {"text": "b"}])
+    vectors_path = os.path.join(str(tmp_path), "vectors.f32")
+    inode = os.stat(vectors_path).st_ino
+
+    namespace.add(np.eye(3, dtype=np.float32)[2:], [{"text": "c"}])
+
+    assert os.stat(vectors_path).st_ino == inode
+    assert os.path.getsize(vectors_path) == 3 * 3 * 4
+    np.testing.assert_array_equal(namespace.vectors, np.eye(3))
+
+
+def test_reload_ignores_rows_of_an_interrupted_add(tmp_path):
+    namespace = _Namespace(str(tmp_path))
+    namespace.add(np.eye(2, dtype=np.float32), [{"text": "a"}, {"text": "b"}])
+    with open(namespace.vectors_path, "ab") as f:
+        f.write(np.ones(2, dtype=np.float32).tobytes())
+
+    reloaded = _Namespace(str(tmp_path))
+    assert len(reloaded) == 2
+    reloaded.add(np.zeros((1, 2), dtype=np.float32), [{"text": "c"}])
+
+    assert len(_Namespace(str(tmp_path))) == 3
+    np.testing.assert_array_equal(reloaded.vectors[2], [0, 0])
+
+
+def test_a_missing_vectors_file_leaves_an_empty_namespace(tmp_path):
+    namespace = _Namespace(str(tmp_path))
+    namespace.add(np.eye(2, dtype=np.float32), [{"text": "a"}, {"text": "b"}])
+    os.remove(namespace.vectors_path)
+
+    reloaded = _Namespace(str(tmp_path))
+    assert len(reloaded) == 0
+    reloaded.add(np.eye(2, dtype=np.float32)[1:], [{"text": "c"}])
+
+    reloaded = _Namespace(str(tmp_path))
+    assert reloaded.docs == [{"text": "c"}]
+    np.testing.assert_array_equal(reloaded.vectors, [[0, 1]])
+
+
+def test_snapshots_are_not_changed_by_later_adds(tmp_path):
+    namespace = _Namespace(str(tmp_path))
+    namespace.add(np.eye(2, dtype=np.float32)[:1], [{"text": "a"}])
+    vectors, docs = namespace.snapshot()
+
+    namespace.add(np.eye(2, dtype=np.float32)[1:], [{"text": "b"}])
+
+    assert docs == [{"text": "a"}]
+    assert vectors.shape == (1, 2)
+    assert [i for i, _ in namespace.search(vectors, np.eye(2), k=2)[1]] == [0]
+
+
+def test_search_finds_texts_added_in_several_calls(tmp_path):
+    store = LocalVectorStore(embedding=None, persist_directory=str(tmp_path))
+    store.add_texts(["x"], embeddings=[[1.0, 0.0]])
+    store.add_texts(["y"], embeddings=[[0.0, 1.0]])
+
+    reloaded = LocalVectorStore(embedding=None, persist_directory=str(tmp_path))
+    results = reloaded.similarity_search_by_vector_with_score([0.1, 1.0], k=1)
+
+    assert [doc.page_content for doc, _ in results] == ["y"]
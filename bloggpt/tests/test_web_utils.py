@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("langchain")
+
+from utils import web_utils
+
+PAGES = {
+    f"https://example.com/{i}": f"watermelon ripe page {i} " + "filler " * (40 - i)
+    for i in range(8)
+}
+
+
+@pytest.fixture
+def fake_web(monkeypatch):
+    monkeypatch.setattr(web_utils, "iter_search_urls", lambda query, report: PAGES)
+    monkeypatch.setattr(web_utils, "get_website_page_text", PAGES.get)
+    monkeypatch.setattr(web_utils, "make_deduplicator", lambda model_name: None)
+
+
+def test_a_failed_summary_is_replaced_by_the_next_ranked_page(fake_web, monkeypatch):
+    summarized = []
+
+    def summarize_text(text):
+        page = text.split()[3]
+        summarized.append(page)
+        # The most relevant page, the shortest, cannot be summarized
+        return None if page == "7" else f"summary {page}"
+
+    monkeypatch.setattr(web_utils, "summarize_text", summarize_text)
+
+    result = web_utils.search_and_summarize_web_url.func("ripe watermelon")
+
+    assert result.split("\n\n")[:-1] == [f"summary {page}" for page in "6543"]
+    assert sorted(summarized) == ["3", "4", "5", "6", "7"]
+
+
+def test_long_pages_reach_the_summarizer_whole(fake_web, monkeypatch):
+    long_page = "ripe watermelon " * 3000
+    monkeypatch.setattr(web_utils, "get_website_page_text", lambda url: long_page)
+    lengths = []
+    monkeypatch.setattr(
+        web_utils, "summarize_text", lambda text: lengths.append(len(text.split()))
+    )
+
+    web_utils.search_and_summarize_web_url.func("ripe watermelon")
+
+    assert set(lengths) == {6000}
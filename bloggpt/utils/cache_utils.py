@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Directory holding all the persistent caches
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+
+
+class DiskLRUCache:
+    """
+    A persistent key-value cache stored in a SQLite file.
+
+    Values are JSON-serializable objects. Every entry records when it was
+    stored and when it was last read, and the least recently read entries are
+    evicted once the encoded values take more than max_bytes. The cache can be
+    shared between threads and between processes.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+            )
+
+    def get_with_age(self, key: str) -> Tuple[Optional[Any], Optional[float]]:
+        """
+        Read an entry and mark it as recently used.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The value and the number of seconds since it was stored, or
+            (None, None) if the key is not in the cache.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, None
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return json.loads(row[0]), now - row[1]
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Optional[Any]:
+        """
+        Read an entry that is younger than ttl seconds.
+
+        Args:
+            key: The key of the entry.
+            ttl: The maximum age of the entry in seconds, None for no limit.
+
+        Returns:
+            The value, or None if the key is missing or the entry expired.
+        """
+        value, age = self.get_with_age(key)
+        if value is not None and ttl is not None and age > ttl:
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store an entry and evict the least recently used ones if needed.
+
+        Args:
+            key: The key of the entry.
+            value: A JSON-serializable value.
+        """
+        encoded = json.dumps(value)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, len(encoded), now, now),
+            )
+            self._evict()
+
+    def touch(self, key: str) -> None:
+        """
+        Reset the age of an entry, e.g. after it was revalidated.
+
+        Args:
+            key: The key of the entry.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+
+    def _evict(self) -> None:
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the hit, miss and eviction counts and the size of the cache.
+
+        Returns:
+            A dict with the cache statistics.
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+            }
@@ -0,0 +1,394 @@
+"""
+Token budgets of the prompts sent to the LLMs.
+
+A prompt is a fixed template plus context pieces: web summaries, retrieved
+chunks or section drafts. Its budget is the context window of the model, minus
+the tokens reserved for the completion and the tokens of the template. Context
+pieces are packed into the budget by priority, and passages that overlap a
+piece already packed are trimmed or dropped, so prompts neither overflow the
+window nor get padded with low-value context. The tokens of the prompts sent
+during a run are totalled per kind of prompt.
+"""
+import logging
+import os
+import re
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from dotenv import load_dotenv
+
+from utils.token_utils import count_tokens, truncate_to_tokens
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Tokens kept free for the completion of a prompt
+COMPLETION_RESERVE_TOKENS = int(os.getenv("COMPLETION_RESERVE_TOKENS", "1500"))
+# Maximum tokens of context in the prompt of a blog section
+SECTION_CONTEXT_TOKENS = int(os.getenv("SECTION_CONTEXT_TOKENS", "2500"))
+# Tokens kept free for the final blog, which is as long as the draft
+REWRITE_RESERVE_TOKENS = int(os.getenv("REWRITE_RESERVE_TOKENS", "4000"))
+# A piece is dropped when this fraction of its words is already in the context
+CONTEXT_DEDUP_CONTAINMENT = float(os.getenv("CONTEXT_DEDUP_CONTAINMENT", "0.6"))
+# Number of words of the shingles that detect overlapping passages
+CONTEXT_DEDUP_SHINGLE_WORDS = 8
+# A piece that does not fit is only truncated if this many tokens are left
+MIN_PIECE_TOKENS = 64
+# Tokens added by the chat format around the messages of a prompt
+PROMPT_OVERHEAD_TOKENS = 16
+
+CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-0613": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-32k-0613": 32768,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-0613": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo-16k-0613": 16384,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+
+def get_context_window(model_name: str) -> int:
+    """
+    Get the number of tokens of the context window of a model.
+
+    Args:
+        model_name: The name of the model.
+
+    Returns:
+        The context window, DEFAULT_CONTEXT_WINDOW for unknown models.
+    """
+    return CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
+
+
+@dataclass
+class ContextPiece:
+    """A piece of context and its priority, higher is packed first."""
+
+    text: str
+    priority: float = 0.0
+
+
+@dataclass
+class PackedContext:
+    """The context pieces that fit in a budget."""
+
+    texts: List[str] = field(default_factory=list)
+    separator: str = "\n"
+    tokens: int = 0
+    # Pieces left out because they did not fit, or overlapped the packed ones
+    dropped: int = 0
+    duplicates: int = 0
+    truncated: int = 0
+
+    @property
+    def text(self) -> str:
+        return self.separator.join(self.texts)
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.texts)} pieces in {self.tokens} tokens, {self.dropped} "
+            f"dropped, {self.duplicates} duplicates, {self.truncated} truncated"
+        )
+
+
+# The end of a sentence, after its closing quotes or brackets, or of a line
+_SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*(?=\s|$)|\n")
+
+
+def _cut_at_boundary(text: str, min_length: int) -> str:
+    """Cut a truncated text after its last paragraph or sentence, if far enough."""
+    paragraph_end = text.rfind("\n\n")
+    if paragraph_end >= min_length:
+        return text[:paragraph_end]
+    sentence_ends = [match.end() for match in _SENTENCE_END_RE.finditer(text)]
+    if sentence_ends and sentence_ends[-1] >= min_length:
+        return text[: sentence_ends[-1]].rstrip()
+    return text
+
+
+def _shingles(words: Sequence[str], size: int) -> List[Tuple[str, ...]]:
+    return [tuple(words[i : i + size]) for i in range(len(words) - size + 1)]
+
+
+def _remove_overlap(
+    text: str, seen: Set[Tuple[str, ...]], containment: float, size: int
+) -> Optional[str]:
+    """Trim the words of a text at its ends that are already in seen shingles."""
+    words = text.split()
+    lowered = [word.lower() for word in words]
+    covered = [False] * len(words)
+    for i, shingle in enumerate(_shingles(lowered, size)):
+        if shingle in seen:
+            covered[i : i + size] = [True] * size
+    num_covered = sum(covered)
+    if num_covered == 0:
+        return text
+    if num_covered >= containment * len(words):
+        return None
+
+    # Overlapping windows share their ends, an overlap in the middle is kept
+    start, end = 0, len(words)
+    while covered[start]:
+        start += 1
+    while covered[end - 1]:
+        end -= 1
+    if start == 0 and end == len(words):
+        return text
+    return " ".join(words[start:end])
+
+
+class TokenBudget:
+    """
+    The tokens a prompt of a model can use, and the packing of context into them.
+
+    Args:
+        model_name: The name of the model the prompt is sent to.
+        reserve_tokens: The tokens kept free for the completion.
+        context_window: The context window, by default the one of the model.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        reserve_tokens: int = COMPLETION_RESERVE_TOKENS,
+        context_window: Optional[int] = None,
+    ):
+        self.model_name = model_name
+        self.reserve_tokens = reserve_tokens
+        self.context_window = context_window or get_context_window(model_name)
+
+    def count(self, text: str) -> int:
+        """Count the tokens of a text with the tokenizer of the model."""
+        return count_tokens(text, self.model_name) if text else 0
+
+    def remaining(self, *fixed_texts: str) -> int:
+        """
+        Get the tokens left for context once the fixed parts of a prompt are counted.
+
+        Args:
+            fixed_texts: The parts of the prompt that are always sent, e.g. the
+                template filled without its context.
+
+        Returns:
+            The number of tokens left, at least 0.
+        """
+        used = sum(self.count(text) for text in fixed_texts)
+        available = self.context_window - self.reserve_tokens - PROMPT_OVERHEAD_TOKENS
+        return max(0, available - used)
+
+    def pack(
+        self,
+        pieces: Sequence[ContextPiece],
+        max_tokens: int,
+        separator: str = "\n",
+        keep_order: bool = False,
+        containment: float = CONTEXT_DEDUP_CONTAINMENT,
+    ) -> PackedContext:
+        """
+        Pack the pieces of highest priority into max_tokens tokens.
+
+        Pieces are taken by decreasing priority, ties in their original order.
+        The ends of a piece that overlap the pieces already packed are trimmed,
+        and a piece mostly made of such overlaps is dropped. The piece that
+        does not fit is truncated to the tokens left, if there are enough.
+
+        Args:
+            pieces: The context pieces.
+            max_tokens: The maximum number of tokens of the packed context.
+            separator: The separator between two pieces.
+            keep_order: Whether the packed pieces keep their original order,
+                instead of the priority order.
+            containment: The fraction of words already packed above which a
+                piece is dropped, 1 or more to not deduplicate.
+
+        Returns:
+            The packed context.
+        """
+        packed = PackedContext(separator=separator)
+        separator_tokens = self.count(separator)
+        seen: Set[Tuple[str, ...]] = set()
+        selected: Dict[int, str] = {}
+        order = sorted(range(len(pieces)), key=lambda i: -pieces[i].priority)
+        for i in order:
+            text = pieces[i].text
+            if containment < 1:
+                text = _remove_overlap(
+                    text, seen, containment, CONTEXT_DEDUP_SHINGLE_WORDS
+                )
+                if text is None:
+                    packed.duplicates += 1
+                    continue
+            gap = separator_tokens if selected else 0
+            tokens = self.count(text)
+            if packed.tokens + gap + tokens > max_tokens:
+                room = max_tokens - packed.tokens - gap
+                if room < MIN_PIECE_TOKENS:
+                    packed.dropped += 1
+                    continue
+                text = truncate_to_tokens(text, room, self.model_name)
+                tokens = self.count(text)
+                packed.truncated += 1
+            selected[i] = text
+            packed.tokens += gap + tokens
+            if containment < 1:
+                lowered = [word.lower() for word in text.split()]
+                seen.update(_shingles(lowered, CONTEXT_DEDUP_SHINGLE_WORDS))
+
+        indices = sorted(selected) if keep_order else list(selected)
+        packed.texts = [selected[i] for i in indices]
+        return packed
+
+    def share(
+        self, texts: Sequence[str], max_tokens: int, separator: str = "\n\n"
+    ) -> PackedContext:
+        """
+        Fit texts of equal priority into max_tokens tokens, in their original order.
+
+        Texts that fit in an equal share of the budget are kept whole, and the
+        tokens they leave are shared by the longer texts, which are truncated
+        after their last paragraph or sentence that fits, when that keeps at
+        least half of their share.
+
+        Args:
+            texts: The texts, e.g. the sections of a draft.
+            max_tokens: The maximum number of tokens of the packed context.
+            separator: The separator between two texts.
+
+        Returns:
+            The packed context.
+        """
+        packed = PackedContext(separator=separator)
+        if not texts:
+            return packed
+        counts = [self.count(text) for text in texts]
+        separators = self.count(separator) * (len(texts) - 1)
+        if sum(counts) + separators <= max_tokens:
+            packed.texts = list(texts)
+            packed.tokens = sum(counts) + separators
+            return packed
+
+        # Give every text an equal share, from the shortest to the longest
+        allocation = [0] * len(texts)
+        available = max(0, max_tokens - separators)
+        order = sorted(range(len(texts)), key=counts.__getitem__)
+        for position, i in enumerate(order):
+            allocation[i] = min(counts[i], available // (len(texts) - position))
+            available -= allocation[i]
+
+        for i, text in enumerate(texts):
+            if allocation[i] >= counts[i]:
+                packed.texts.append(text)
+                packed.tokens += counts[i]
+            elif allocation[i] >= MIN_PIECE_TOKENS:
+                text = truncate_to_tokens(text, allocation[i], self.model_name)
+                text = _cut_at_boundary(text, len(text) // 2)
+                packed.texts.append(text)
+                packed.tokens += self.count(text)
+                packed.truncated += 1
+            else:
+                packed.dropped += 1
+        packed.tokens += self.count(separator) * max(0, len(packed.texts) - 1)
+        return packed
+
+
+class PromptTokenRecorder:
+    """
+    The number of prompts and of tokens of each kind of prompt sent during a run.
+
+    Only the totals are kept, so the recorder stays small however many prompts
+    a run sends.
+    """
+
+    def __init__(self):
+        self._usage: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, tokens: int) -> None:
+        """Add a prompt of tokens tokens to the totals of its kind."""
+        with self._lock:
+            usage = self._usage.setdefault(
+                name, {"prompts": 0, "tokens": 0, "max_tokens": 0}
+            )
+            usage["prompts"] += 1
+            usage["tokens"] += tokens
+            usage["max_tokens"] = max(usage["max_tokens"], tokens)
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """Get a copy of the totals of each kind of prompt."""
+        with self._lock:
+            return {name: dict(usage) for name, usage in self._usage.items()}
+
+    def reset(self) -> None:
+        """Forget the prompts recorded so far."""
+        with self._lock:
+            self._usage = {}
+
+
+# The prompts of the current run. Each run (e.g. each Streamlit session) sets
+# its own recorder, which its worker threads set again with
+# set_prompt_token_recorder, since threads do not inherit context variables
+_prompt_tokens: ContextVar[Optional[PromptTokenRecorder]] = ContextVar(
+    "prompt_tokens", default=None
+)
+
+
+def get_prompt_token_recorder() -> Optional[PromptTokenRecorder]:
+    """Get the recorder of the prompts of the current run, if a run started."""
+    return _prompt_tokens.get()
+
+
+def set_prompt_token_recorder(recorder: Optional[PromptTokenRecorder]) -> None:
+    """Record the prompts sent from the current thread with a run's recorder."""
+    _prompt_tokens.set(recorder)
+
+
+def record_prompt_tokens(
+    name: str, prompt: str, model_name: str, tokens: Optional[int] = None
+) -> int:
+    """
+    Count and record the tokens of a prompt that is sent to a model.
+
+    Args:
+        name: The kind of prompt, e.g. "Section draft".
+        prompt: The full prompt.
+        model_name: The name of the model.
+        tokens: The number of tokens of the prompt, if already counted.
+
+    Returns:
+        The number of tokens of the prompt.
+    """
+    if tokens is None:
+        tokens = count_tokens(prompt, model_name)
+    recorder = _prompt_tokens.get()
+    if recorder is not None:
+        recorder.record(name, tokens)
+    logging.info(
+        "%s prompt: %d tokens of the %d of %s",
+        name,
+        tokens,
+        get_context_window(model_name),
+        model_name,
+    )
+    return tokens
+
+
+def prompt_token_usage() -> Dict[str, Dict[str, int]]:
+    """
+    Get the number of prompts and of tokens recorded for each kind of prompt.
+
+    Returns:
+        A dict with the count, the total and the largest number of tokens of the
+        prompts of each kind, since the current run started.
+    """
+    recorder = _prompt_tokens.get()
+    return recorder.usage() if recorder is not None else {}
+
+
+def reset_prompt_token_usage() -> None:
+    """Record the prompts of a new run, started in the current context."""
+    _prompt_tokens.set(PromptTokenRecorder())
@@ -0,0 +1,192 @@
+"""
+Near-duplicate detection for scraped pages and corpus chunks.
+
+Texts are compared by the Jaccard similarity of their word shingles, estimated
+with MinHash signatures. Signatures are bucketed with locality-sensitive
+hashing (LSH), so every new text is only compared with the few texts that
+share a bucket with it instead of with every text seen so far.
+"""
+import os
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.token_utils import count_tokens
+
+# Load environment variables from .env file
+load_dotenv()
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+# Texts whose estimated Jaccard similarity reaches this threshold are duplicates
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"\w+")
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Choose the LSH bands and rows per band for a similarity threshold.
+
+    Two texts share a bucket with probability 1 - (1 - s^rows)^bands, which
+    rises steeply around (1 / bands)^(1 / rows). That point is kept below the
+    threshold, so that few duplicates are missed, since candidates are
+    verified with their full signatures anyway.
+
+    Args:
+        threshold: The Jaccard similarity threshold.
+        num_perm: The number of MinHash permutations.
+
+    Returns:
+        The number of bands and the number of rows per band.
+    """
+
+    def steepest_point(band: Tuple[int, int]) -> float:
+        return (1 / band[0]) ** (1 / band[1])
+
+    candidates = [
+        (num_perm // rows, rows)
+        for rows in range(1, num_perm + 1)
+        if not num_perm % rows
+    ]
+    below = [band for band in candidates if steepest_point(band) <= threshold]
+    if not below:
+        return min(candidates, key=steepest_point)
+    return max(below, key=steepest_point)
+
+
+class MinHashDeduplicator:
+    """
+    Keeps the first of every group of near-duplicate texts it is given.
+
+    The deduplicator is stateful and thread-safe: texts are compared with all
+    the texts kept before, including the ones kept by other threads.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_perm: int = DEDUP_NUM_PERM,
+        shingle_words: int = DEDUP_SHINGLE_WORDS,
+        model_name: str = "gpt-3.5-turbo",
+    ):
+        self.threshold = threshold
+        self.shingle_words = shingle_words
+        self.model_name = model_name
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.num_perm = self.bands * self.rows
+
+        # The same permutations in every process, so signatures are comparable
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, _MERSENNE_PRIME, self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, self.num_perm, dtype=np.uint64)
+
+        self._signatures: List[np.ndarray] = []
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+        self.kept = 0
+        self.removed = 0
+        self.tokens_removed = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Compute the MinHash signature of a text.
+
+        Args:
+            text: The text.
+
+        Returns:
+            The minimum hash of the text's shingles under each permutation.
+        """
+        words = _WORD_RE.findall(text.lower())
+        n = self.shingle_words
+        shingles = {
+            " ".join(words[i : i + n]) for i in range(max(1, len(words) - n + 1))
+        }
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # Wrapping uint64 arithmetic is part of the hash family
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def is_duplicate(self, text: str) -> bool:
+        """
+        Check whether a text is a near-duplicate of a kept text, and keep it if not.
+
+        Args:
+            text: The text to check.
+
+        Returns:
+            True if the text should be dropped.
+        """
+        if not text.strip():
+            return False
+        signature = self.signature(text)
+        keys = self._band_keys(signature)
+        with self._lock:
+            candidates = {
+                i
+                for band, key in enumerate(keys)
+                for i in self._buckets[band].get(key, ())
+            }
+            for i in candidates:
+                similarity = np.mean(self._signatures[i] == signature)
+                if similarity >= self.threshold:
+                    self.removed += 1
+                    self.tokens_removed += count_tokens(text, self.model_name)
+                    return True
+
+            index = len(self._signatures)
+            self._signatures.append(signature)
+            for band, key in enumerate(keys):
+                self._buckets[band].setdefault(key, []).append(index)
+            self.kept += 1
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the number of texts kept and removed and the tokens removed.
+
+        Returns:
+            A dict with the deduplication statistics.
+        """
+        with self._lock:
+            return {
+                "kept": self.kept,
+                "removed": self.removed,
+                "tokens_removed": self.tokens_removed,
+            }
+
+
+def make_deduplicator(
+    model_name: str = "gpt-3.5-turbo",
+) -> Optional[MinHashDeduplicator]:
+    """
+    Create a deduplicator with the configured threshold, if deduplication is enabled.
+
+    Args:
+        model_name: The model whose tokenizer counts the removed tokens.
+
+    Returns:
+        A new deduplicator, or None if deduplication is disabled.
+    """
+    if not DEDUP_ENABLED:
+        return None
+    return MinHashDeduplicator(DEDUP_THRESHOLD, model_name=model_name)
@@ -0,0 +1,234 @@
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import PyPDF2
+
+from utils import pdf_extraction
+from utils.http_client import get_http_client
+from utils.text_extraction import decode_content, html_to_text, normalize_whitespace
+from utils.web_cache import get_web_cache
+
+PDF_MAGIC = b"%PDF-"
+# Errors raised by PyPDF2 for broken, truncated or encrypted PDFs. Some malformed
+# objects surface as plain lookup and value errors
+PDF_ERRORS = (
+    PyPDF2.errors.PyPdfError,
+    PyPDF2.errors.DependencyError,
+    ValueError,
+    KeyError,
+    IndexError,
+    TypeError,
+)
+
+
+@dataclass
+class WebDocument:
+    """A document fetched from the web and converted to text."""
+
+    url: str
+    text: str
+    # One of "html", "pdf" or "text"
+    kind: str
+    content_type: str
+    byte_size: int
+    fetch_seconds: float
+    extract_seconds: float
+    from_cache: bool = False
+
+
+def clean_text(text):
+    """
+    This function takes a text string as input and returns a cleaned version of the text that is more suitable for a language model.
+
+    Parameters:
+    text (str): The text to clean.
+
+    Returns:
+    str: The cleaned text.
+    """
+    # Remove leading and trailing whitespace
+    text = text.strip()
+    # Replace multiple whitespace characters with a single space
+    text = re.sub(r"\s+", " ", text)
+    # Replace multiple new lines with a single new line
+    text = re.sub(r"\n+", "\n", text)
+    return text
+
+
+def detect_kind(content, content_type):
+    """
+    This function picks the extractor for a response from its content type and magic bytes.
+
+    Parameters:
+    content (bytes): The body of the response.
+    content_type (str): The Content-Type header of the response.
+
+    Returns:
+    str: One of "html", "pdf" or "text".
+    """
+    content_type = content_type.lower()
+    if "application/pdf" in content_type or content.startswith(PDF_MAGIC):
+        return "pdf"
+    if "text/plain" in content_type:
+        return "text"
+    return "html"
+
+
+def extract_pdf_text(content, content_type=""):
+    """
+    This function extracts the text content of a PDF file, up to the PDF word budget.
+
+    Parameters:
+    content (bytes): The bytes of the PDF file.
+    content_type (str): The Content-Type header of the response.
+
+    Returns:
+    str: The text content of the PDF file, or None if it could not be read.
+    """
+    try:
+        return pdf_extraction.extract_pdf_text(content)
+    except PDF_ERRORS as e:
+        logging.warning(f"Could not read the PDF: {type(e).__name__}: {e}")
+        return None
+
+
+def extract_html_text(content, content_type=""):
+    """
+    This function extracts the text content of an HTML page.
+
+    Parameters:
+    content (bytes): The bytes of the HTML page.
+    content_type (str): The Content-Type header of the response.
+
+    Returns:
+    str: The text content of the page, or None if it could not be decoded.
+    """
+    decoded_content = decode_content(content, content_type)
+    if decoded_content is None:
+        return None
+
+    # Parse the HTML and extract the text
+    return html_to_text(decoded_content)
+
+
+def extract_plain_text(content, content_type=""):
+    """
+    This function extracts the text content of a plain text file.
+
+    Parameters:
+    content (bytes): The bytes of the text file.
+    content_type (str): The Content-Type header of the response.
+
+    Returns:
+    str: The text content of the file, or None if it could not be decoded.
+    """
+    decoded_content = decode_content(content, content_type)
+    if decoded_content is None:
+        return None
+
+    return normalize_whitespace(decoded_content)
+
+
+EXTRACTORS = {
+    "html": extract_html_text,
+    "pdf": extract_pdf_text,
+    "text": extract_plain_text,
+}
+
+
+def document_from_cache(url, entry, fetch_seconds=0.0) -> WebDocument:
+    """
+    This function builds a document from a web cache entry.
+
+    Parameters:
+    url (str): The URL of the document.
+    entry (dict): The cached entry.
+    fetch_seconds (float): The time spent revalidating the entry.
+
+    Returns:
+    WebDocument: The cached document.
+    """
+    return WebDocument(
+        url=url,
+        text=entry["text"],
+        kind=entry["kind"],
+        content_type=entry["content_type"],
+        byte_size=entry["byte_size"],
+        fetch_seconds=fetch_seconds,
+        extract_seconds=0.0,
+        from_cache=True,
+    )
+
+
+def load_document(url, kind=None) -> Optional[WebDocument]:
+    """
+    This function downloads a URL once and converts it to text with the matching extractor.
+
+    Documents are read through the web cache: fresh entries are returned without any
+    request, and stale ones are revalidated with a conditional GET.
+
+    Parameters:
+    url (str): The URL of the document.
+    kind (str): Forces the extractor ("html", "pdf" or "text") instead of detecting it.
+
+    Returns:
+    WebDocument: The loaded document, or None if its content could not be extracted.
+
+    Raises:
+    requests.exceptions.RequestException: If the download fails.
+    """
+    cache = get_web_cache()
+    entry, fresh = cache.lookup(url) if cache is not None else (None, False)
+    if entry is not None and kind is not None and entry["kind"] != kind:
+        entry, fresh = None, False
+    if fresh:
+        return document_from_cache(url, entry)
+
+    request_headers = cache.conditional_headers(entry) if entry is not None else None
+
+    start = time.perf_counter()
+    response, content = get_http_client().get(url, headers=request_headers)
+    fetch_seconds = time.perf_counter() - start
+
+    if entry is not None and response.status_code == 304:
+        cache.mark_revalidated(url)
+        return document_from_cache(url, entry, fetch_seconds)
+
+    # Check if the request was successful
+    response.raise_for_status()
+
+    content_type = response.headers.get("Content-Type", "")
+    kind = kind or detect_kind(content, content_type)
+
+    start = time.perf_counter()
+    text = EXTRACTORS[kind](content, content_type)
+    extract_seconds = time.perf_counter() - start
+    if text is None:
+        logging.warning(f"Could not extract the {kind} text of {url}")
+        return None
+
+    document = WebDocument(
+        url=url,
+        text=text,
+        kind=kind,
+        content_type=content_type,
+        byte_size=len(content),
+        fetch_seconds=fetch_seconds,
+        extract_seconds=extract_seconds,
+    )
+    if cache is not None:
+        cache.save(
+            url,
+            {
+                "text": text,
+                "kind": kind,
+                "content_type": content_type,
+                "byte_size": len(content),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            },
+        )
+    return document
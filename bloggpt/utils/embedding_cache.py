@@ -0,0 +1,287 @@
+"""
+A persistent embedding cache keyed by a hash of the model name and the text.
+
+The vectors of a model are appended to one float32 array file that is read through a memory map,
+and a SQLite index maps every key to its row in that file. There is one store per directory in a
+process, and writers of several processes are serialized by a lock file.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.embeddings.base import Embeddings
+
+from utils.cache_utils import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# At 1536 float32 dimensions, 50000 vectors take about 300 MB
+EMBEDDING_CACHE_MAX_VECTORS = int(os.getenv("EMBEDDING_CACHE_MAX_VECTORS", "50000"))
+# Share of the vectors kept, most recently used first, when the cache is full
+EMBEDDING_CACHE_KEEP_RATIO = 0.8
+
+
+class EmbeddingStore:
+    """
+    An append-only, memory-mapped array of embeddings with a SQLite offset index.
+
+    Once the store holds more than max_vectors vectors it is compacted: the
+    least recently used vectors are dropped and the array file is rewritten.
+    """
+
+    def __init__(self, directory: str, dim: int, max_vectors: int):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.lock_path = os.path.join(directory, "vectors.lock")
+        self.dim = dim
+        self.max_vectors = max_vectors
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.memmap] = None
+        # Identity of the mapped file, which changes when it is compacted
+        self._mapped_inode: Optional[int] = None
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False, timeout=30
+        )
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS offsets (
+                    key TEXT PRIMARY KEY,
+                    row INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        # The lock file is never replaced, unlike the vectors file on compaction
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _num_rows(self) -> int:
+        if not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _mapped_vectors(self, min_rows: int) -> np.memmap:
+        # Map the file again when it grew past the current mapping, or was
+        # replaced by a compaction, possibly in another process
+        inode = os.stat(self.vectors_path).st_ino
+        if (
+            self._vectors is None
+            or inode != self._mapped_inode
+            or len(self._vectors) < min_rows
+        ):
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r"
+            ).reshape(-1, self.dim)
+            self._mapped_inode = inode
+        return self._vectors
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """
+        Read the vectors of keys and mark them as recently used.
+
+        Args:
+            keys: The keys to read.
+
+        Returns:
+            The vector of each key, or None for the keys that are not cached.
+        """
+        results: List[Optional[List[float]]] = [None] * len(keys)
+        with self._lock, self._file_lock(exclusive=False), self._conn:
+            rows = {}
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(
+                    self._conn.execute(
+                        f"SELECT key, row FROM offsets WHERE key IN ({placeholders})",
+                        batch,
+                    ).fetchall()
+                )
+            if rows:
+                vectors = self._mapped_vectors(max(rows.values()) + 1)
+                for i, key in enumerate(keys):
+                    if key in rows:
+                        results[i] = vectors[rows[key]].tolist()
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE offsets SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in rows],
+                )
+            self.hits += sum(result is not None for result in results)
+            self.misses += sum(result is None for result in results)
+        return results
+
+    def add_many(self, keys: List[str], vectors: List[List[float]]) -> None:
+        """
+        Append vectors to the store.
+
+        Args:
+            keys: The keys of the vectors.
+            vectors: The vectors, of the store's dimension.
+        """
+        array = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        now = time.time()
+        row_bytes = 4 * self.dim
+        with self._lock, self._file_lock(exclusive=True), self._conn:
+            with open(self.vectors_path, "ab") as f:
+                # The rows are placed at the end of the file as it is now, and
+                # the partial row of an interrupted write is dropped
+                end = f.seek(0, os.SEEK_END)
+                f.truncate(end - end % row_bytes)
+                start = end // row_bytes
+                f.write(array.tobytes())
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO offsets VALUES (?, ?, ?)",
+                [(key, start + i, now) for i, key in enumerate(keys)],
+            )
+            if start + len(keys) > self.max_vectors:
+                self._compact()
+
+    def _compact(self) -> None:
+        keep = int(self.max_vectors * EMBEDDING_CACHE_KEEP_RATIO)
+        kept = self._conn.execute(
+            "SELECT key, row FROM offsets ORDER BY accessed_at DESC LIMIT ?", (keep,)
+        ).fetchall()
+        vectors = self._mapped_vectors(self._num_rows())
+        compacted = np.asarray(vectors[[row for _, row in kept]], dtype=np.float32)
+
+        tmp_path = f"{self.vectors_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compacted.tobytes())
+        self._vectors = None
+        self._mapped_inode = None
+        os.replace(tmp_path, self.vectors_path)
+
+        self._conn.execute("DELETE FROM offsets")
+        self._conn.executemany(
+            "INSERT INTO offsets VALUES (?, ?, ?)",
+            [(key, row, time.time()) for row, (key, _) in enumerate(kept)],
+        )
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(directory: str, dim: int, max_vectors: int) -> EmbeddingStore:
+    """
+    Get the embedding store of a directory, creating it on first use.
+
+    Every cached embedding model of a directory shares one store, and so one
+    lock and one memory map of its vectors.
+
+    Args:
+        directory: The directory of the store.
+        dim: The dimension of the vectors.
+        max_vectors: The number of vectors above which the store is compacted.
+
+    Returns:
+        The embedding store.
+    """
+    path = os.path.realpath(directory)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingStore(path, dim, max_vectors)
+        return _stores[path]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that are read from the embedding cache before calling the wrapped model.
+
+    Texts that are not cached yet are embedded in a single call to the model.
+    Query and document embeddings are cached under different keys.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, dim: int = 1536):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.store = get_embedding_store(
+            os.path.join(CACHE_DIR, "embeddings", slug),
+            dim,
+            EMBEDDING_CACHE_MAX_VECTORS,
+        )
+
+    def key(self, text: str, kind: str) -> str:
+        """Builds the cache key of a text embedded as a document or a query."""
+        digest = hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8"))
+        return f"{kind}:{digest.hexdigest()}"
+
+    def _embed_many(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [self.key(text, kind) for text in texts]
+        vectors = self.store.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.store.add_many([keys[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_many(texts, "document")
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries, with a single call to the model for the ones not cached.
+
+        Args:
+            texts: The queries.
+
+        Returns:
+            The embedding of each query.
+        """
+        return self._embed_many(texts, "query")
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.key(text, "query")
+        vector = self.store.get_many([key])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.store.add_many([key], [vector])
+        return vector
+
+
+def get_cached_embeddings(embeddings: Embeddings, model_name: str) -> Embeddings:
+    """
+    Wrap an embedding model with the embedding cache, if it is enabled.
+
+    Args:
+        embeddings: The embedding model.
+        model_name: The name of the model, part of the cache key.
+
+    Returns:
+        The cached embeddings, or the model itself if the cache is disabled.
+    """
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name)
@@ -0,0 +1,254 @@
+"""
+A deadline-aware scheduler for the fetches of a research step.
+
+Candidate URLs are fetched in parallel, a few more than the number of results
+still needed (over-provisioning), and results are returned in candidate order.
+A fetch that is slower than the hedge delay no longer holds back the results
+behind it: the next candidate is started in its place, and the slow fetch is
+only used if it still finishes in time. When the time budget of the step runs
+out, whatever is ready is returned and the fetches still running are recorded
+as timed out. The clock of the time budget is paused while the caller handles
+a returned result, so slow consumers do not use up the budget of the fetches. Results can be checked by the caller (e.g. against near-duplicates)
+as they are returned, and a rejected result is replaced by another candidate.
+"""
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Seconds a research step (search, fetch and extract) may take, 0 for no limit
+RESEARCH_TIME_BUDGET = float(os.getenv("RESEARCH_TIME_BUDGET", "90"))
+# Seconds after which a fetch is hedged with the next candidate URL, 0 to never hedge
+FETCH_HEDGE_SECONDS = float(os.getenv("FETCH_HEDGE_SECONDS", "10"))
+# Number of fetches in flight per result still needed
+FETCH_OVERPROVISION = float(os.getenv("FETCH_OVERPROVISION", "1.5"))
+
+
+@dataclass
+class FetchReport:
+    """What happened to the candidate URLs of a research step."""
+
+    succeeded: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    # Still running when the time budget ran out
+    timed_out: List[str] = field(default_factory=list)
+    # Started but not needed any more once enough results were found
+    skipped: List[str] = field(default_factory=list)
+    # Slower than the hedge delay, so the next candidate was started
+    hedged: List[str] = field(default_factory=list)
+    # Fetched, but rejected by the accept check of the caller
+    rejected: List[str] = field(default_factory=list)
+    search_pages: int = 0
+    deadline_hit: bool = False
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.succeeded)} succeeded, {len(self.failed)} failed, "
+            f"{len(self.timed_out)} timed out, {len(self.skipped)} skipped, "
+            f"{len(self.hedged)} hedged, {len(self.rejected)} rejected, "
+            f"{self.search_pages} search pages, "
+            f"{self.seconds:.1f}s" + (" (deadline hit)" if self.deadline_hit else "")
+        )
+
+
+@dataclass
+class _Fetch:
+    url: str
+    future: Future
+    started_at: float
+
+    def result(self) -> Optional[Any]:
+        if not self.future.done() or self.future.exception() is not None:
+            return None
+        return self.future.result()
+
+
+class FetchScheduler:
+    """
+    Fetches candidate URLs until num_results fetches succeeded or the time budget ran out.
+
+    A fetch succeeds when fetch_fn returns something other than None, and accept,
+    if given, returns True for its result. accept is called from the thread that
+    consumes the results, one result at a time in the order they are yielded, so
+    it can keep state such as the pages already returned. thread_initializer, if
+    given, is called at the start of each worker thread, e.g. to give it the
+    context of the calling thread.
+    """
+
+    def __init__(
+        self,
+        fetch_fn: Callable[[str], Optional[Any]],
+        num_results: int,
+        max_workers: int,
+        time_budget: Optional[float] = RESEARCH_TIME_BUDGET,
+        hedge_after: Optional[float] = FETCH_HEDGE_SECONDS,
+        overprovision: float = FETCH_OVERPROVISION,
+        report: Optional[FetchReport] = None,
+        accept: Optional[Callable[[Any], bool]] = None,
+        thread_initializer: Optional[Callable[[], None]] = None,
+    ):
+        self.fetch_fn = fetch_fn
+        self.num_results = num_results
+        self.max_workers = max(1, max_workers)
+        self.time_budget = time_budget or None
+        self.hedge_after = hedge_after or None
+        self.overprovision = max(1.0, overprovision)
+        self.report = report if report is not None else FetchReport()
+        self.accept = accept
+        self.thread_initializer = thread_initializer
+
+    def run(self, candidates: Iterable[str]) -> Iterator[Any]:
+        """
+        Fetch the candidates and yield the successful results.
+
+        Candidates are only drawn from the iterable when a fetch slot is free,
+        so a lazy iterable (e.g. paginated search results) is not read further
+        than needed. The time budget only counts the time spent inside the
+        generator, not the time the caller takes between two results.
+
+        Args:
+            candidates: The candidate URLs, in order of preference.
+
+        Yields:
+            Up to num_results results, in candidate order except for hedged fetches
+            that finished after the candidates started in their place.
+        """
+        report = self.report
+        start = time.monotonic()
+        deadline = start + self.time_budget if self.time_budget else None
+        candidates = iter(candidates)
+        exhausted = False
+        # Fetches in candidate order, not yet resolved, and the hedged ones
+        ordered: Deque[_Fetch] = deque()
+        hedged: List[_Fetch] = []
+        num_yielded = 0
+
+        def _emit(result):
+            # The deadline is moved by the time the caller holds the generator
+            nonlocal deadline
+            yielded_at = time.monotonic()
+            yield result
+            if deadline is not None:
+                deadline += time.monotonic() - yielded_at
+
+        def _resolve(fetch: _Fetch) -> Optional[Any]:
+            result = fetch.result()
+            if result is None:
+                report.failed.append(fetch.url)
+            elif self.accept is not None and not self.accept(result):
+                report.rejected.append(fetch.url)
+                return None
+            else:
+                report.succeeded.append(fetch.url)
+            return result
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, initializer=self.thread_initializer
+        )
+        try:
+            while num_yielded < self.num_results:
+                # Keep enough fetches in flight for the results still needed.
+                # Hedged fetches were replaced, so they do not count, but they
+                # still hold a worker until they finish
+                pending = [fetch for fetch in ordered if fetch.future.done()]
+                running = [fetch for fetch in ordered if not fetch.future.done()]
+                running_hedged = [fetch for fetch in hedged if not fetch.future.done()]
+                needed = (
+                    self.num_results
+                    - num_yielded
+                    - sum(fetch.result() is not None for fetch in pending)
+                )
+                target = min(
+                    self.max_workers - len(running_hedged),
+                    math.ceil(needed * self.overprovision),
+                )
+                while not exhausted and len(running) < target:
+                    url = next(candidates, None)
+                    if url is None:
+                        exhausted = True
+                        break
+                    future = executor.submit(self.fetch_fn, url)
+                    fetch = _Fetch(url, future, time.monotonic())
+                    ordered.append(fetch)
+                    running.append(fetch)
+                running.extend(running_hedged)
+
+                # Yield the results that are next in order
+                progressed = False
+                while ordered and ordered[0].future.done():
+                    progressed = True
+                    result = _resolve(ordered.popleft())
+                    if result is not None:
+                        yield from _emit(result)
+                        num_yielded += 1
+                        if num_yielded >= self.num_results:
+                            return
+                for fetch in [fetch for fetch in hedged if fetch.future.done()]:
+                    progressed = True
+                    hedged.remove(fetch)
+                    result = _resolve(fetch)
+                    if result is not None:
+                        yield from _emit(result)
+                        num_yielded += 1
+                        if num_yielded >= self.num_results:
+                            return
+                if progressed:
+                    continue
+                if not running:
+                    break
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    report.deadline_hit = True
+                    # Return the results that are ready, even behind a running fetch
+                    for fetch in [*ordered, *hedged]:
+                        if not fetch.future.done():
+                            report.timed_out.append(fetch.url)
+                        elif num_yielded < self.num_results:
+                            result = _resolve(fetch)
+                            if result is not None:
+                                yield result
+                                num_yielded += 1
+                        else:
+                            report.skipped.append(fetch.url)
+                    ordered.clear()
+                    hedged.clear()
+                    return
+
+                # Stop waiting for a slow fetch in order, the next candidate replaces it
+                if (
+                    self.hedge_after is not None
+                    and ordered
+                    and now - ordered[0].started_at >= self.hedge_after
+                ):
+                    fetch = ordered.popleft()
+                    hedged.append(fetch)
+                    report.hedged.append(fetch.url)
+                    continue
+
+                # Wake up for the next completion, hedge or deadline
+                timeouts = []
+                if deadline is not None:
+                    timeouts.append(deadline - now)
+                if self.hedge_after is not None and ordered:
+                    timeouts.append(ordered[0].started_at + self.hedge_after - now)
+                wait(
+                    [fetch.future for fetch in running],
+                    timeout=min(timeouts) if timeouts else None,
+                    return_when=FIRST_COMPLETED,
+                )
+        finally:
+            report.skipped.extend(fetch.url for fetch in (*ordered, *hedged))
+            report.seconds = time.monotonic() - start
+            # Fetches that have not started are cancelled, the running ones
+            # finish in the background within their HTTP timeouts
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+# Load environment variables from .env file
+load_dotenv()
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+# Responses larger than this are aborted (PDFs are the largest results)
+HTTP_MAX_RESPONSE_BYTES = int(
+    os.getenv("HTTP_MAX_RESPONSE_BYTES", str(20 * 1024 * 1024))
+)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "16"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "4"))
+
+USER_AGENT = "Mozilla/5.0 (compatible; BlogGPT/0.1)"
+CHUNK_SIZE = 64 * 1024
+
+try:
+    # urllib3 only decodes brotli responses when a brotli package is installed
+    import brotli  # noqa: F401
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """Raised when a response is larger than the maximum response size."""
+
+
+class HttpClient:
+    """
+    A pooled HTTP client shared by all the fetchers.
+
+    Connections are kept alive and reused per host, responses are requested
+    compressed, every request has a connect and a read timeout, bodies larger
+    than max_response_bytes are aborted, and the number of requests in flight
+    is capped both globally and per host.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        max_response_bytes: int = HTTP_MAX_RESPONSE_BYTES,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_per_host: int = HTTP_MAX_PER_HOST,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_response_bytes = max_response_bytes
+        self.max_per_host = max_per_host
+
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING}
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_per_host
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._global_slots = threading.BoundedSemaphore(max_connections)
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def _read_limited(self, response: requests.Response) -> bytes:
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit():
+            if int(content_length) > self.max_response_bytes:
+                raise ResponseTooLarge(
+                    f"Response of {content_length} bytes is larger than "
+                    f"{self.max_response_bytes} bytes",
+                    response=response,
+                )
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                raise ResponseTooLarge(
+                    f"Response is larger than {self.max_response_bytes} bytes",
+                    response=response,
+                )
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def get(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[requests.Response, bytes]:
+        """
+        Send a GET request and read the whole (size-limited) body.
+
+        Args:
+            url: The URL to fetch.
+            headers: Extra request headers.
+
+        Returns:
+            The closed response, for its status and headers, and its body.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails, times
+                out or the response is too large.
+        """
+        # Wait for a per-host slot first so a busy host does not hold global slots
+        with self._host_semaphore(url), self._global_slots:
+            response = self.session.get(
+                url, headers=headers, timeout=self.timeout, stream=True
+            )
+            try:
+                content = self._read_limited(response)
+            finally:
+                response.close()
+        return response, content
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """
+    Get the process-wide HTTP client, creating it on first use.
+
+    Returns:
+        The shared HttpClient.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,305 @@
+"""
+A record of what is stored in each vector index, kept across runs.
+
+The manifest lists the chunks (by content hash) and the URLs indexed in every
+namespace of an index, so that a run can keep the index of the previous runs
+and only scrape and embed what is new. Namespaces that were not used for a
+while, or that make the index too large, are garbage-collected.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.cache_utils import CACHE_DIR
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Keep the index between runs and only add new chunks to it
+INCREMENTAL_INDEX = os.getenv("INCREMENTAL_INDEX", "true").lower() == "true"
+# Seconds after which an indexed URL is scraped again
+INDEX_URL_TTL = float(os.getenv("INDEX_URL_TTL", str(7 * 24 * 60 * 60)))
+# Namespaces unused for longer than this many seconds are deleted
+INDEX_NAMESPACE_MAX_AGE = float(
+    os.getenv("INDEX_NAMESPACE_MAX_AGE", str(30 * 24 * 60 * 60))
+)
+# The least recently used namespaces are deleted past this many chunks
+INDEX_MAX_CHUNKS = int(os.getenv("INDEX_MAX_CHUNKS", "200000"))
+
+
+def chunk_id(text: str) -> str:
+    """
+    Get the id of a chunk, the hash of its content.
+
+    Args:
+        text: The text of the chunk.
+
+    Returns:
+        The hex digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    The chunks and URLs of every namespace of the vector indexes, in SQLite.
+
+    The manifest is only written after the vectors were upserted, so a chunk
+    listed in it is always in the index.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    index_name TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    indexed_at REAL NOT NULL,
+                    PRIMARY KEY (index_name, namespace, chunk_id)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS urls (
+                    index_name TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    indexed_at REAL NOT NULL,
+                    PRIMARY KEY (index_name, namespace, url)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS namespaces (
+                    index_name TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (index_name, namespace)
+                )
+                """
+            )
+
+    def touch_namespace(self, index_name: str, namespace: str) -> None:
+        """
+        Mark a namespace as used by the current run.
+
+        Args:
+            index_name: The name of the index.
+            namespace: The namespace.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO namespaces VALUES (?, ?, ?)",
+                (index_name, namespace, time.time()),
+            )
+
+    def _indexed_ids(self, index_name: str, namespace: str, ids: List[str]) -> set:
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            return {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE index_name = ? "
+                    f"AND namespace = ? AND chunk_id IN ({placeholders})",
+                    [index_name, namespace, *ids],
+                )
+            }
+
+    def new_chunks(
+        self,
+        index_name: str,
+        namespace: str,
+        texts: Iterable[str],
+        batch_size: int = 500,
+    ) -> Iterator[str]:
+        """
+        Filter out the chunks that are already in a namespace, lazily.
+
+        Args:
+            index_name: The name of the index.
+            namespace: The namespace.
+            texts: The chunks to check.
+            batch_size: The number of chunks checked with one query.
+
+        Yields:
+            The new texts, without duplicates, in their original order.
+        """
+        seen = set()
+        batch: Dict[str, str] = {}
+        for text in texts:
+            id_ = chunk_id(text)
+            if id_ in seen:
+                continue
+            seen.add(id_)
+            batch[id_] = text
+            if len(batch) >= batch_size:
+                indexed = self._indexed_ids(index_name, namespace, list(batch))
+                yield from (t for i, t in batch.items() if i not in indexed)
+                batch = {}
+        if batch:
+            indexed = self._indexed_ids(index_name, namespace, list(batch))
+            yield from (t for i, t in batch.items() if i not in indexed)
+
+    def add_chunks(self, index_name: str, namespace: str, texts: List[str]) -> None:
+        """
+        Record chunks that were upserted into a namespace.
+
+        Args:
+            index_name: The name of the index.
+            namespace: The namespace.
+            texts: The upserted chunks.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [(index_name, namespace, chunk_id(text), now) for text in texts],
+            )
+
+    def is_fresh_url(self, index_name: str, namespace: str, url: str) -> bool:
+        """
+        Check whether a URL was indexed in a namespace less than INDEX_URL_TTL ago.
+
+        Args:
+            index_name: The name of the index.
+            namespace: The namespace.
+            url: The normalized URL.
+
+        Returns:
+            True if the URL does not need to be scraped again.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT indexed_at FROM urls WHERE index_name = ? AND namespace = ? "
+                "AND url = ?",
+                (index_name, namespace, url),
+            ).fetchone()
+        return row is not None and time.time() - row[0] <= INDEX_URL_TTL
+
+    def add_urls(self, index_name: str, namespace: str, urls: List[str]) -> None:
+        """
+        Record URLs whose chunks were indexed in a namespace.
+
+        Args:
+            index_name: The name of the index.
+            namespace: The namespace.
+            urls: The normalized URLs.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)",
+                [(index_name, namespace, url, now) for url in urls],
+            )
+
+    def delete_namespace(self, index_name: str, namespace: str) -> None:
+        """Forget everything recorded for a namespace."""
+        with self._lock, self._conn:
+            for table in ("chunks", "urls", "namespaces"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE index_name = ? AND namespace = ?",
+                    (index_name, namespace),
+                )
+
+    def delete_index(self, index_name: str) -> None:
+        """Forget everything recorded for an index, e.g. after it was recreated."""
+        with self._lock, self._conn:
+            for table in ("chunks", "urls", "namespaces"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE index_name = ?", (index_name,)
+                )
+
+    def expired_namespaces(
+        self,
+        index_name: str,
+        max_age: float = INDEX_NAMESPACE_MAX_AGE,
+        max_chunks: int = INDEX_MAX_CHUNKS,
+    ) -> List[str]:
+        """
+        Get the namespaces to garbage-collect.
+
+        A namespace expires when it was not used for max_age seconds, or when
+        the index holds more than max_chunks chunks and it is among the least
+        recently used namespaces.
+
+        Args:
+            index_name: The name of the index.
+            max_age: The maximum number of seconds since a namespace was used.
+            max_chunks: The maximum number of chunks of the index.
+
+        Returns:
+            The expired namespaces, least recently used first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT n.namespace, n.used_at, COUNT(c.chunk_id)
+                FROM namespaces n LEFT JOIN chunks c
+                ON c.index_name = n.index_name AND c.namespace = n.namespace
+                WHERE n.index_name = ?
+                GROUP BY n.namespace, n.used_at
+                ORDER BY n.used_at
+                """,
+                (index_name,),
+            ).fetchall()
+
+        now = time.time()
+        total = sum(count for _, _, count in rows)
+        expired = []
+        for namespace, used_at, count in rows:
+            if now - used_at > max_age or total > max_chunks:
+                expired.append(namespace)
+                total -= count
+        return expired
+
+    def stats(self, index_name: str) -> Dict[str, int]:
+        """
+        Get the number of namespaces, chunks and URLs of an index.
+
+        Args:
+            index_name: The name of the index.
+
+        Returns:
+            A dict with the index statistics.
+        """
+        with self._lock:
+            return {
+                table: self._conn.execute(
+                    f"SELECT COUNT(*) FROM {table} WHERE index_name = ?",
+                    (index_name,),
+                ).fetchone()[0]
+                for table in ("namespaces", "chunks", "urls")
+            }
+
+
+_manifest: Optional[IndexManifest] = None
+_manifest_lock = threading.Lock()
+
+
+def get_index_manifest() -> IndexManifest:
+    """
+    Get the shared index manifest, creating it on first use.
+
+    Returns:
+        The index manifest.
+    """
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = IndexManifest(os.path.join(CACHE_DIR, "index_manifest.sqlite"))
+        return _manifest
@@ -0,0 +1,219 @@
+"""
+Batched embedding and upsert pipeline for the research corpus.
+
+Texts are read from an iterable, possibly a generator, and grouped into batches bounded by the
+embedding provider's item and token limits, so only one batch is held in memory. While
+batch N is upserted in a background thread, batch N+1 is embedded. Rate-limited batches are
+retried after an exponential backoff and split in half, and the batch limits grow back after
+successful batches.
+"""
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+from utils.token_utils import count_tokens
+
+# Load environment variables from .env file
+load_dotenv()
+
+# OpenAI accepts up to 2048 inputs per embedding request
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "2048"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", "1"))
+EMBED_MODEL = "text-embedding-ada-002"
+
+UpsertFn = Callable[[List[str], List[List[float]]], None]
+
+
+@dataclass
+class IngestionStats:
+    """Counters of an ingestion run."""
+
+    chunks: int = 0
+    batches: int = 0
+    rate_limited: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Check whether an error is a rate limit error of the embedding provider.
+
+    Args:
+        error: The error raised by the embedding call.
+
+    Returns:
+        True for OpenAI's RateLimitError and HTTP 429 errors.
+    """
+    if type(error).__name__ == "RateLimitError":
+        return True
+    return getattr(error, "http_status", None) == 429
+
+
+def get_ingestion_embeddings(
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+) -> OpenAIEmbeddings:
+    """
+    Create the OpenAI embedding model that ingest_texts calls.
+
+    OpenAIEmbeddings splits its input into requests of chunk_size texts and
+    retries rate limits itself, which would hide them from the adaptive batches.
+    Here a batch is sent as a single request, tried once.
+
+    Args:
+        max_items: The maximum number of texts of an embedding request.
+
+    Returns:
+        The embedding model.
+    """
+    return OpenAIEmbeddings(chunk_size=max_items, max_retries=1)
+
+
+class AdaptiveBatcher:
+    """
+    Groups texts into batches whose limits shrink on rate limits and grow back on success.
+    """
+
+    def __init__(self, max_items: int, max_tokens: int):
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.item_limit = max_items
+        self.token_limit = max_tokens
+
+    def next_batch(self, texts: List[str], token_counts: List[int], start: int) -> int:
+        """
+        Find the end of the batch starting at start.
+
+        Args:
+            texts: All the texts.
+            token_counts: The number of tokens of each text.
+            start: The index of the first text of the batch.
+
+        Returns:
+            The index after the last text of the batch (at least start + 1).
+        """
+        end = start
+        tokens = 0
+        while end < len(texts) and end - start < self.item_limit:
+            if end > start and tokens + token_counts[end] > self.token_limit:
+                break
+            tokens += token_counts[end]
+            end += 1
+        return end
+
+    def shrink(self, batch_size: int) -> None:
+        """Halve the batch limits after a rate limit."""
+        self.item_limit = max(1, batch_size // 2)
+        self.token_limit = max(1, self.token_limit // 2)
+
+    def grow(self) -> None:
+        """Grow the batch limits by half, up to the provider limits, after a success."""
+        self.item_limit = min(self.max_items, self.item_limit * 3 // 2 + 1)
+        self.token_limit = min(self.max_tokens, self.token_limit * 3 // 2 + 1)
+
+
+def ingest_texts(
+    texts: Iterable[str],
+    embeddings: Embeddings,
+    upsert: UpsertFn,
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+    max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+) -> IngestionStats:
+    """
+    Embed texts in adaptive batches and upsert each batch while the next one is embedded.
+
+    Args:
+        texts: The texts to ingest, read lazily.
+        embeddings: The embedding model, made by get_ingestion_embeddings so that
+            its requests are the batches and rate limits reach the batcher.
+        upsert: Stores a batch of texts and their vectors.
+        max_items: The maximum number of texts of an embedding request.
+        max_tokens: The maximum number of tokens of an embedding request.
+
+    Returns:
+        The counters of the run, including the throughput in chunks per second.
+
+    Raises:
+        Exception: The last error if a batch still fails after EMBED_MAX_RETRIES retries.
+    """
+    stats = IngestionStats()
+    start_time = time.perf_counter()
+    batcher = AdaptiveBatcher(max_items, max_tokens)
+
+    # The texts read but not ingested yet, enough to fill the next batch
+    remaining = iter(texts)
+    buffer: List[str] = []
+    buffer_tokens: List[int] = []
+    num_buffer_tokens = 0
+    exhausted = False
+
+    pending_upsert: Optional[Future] = None
+    retries = 0
+    with ThreadPoolExecutor(max_workers=1) as upsert_executor:
+        while True:
+            while not exhausted and (
+                len(buffer) < batcher.item_limit
+                and num_buffer_tokens < batcher.token_limit
+            ):
+                text = next(remaining, None)
+                if text is None:
+                    exhausted = True
+                    break
+                buffer.append(text)
+                buffer_tokens.append(count_tokens(text, EMBED_MODEL))
+                num_buffer_tokens += buffer_tokens[-1]
+            if not buffer:
+                break
+
+            end = batcher.next_batch(buffer, buffer_tokens, 0)
+            batch = buffer[:end]
+            try:
+                vectors = embeddings.embed_documents(batch)
+            except Exception as e:
+                if not is_rate_limit_error(e) or retries >= EMBED_MAX_RETRIES:
+                    raise
+                stats.rate_limited += 1
+                delay = EMBED_BACKOFF_SECONDS * 2**retries
+                logging.warning(
+                    f"Rate limited on a batch of {len(batch)} texts, "
+                    f"retrying in {delay:.1f}s with smaller batches"
+                )
+                retries += 1
+                batcher.shrink(len(batch))
+                time.sleep(delay)
+                continue
+
+            retries = 0
+            batcher.grow()
+            # Only one upsert is in flight, so embedding runs at most one batch ahead
+            if pending_upsert is not None:
+                pending_upsert.result()
+            pending_upsert = upsert_executor.submit(upsert, batch, vectors)
+            stats.batches += 1
+            stats.chunks += len(batch)
+            num_buffer_tokens -= sum(buffer_tokens[:end])
+            del buffer[:end]
+            del buffer_tokens[:end]
+
+        if pending_upsert is not None:
+            pending_upsert.result()
+
+    stats.seconds = time.perf_counter() - start_time
+    logging.info(
+        f"Ingested {stats.chunks} chunks in {stats.batches} batches "
+        f"({stats.rate_limited} rate limited) in {stats.seconds:.2f}s, "
+        f"{stats.chunks_per_second:.1f} chunks/s"
+    )
+    return stats
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+from utils.cache_utils import CACHE_DIR, DiskLRUCache
+
+# Load environment variables from .env file
+load_dotenv()
+
+# The completion cache is opt-in
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Calls sampled at a higher temperature are not deterministic and bypass the cache.
+# With the default of 0 the final rewrite (temperature 0.5) is never cached, unless
+# REWRITE_CACHE_ENABLED opts it in.
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0"))
+# Maximum number of LLM requests in flight, across all the threads of the process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+_llm_cache: Optional[DiskLRUCache] = None
+_llm_cache_lock = threading.Lock()
+# Shared by every model, so nested executors (sections, fetches, summary chunks)
+# cannot multiply the number of requests sent at once
+_llm_slots = threading.BoundedSemaphore(max(1, LLM_MAX_CONCURRENCY))
+
+
+def get_llm_cache() -> Optional[DiskLRUCache]:
+    """
+    Get the process-wide completion cache, creating it on first use.
+
+    Returns:
+        The completion cache, or None if it is disabled.
+    """
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = DiskLRUCache(
+                os.path.join(CACHE_DIR, "completions.sqlite"), LLM_CACHE_MAX_BYTES
+            )
+        return _llm_cache
+
+
+class CachedChatOpenAI(ChatOpenAI):
+    """
+    A ChatOpenAI model whose completions are stored in the completion cache.
+
+    The cache key is a hash of the model, its sampling parameters and the full
+    message list, so only byte-identical requests are served from the cache.
+    Models sampled above LLM_CACHE_MAX_TEMPERATURE always call the API, unless
+    bypass_cache is explicitly set to False. At most LLM_MAX_CONCURRENCY calls
+    to the API run at once; cache hits do not wait. A streaming model sends a
+    cached completion to its callbacks as a single token.
+    """
+
+    bypass_cache: Optional[bool] = None
+
+    def _cache_bypassed(self) -> bool:
+        if self.bypass_cache is not None:
+            return self.bypass_cache
+        return self.temperature > LLM_CACHE_MAX_TEMPERATURE
+
+    def _cache_key(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> str:
+        request = {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "n": self.n,
+            "model_kwargs": self.model_kwargs,
+            "stop": stop,
+            "messages": [
+                [message.type, message.content, message.additional_kwargs]
+                for message in messages
+            ],
+        }
+        encoded = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        cache = None if self._cache_bypassed() else get_llm_cache()
+        if cache is None:
+            with _llm_slots:
+                return super()._generate(messages, stop, run_manager, **kwargs)
+
+        key = self._cache_key(messages, stop)
+        cached = cache.get(key)
+        if cached is not None:
+            # Drop the token usage so that cached calls are not counted as spent
+            llm_output = {
+                name: value
+                for name, value in cached["llm_output"].items()
+                if name != "token_usage"
+            }
+            # Fill the streaming output, e.g. a placeholder on the page
+            if self.streaming and run_manager is not None and cached["generations"]:
+                run_manager.on_llm_new_token(cached["generations"][0]["content"])
+            return ChatResult(
+                generations=[
+                    ChatGeneration(
+                        message=AIMessage(
+                            content=generation["content"],
+                            additional_kwargs=generation["additional_kwargs"],
+                        )
+                    )
+                    for generation in cached["generations"]
+                ],
+                llm_output={**llm_output, "cached": True},
+            )
+
+        with _llm_slots:
+            result = super()._generate(messages, stop, run_manager, **kwargs)
+        cache.set(
+            key,
+            {
+                "generations": [
+                    {
+                        "content": generation.message.content,
+                        "additional_kwargs": generation.message.additional_kwargs,
+                    }
+                    for generation in result.generations
+                ],
+                "llm_output": result.llm_output or {},
+            },
+        )
+        return result
+
+
+def llm_cache_stats() -> Dict[str, int]:
+    """
+    Get the hit and miss counts of the completion cache.
+
+    Returns:
+        A dict with the cache statistics, empty if the cache is disabled.
+    """
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else {}
@@ -1,9 +1,12 @@
 import logging
 import os
+import time
+from typing import Optional
 
 import streamlit as st
 from ansi2html import Ansi2HTMLConverter
 from dotenv import load_dotenv
+from langchain.callbacks.base import BaseCallbackHandler
 
 # Load environment variables from .env file
 load_dotenv()
@@ -58,3 +61,58 @@ class StreamlitHandler(logging.Handler):
     def emit(self, record):
         log_entry = self.format(record)
         st.write(log_entry)
+
+
+class StreamlitTokenHandler(BaseCallbackHandler):
+    """
+    Renders the tokens of an LLM into a Streamlit placeholder as they arrive.
+
+    The placeholder shows the output of the current LLM call, while the timings
+    cover every call since the first one (e.g. all the steps of an agent run).
+    With an answer_prefix, only the output that follows it is shown, so the
+    thoughts and actions of an agent stay hidden until its final answer.
+    """
+
+    def __init__(self, placeholder, answer_prefix: Optional[str] = None):
+        self.placeholder = placeholder
+        self.answer_prefix = answer_prefix
+        self.output = ""
+        self.text = ""
+        self.start_time = None
+        self.first_token_time = None
+        self.end_time = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.output = ""
+        self.text = ""
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.output += token
+        if self.answer_prefix is None:
+            self.text = self.output
+        else:
+            start = self.output.find(self.answer_prefix)
+            if start < 0:
+                return
+            self.text = self.output[start + len(self.answer_prefix) :].lstrip()
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.placeholder.markdown(self.text + "▌")
+
+    def on_llm_end(self, response, **kwargs):
+        self.end_time = time.perf_counter()
+        self.placeholder.markdown(self.text)
+
+    @property
+    def time_to_first_token(self):
+        if self.start_time is None or self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    @property
+    def total_time(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
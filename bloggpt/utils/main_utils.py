@@ -1,13 +1,29 @@
+import hashlib
 import logging
 import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Dict, Optional
 
 import streamlit as st
 from dotenv import load_dotenv
+from langchain.callbacks import get_openai_callback
 from langchain.chains import LLMChain
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
 
-from prompts.prompts import REWRITE_PROMPT, SUMMARIZE_PROMPT
+from prompts.prompts import REWRITE_PROMPT, SUMMARIZE_PROMPT, SUMMARIZE_REDUCE_PROMPT
+from utils.cache_utils import CACHE_DIR, DiskLRUCache
+from utils.context_budget import (
+    REWRITE_RESERVE_TOKENS,
+    get_prompt_token_recorder,
+    record_prompt_tokens,
+    set_prompt_token_recorder,
+)
+from utils.model_registry import get_chat_model, get_task_profile, route_task
+from utils.token_utils import count_tokens, split_text_by_tokens
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,6 +33,18 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_CONTEXT_ID = os.getenv("GOOGLE_CSE_ID")
 PINECONE_ENV = os.getenv("PINECONE_ENV")
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_MAX_BYTES = int(
+    os.getenv("SUMMARY_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+# Texts longer than the summarize prompt can hold are summarized in chunks of
+# SUMMARY_CHUNK_TOKENS tokens, then reduced
+SUMMARY_MODEL = get_task_profile("page_summary").model_name
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+SUMMARY_MAX_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", "8"))
+SUMMARY_PARALLELISM = int(os.getenv("SUMMARY_PARALLELISM", "4"))
+# The final rewrite is sampled, so it only uses the completion cache when opted in
+REWRITE_CACHE_ENABLED = os.getenv("REWRITE_CACHE_ENABLED", "false").lower() == "true"
 
 
 def rprint(text):
@@ -43,7 +71,42 @@ def gprint(text):
     print(f"<span style='color:green'>{text}</span>")
 
 
-def generate_final_blog(entire_draft, TOPIC_PROMPT, OPENAI_API_KEY):
+def write_file_atomically(filename, text):
+    """
+    This function writes a text file through a temporary file, so the file is either fully written or unchanged.
+
+    The temporary file has a unique name in the same directory, so concurrent writers never share it.
+
+    Parameters:
+    filename (str): The name of the file to write to.
+    text (str): The text to write.
+
+    Returns:
+    None
+    """
+    tmp_file = tempfile.NamedTemporaryFile(
+        "w",
+        dir=os.path.dirname(filename) or ".",
+        prefix=f".{os.path.basename(filename)}.",
+        suffix=".tmp",
+        delete=False,
+    )
+    try:
+        with tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_file.name, filename)
+    except BaseException:
+        os.remove(tmp_file.name)
+        raise
+
+
+def generate_final_blog(
+    entire_draft,
+    TOPIC_PROMPT,
+    OPENAI_API_KEY,
+    stream_handler=None,
+    use_cache=REWRITE_CACHE_ENABLED,
+):
     """
     This function refines the generated blog and saves the final blog in a markdown file.
 
@@ -51,27 +114,53 @@ def generate_final_blog(entire_draft, TOPIC_PROMPT, OPENAI_API_KEY):
     entire_draft (str): The entire draft of the blog.
     TOPIC_PROMPT (str): The topic prompt for the blog.
     OPENAI_API_KEY (str): The OpenAI API key.
+    stream_handler (BaseCallbackHandler): If given, the rewrite is streamed token by token to this handler.
+    use_cache (bool): Whether the rewrite is read from and stored in the completion cache (LLM_CACHE_ENABLED) although it is sampled.
 
     Returns:
     None
     """
-    refine_llm = ChatOpenAI(
-        model_name="gpt-4-0613",
-        temperature=0.5,
-        openai_api_key=OPENAI_API_KEY,
+    # Drafts too long for the rewrite prompt are shortened evenly across sections
+    budget = get_task_profile("final_rewrite").budget(REWRITE_RESERVE_TOKENS)
+    max_draft_tokens = budget.remaining(
+        REWRITE_PROMPT.format(generated_blog="", TOPIC_PROMPT=TOPIC_PROMPT)
+    )
+    # Sections are joined by a blank line, so a cut section never runs into a header
+    sections = [
+        section.strip()
+        for section in re.split(r"(?m)^(?=#)", entire_draft)
+        if section.strip()
+    ]
+    packed_draft = budget.share(sections, max_draft_tokens, separator="\n\n")
+    if packed_draft.truncated or packed_draft.dropped:
+        rprint(f"Shortening the draft to {max_draft_tokens} tokens")
+    entire_draft = packed_draft.text
+
+    rewrite_prompt = REWRITE_PROMPT.format(
+        generated_blog=entire_draft, TOPIC_PROMPT=TOPIC_PROMPT
+    )
+    prompt_tokens = budget.count(rewrite_prompt)
+    profile = route_task("final_rewrite", prompt_tokens)
+    if use_cache:
+        profile = replace(profile, bypass_cache=False)
+    record_prompt_tokens(
+        "Final rewrite", rewrite_prompt, profile.model_name, prompt_tokens
     )
 
+    refine_llm = get_chat_model(
+        profile, streaming=stream_handler is not None, openai_api_key=OPENAI_API_KEY
+    )
     prompt = PromptTemplate.from_template(REWRITE_PROMPT)
     refine_llm_chain = LLMChain(llm=refine_llm, prompt=prompt)
 
     final_blog = refine_llm_chain(
         inputs={"generated_blog": entire_draft, "TOPIC_PROMPT": TOPIC_PROMPT},
         return_only_outputs=True,
+        callbacks=[stream_handler] if stream_handler is not None else None,
     )
 
-    # Save the blog in a markdown file
-    with open("bloggpt/outputs/blog.md", "w") as f:
-        f.write(final_blog["text"])
+    # Save the blog in a markdown file, atomically so readers never see a partial blog
+    write_file_atomically("bloggpt/outputs/blog.md", final_blog["text"])
 
     return final_blog["text"]
 
@@ -145,27 +234,155 @@ def combine_drafts(directory):
     return entire_draft
 
 
-def summarize_text(text: str) -> str:
-    PROMPT = PromptTemplate(template=SUMMARIZE_PROMPT, input_variables=["text"])
-    llm = ChatOpenAI(
-        model_name="gpt-3.5-turbo-16k-0613",
-        max_tokens=300,
-        openai_api_key=OPENAI_API_KEY,
-        temperature=0,
+class SummaryCache:
+    """
+    A persistent cache of page summaries.
+
+    Entries are keyed by a hash of the text, the model name and the prompt
+    version, and remember how many tokens the summary cost, so that the cache
+    can report the tokens it saved.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.store = DiskLRUCache(path, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str, model_name: str, prompt: str) -> str:
+        """Builds the cache key of a text summarized by a model with a prompt."""
+        # Cached summaries are invalidated whenever the prompt changes
+        prompt_version = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{prompt_version}:{digest}"
+
+    def get(self, text: str, model_name: str, prompt: str) -> Optional[str]:
+        """Returns the cached summary of a text, or None if it was not summarized yet."""
+        entry = self.store.get(self.key(text, model_name, prompt))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.tokens_saved += entry["total_tokens"]
+        return entry["summary"]
+
+    def set(
+        self, text: str, model_name: str, prompt: str, summary: str, total_tokens: int
+    ):
+        """Stores the summary of a text and the number of tokens it cost."""
+        self.store.set(
+            self.key(text, model_name, prompt),
+            {"summary": summary, "total_tokens": total_tokens},
+        )
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit rate and the number of tokens saved by the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+_summary_cache = None
+_summary_cache_lock = threading.Lock()
+
+
+def get_summary_cache() -> Optional[SummaryCache]:
+    """Returns the process-wide summary cache, or None if it is disabled."""
+    global _summary_cache
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            _summary_cache = SummaryCache(
+                os.path.join(CACHE_DIR, "summaries.sqlite"), SUMMARY_CACHE_MAX_BYTES
+            )
+        return _summary_cache
+
+
+def run_summary_chain(text: str, prompt: str = SUMMARIZE_PROMPT) -> str:
+    """
+    This function summarizes a text with a single LLM call, reusing a cached summary if there is one.
+
+    Parameters:
+    text (str): The text to summarize.
+    prompt (str): The summarize prompt, with a {text} variable.
+
+    Returns:
+    str: The summary.
+    """
+    # Short texts are summarized by a faster model
+    full_prompt = prompt.format(text=text)
+    prompt_tokens = count_tokens(full_prompt, SUMMARY_MODEL)
+    profile = route_task("page_summary", prompt_tokens)
+
+    cache = get_summary_cache()
+    if cache is not None:
+        summary = cache.get(text, profile.model_name, prompt)
+        if summary is not None:
+            return summary
+
+    summarize_chain = LLMChain(
+        llm=get_chat_model(profile),
+        prompt=PromptTemplate(template=prompt, input_variables=["text"]),
     )
-    summarize_chain = LLMChain(llm=llm, prompt=PROMPT)
+    record_prompt_tokens("Summary", full_prompt, profile.model_name, prompt_tokens)
+    with get_openai_callback() as cb:
+        summary = summarize_chain.run(text)
+
+    if cache is not None:
+        cache.set(text, profile.model_name, prompt, summary, cb.total_tokens)
+    return summary
+
 
-    # Truncate text if larger than 12500 words
-    if len(text.split()) > 12000:
-        rprint("Truncating text to 12500 words")
-        text = " ".join(text.split()[:12000])
+def summarize_text(text: str) -> str:
+    """
+    This function summarizes a text of any length.
+
+    Texts that fit in the summarize prompt of the model are summarized with a single call.
+    Longer texts are split into chunks of SUMMARY_CHUNK_TOKENS tokens that are summarized
+    concurrently (map), and the chunk summaries are then combined into the final summary (reduce).
+
+    Parameters:
+    text (str): The text to summarize.
+
+    Returns:
+    str: The summary, or None if the summarization failed.
+    """
+    budget = get_task_profile("page_summary").budget()
+    max_text_tokens = budget.remaining(SUMMARIZE_PROMPT.format(text=""))
 
     # Summarize the text
     try:
-        summary = summarize_chain.run(text)
+        if budget.count(text) <= max_text_tokens:
+            return run_summary_chain(text)
+
+        chunk_tokens = min(SUMMARY_CHUNK_TOKENS, max_text_tokens)
+        chunks = split_text_by_tokens(text, chunk_tokens, SUMMARY_MODEL)
+        if len(chunks) > SUMMARY_MAX_CHUNKS:
+            rprint(f"Truncating text to {SUMMARY_MAX_CHUNKS * chunk_tokens} tokens")
+            chunks = chunks[:SUMMARY_MAX_CHUNKS]
+
+        # The chunk summaries are recorded with the prompts of the run
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(SUMMARY_PARALLELISM, len(chunks))),
+            initializer=set_prompt_token_recorder,
+            initargs=(get_prompt_token_recorder(),),
+        ) as executor:
+            chunk_summaries = list(executor.map(run_summary_chain, chunks))
+        packed_summaries = budget.share(
+            chunk_summaries,
+            budget.remaining(SUMMARIZE_REDUCE_PROMPT.format(text="")),
+        )
+        return run_summary_chain(packed_summaries.text, SUMMARIZE_REDUCE_PROMPT)
     except Exception as e:
         st.error(e)
-        st.error(f"Number of words: {len(text.split())}")
+        st.error(f"Number of tokens: {count_tokens(text, SUMMARY_MODEL)}")
         return None
-
-    return summary
@@ -0,0 +1,220 @@
+"""
+Named model profiles, and the routing of each task to a profile.
+
+A profile fixes the model and its sampling parameters. Each task (page summary,
+section draft of the agent or of the RQNA runner, final rewrite) is routed to a
+profile, and to a faster profile when its prompt is small enough. Profiles and
+routes can be changed from the environment, e.g. to trade quality for latency,
+without code edits:
+
+    MODEL_PROFILES={"draft": {"model_name": "gpt-3.5-turbo-16k-0613"}}
+    MODEL_ROUTES={"section_draft": {"small_profile": "fast", "small_input_tokens": 2000}}
+
+Chat clients are created once per profile and shared by all the calls.
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils.context_budget import (
+    COMPLETION_RESERVE_TOKENS,
+    TokenBudget,
+    get_context_window,
+)
+from utils.llm_utils import CachedChatOpenAI
+
+# Load environment variables from .env file
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """A model and the parameters it is called with."""
+
+    name: str
+    model_name: str
+    temperature: float = 0.0
+    # Maximum tokens of the completion, None for no limit
+    max_tokens: Optional[int] = None
+    # Tokens of the context window, 0 for the known window of the model
+    context_window: int = 0
+    # Seconds before a request is abandoned and retried
+    timeout: float = 120.0
+    # Whether calls skip the completion cache, None to decide by the temperature
+    bypass_cache: Optional[bool] = None
+
+    def __post_init__(self):
+        if not self.context_window:
+            object.__setattr__(
+                self, "context_window", get_context_window(self.model_name)
+            )
+
+    def budget(self, reserve_tokens: Optional[int] = None) -> TokenBudget:
+        """
+        Get the token budget of a prompt sent with this profile.
+
+        Args:
+            reserve_tokens: The tokens kept free for the completion, by default
+                max_tokens, or COMPLETION_RESERVE_TOKENS without a limit.
+
+        Returns:
+            The token budget.
+        """
+        if reserve_tokens is None:
+            reserve_tokens = self.max_tokens or COMPLETION_RESERVE_TOKENS
+        return TokenBudget(self.model_name, reserve_tokens, self.context_window)
+
+
+@dataclass(frozen=True)
+class TaskRoute:
+    """The profile of a task, and the faster profile used for small prompts."""
+
+    profile: str
+    small_profile: Optional[str] = None
+    # Prompts of at most this many tokens use the small profile
+    small_input_tokens: int = 0
+
+
+DEFAULT_PROFILES = {
+    "summary": ModelProfile(
+        "summary", "gpt-3.5-turbo-16k-0613", max_tokens=300, timeout=90
+    ),
+    "fast": ModelProfile("fast", "gpt-3.5-turbo-0613", max_tokens=300, timeout=60),
+    "draft": ModelProfile("draft", "gpt-4-0613", timeout=180),
+    # The RQNA runner drafts at ChatOpenAI's default temperature
+    "rqna_draft": ModelProfile(
+        "rqna_draft", "gpt-4-0613", temperature=0.7, timeout=180
+    ),
+    "rewrite": ModelProfile("rewrite", "gpt-4-0613", temperature=0.5, timeout=300),
+}
+
+DEFAULT_ROUTES = {
+    "page_summary": TaskRoute("summary", "fast", 2500),
+    "section_draft": TaskRoute("draft"),
+    "rqna_section_draft": TaskRoute("rqna_draft"),
+    "final_rewrite": TaskRoute("rewrite"),
+}
+
+
+def _load_profiles() -> Dict[str, ModelProfile]:
+    profiles = dict(DEFAULT_PROFILES)
+    for name, fields in json.loads(os.getenv("MODEL_PROFILES", "{}")).items():
+        if name in profiles:
+            # A new model comes with its own context window, unless one is given
+            if "model_name" in fields:
+                fields = {"context_window": 0, **fields}
+            profiles[name] = replace(profiles[name], **fields)
+        else:
+            profiles[name] = ModelProfile(name=name, **fields)
+    return profiles
+
+
+def _load_routes() -> Dict[str, TaskRoute]:
+    routes = dict(DEFAULT_ROUTES)
+    for task, fields in json.loads(os.getenv("MODEL_ROUTES", "{}")).items():
+        if task in routes:
+            routes[task] = replace(routes[task], **fields)
+        else:
+            routes[task] = TaskRoute(**fields)
+    return routes
+
+
+MODEL_PROFILES = _load_profiles()
+MODEL_ROUTES = _load_routes()
+
+
+def get_profile(name: str) -> ModelProfile:
+    """
+    Get a model profile by name.
+
+    Args:
+        name: The name of the profile.
+
+    Returns:
+        The profile.
+    """
+    try:
+        return MODEL_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown model profile: {name}") from None
+
+
+def get_task_profile(task: str) -> ModelProfile:
+    """
+    Get the profile a task uses for prompts of any size.
+
+    Args:
+        task: The task, e.g. "page_summary".
+
+    Returns:
+        The profile of the task.
+    """
+    return get_profile(MODEL_ROUTES[task].profile)
+
+
+def route_task(task: str, input_tokens: int) -> ModelProfile:
+    """
+    Pick the profile of a task for a prompt.
+
+    The small profile of the task is used when the prompt has at most
+    small_input_tokens tokens and still leaves room for the completion in its
+    context window.
+
+    Args:
+        task: The task, e.g. "page_summary".
+        input_tokens: The number of tokens of the prompt.
+
+    Returns:
+        The profile to call.
+    """
+    route = MODEL_ROUTES[task]
+    if route.small_profile is not None and input_tokens <= route.small_input_tokens:
+        small = get_profile(route.small_profile)
+        if input_tokens + (small.max_tokens or 0) <= small.context_window:
+            return small
+    return get_profile(route.profile)
+
+
+_chat_models: Dict[Tuple[ModelProfile, bool, Optional[str]], CachedChatOpenAI] = {}
+_chat_models_lock = threading.Lock()
+
+
+def get_chat_model(
+    profile: ModelProfile,
+    streaming: bool = False,
+    openai_api_key: Optional[str] = None,
+) -> CachedChatOpenAI:
+    """
+    Get the shared chat client of a profile, creating it on first use.
+
+    Callbacks, e.g. to stream the output, are passed to each call rather than
+    to the client, so that the client can be shared.
+
+    Args:
+        profile: The model profile.
+        streaming: Whether the completions are streamed token by token.
+        openai_api_key: The OpenAI API key, by default the one of the environment.
+
+    Returns:
+        The chat client.
+    """
+    openai_api_key = openai_api_key or OPENAI_API_KEY
+    key = (profile, streaming, openai_api_key)
+    with _chat_models_lock:
+        if key not in _chat_models:
+            _chat_models[key] = CachedChatOpenAI(
+                model_name=profile.model_name,
+                temperature=profile.temperature,
+                max_tokens=profile.max_tokens,
+                request_timeout=profile.timeout,
+                openai_api_key=openai_api_key,
+                streaming=streaming,
+                bypass_cache=profile.bypass_cache,
+            )
+        return _chat_models[key]
@@ -0,0 +1,188 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import PyPDF2
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Pages are not read past this many words (0 reads the whole PDF)
+PDF_MAX_WORDS = int(os.getenv("PDF_MAX_WORDS", "12000"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# The first pages are always extracted in the calling process, and only the pages
+# left after this many are extracted on the process pool (see
+# benchmarks/bench_pdf_extraction.py)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "100"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool used for large PDFs, creating it on first use.
+
+    The pool uses the spawn start method, since forking a process that runs
+    several threads (Streamlit, the fetch workers) is not safe.
+
+    Returns:
+        The shared process pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _extract_pages(pdf: PyPDF2.PdfReader, start: int, stop: int) -> List[str]:
+    return [pdf.pages[i].extract_text((0, 90)) for i in range(start, stop)]
+
+
+# The PDF parsed by a worker process, reused by its next page ranges
+_worker_pdf: Optional[Tuple[str, PyPDF2.PdfReader]] = None
+
+
+def extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """
+    Extract the text of the pages [start, stop) of a PDF, in a worker process.
+
+    The PDF is read from a file rather than sent with every task, and each
+    worker parses it only once.
+
+    Args:
+        path: The path of the PDF file.
+        start: The index of the first page.
+        stop: The index after the last page.
+
+    Returns:
+        The text of each page.
+    """
+    global _worker_pdf
+    if _worker_pdf is None or _worker_pdf[0] != path:
+        _worker_pdf = (path, PyPDF2.PdfReader(path))
+    return _extract_pages(_worker_pdf[1], start, stop)
+
+
+def _extract_sequentially(
+    pdf: PyPDF2.PdfReader, stop: int, max_words: int
+) -> Tuple[List[str], int]:
+    pages = []
+    num_words = 0
+    for i in range(stop):
+        page_text = _extract_pages(pdf, i, i + 1)[0]
+        pages.append(page_text)
+        num_words += len(page_text.split())
+        if max_words and num_words >= max_words:
+            break
+    return pages, num_words
+
+
+def _extract_in_parallel(
+    path: str, start: int, num_pages: int, max_words: int
+) -> Tuple[List[str], int]:
+    ranges = [
+        (range_start, min(range_start + PDF_PAGES_PER_TASK, num_pages))
+        for range_start in range(start, num_pages, PDF_PAGES_PER_TASK)
+    ]
+    pool = get_pdf_pool()
+    # Keep only as many page ranges in flight as there are workers, so that
+    # little work is wasted once the word budget is reached
+    futures = deque(
+        pool.submit(extract_page_range, path, *page_range)
+        for page_range in ranges[:PDF_WORKERS]
+    )
+    next_range = len(futures)
+
+    pages = []
+    num_words = 0
+    try:
+        while futures:
+            future = futures.popleft()
+            if next_range < len(ranges):
+                futures.append(
+                    pool.submit(extract_page_range, path, *ranges[next_range])
+                )
+                next_range += 1
+            for page_text in future.result():
+                pages.append(page_text)
+                num_words += len(page_text.split())
+                if max_words and num_words >= max_words:
+                    return pages, num_words
+        return pages, num_words
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _extract_rest_in_parallel(
+    content: bytes, start: int, num_pages: int, max_words: int
+) -> Tuple[List[str], int]:
+    # The workers read the PDF from one temporary file instead of each task
+    # pickling its bytes
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(content)
+    try:
+        return _extract_in_parallel(f.name, start, num_pages, max_words)
+    finally:
+        try:
+            os.remove(f.name)
+        except OSError:
+            # Still open in a worker on platforms that lock open files
+            logging.debug("Could not remove %s", f.name)
+
+
+def extract_pdf_text(content: bytes, max_words: int = PDF_MAX_WORDS) -> str:
+    """
+    Extract the text of a PDF, stopping once max_words words have been read.
+
+    The first PDF_PARALLEL_MIN_PAGES pages are extracted in the calling
+    process, which is enough to fill the word budget of most PDFs. Only the
+    pages of larger PDFs left after them are extracted in page ranges on a
+    process pool. Pages are joined once at the end instead of being appended to
+    a growing string.
+
+    Args:
+        content: The bytes of the PDF file.
+        max_words: The word budget, 0 to read every page.
+
+    Returns:
+        The text of the pages that were read.
+    """
+    start = time.perf_counter()
+    pdf = PyPDF2.PdfReader(BytesIO(content))
+    num_pages = len(pdf.pages)
+
+    parallel = PDF_WORKERS > 1 and num_pages > PDF_PARALLEL_MIN_PAGES
+    stop = PDF_PARALLEL_MIN_PAGES if parallel else num_pages
+    pages, num_words = _extract_sequentially(pdf, stop, max_words)
+    if parallel and len(pages) == stop and not (max_words and num_words >= max_words):
+        rest, rest_words = _extract_rest_in_parallel(
+            content, stop, num_pages, max_words - num_words if max_words else 0
+        )
+        pages += rest
+        num_words += rest_words
+
+    seconds = time.perf_counter() - start
+    logging.info(
+        "Extracted %d/%d PDF pages (%d words) in %.2fs, %.1f pages/s",
+        len(pages),
+        num_pages,
+        num_words,
+        seconds,
+        len(pages) / seconds if seconds > 0 else float("inf"),
+    )
+    return "\n".join(pages)
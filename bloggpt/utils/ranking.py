@@ -0,0 +1,143 @@
+"""
+Local BM25 relevance ranking of fetched pages and of their passages.
+
+Ranking runs offline, before any LLM call: only the pages most relevant to the
+query are summarized, and only their most relevant passages are sent.
+"""
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of candidate pages fetched and ranked for every page summarized
+RANK_CANDIDATES_PER_RESULT = float(os.getenv("RANK_CANDIDATES_PER_RESULT", "2"))
+# Words of a passage
+RANK_PASSAGE_WORDS = int(os.getenv("RANK_PASSAGE_WORDS", "120"))
+# Words of passages kept per page, 0 for as many as the summarizer reads
+RANK_MAX_WORDS_PER_PAGE = int(os.getenv("RANK_MAX_WORDS_PER_PAGE", "0"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    """
+    a an and are as at be but by for from has have how in is it its of on or
+    that the this to was were what when where which who why will with you your
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase terms, without stopwords.
+
+    Args:
+        text: The text.
+
+    Returns:
+        The terms, in order.
+    """
+    return [term for term in _TOKEN_RE.findall(text.lower()) if term not in STOPWORDS]
+
+
+class BM25:
+    """
+    An Okapi BM25 index over a small collection of documents.
+
+    Args:
+        documents: The documents, already tokenized.
+        k1: The term frequency saturation.
+        b: The strength of the document length normalization.
+    """
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(document) for document in documents]
+        self.lengths = [len(document) for document in documents]
+        self.average_length = sum(self.lengths) / len(documents) if documents else 0
+        document_frequencies = Counter(
+            term for counts in self.term_counts for term in counts
+        )
+        num_documents = len(documents)
+        self.idf = {
+            term: math.log(1 + (num_documents - df + 0.5) / (df + 0.5))
+            for term, df in document_frequencies.items()
+        }
+
+    def scores(self, query: List[str]) -> List[float]:
+        """
+        Score every document against a query.
+
+        Args:
+            query: The tokenized query.
+
+        Returns:
+            The BM25 score of each document, higher is more relevant.
+        """
+        query_terms = [term for term in set(query) if term in self.idf]
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            scores.append(
+                sum(
+                    self.idf[term]
+                    * counts[term]
+                    * (self.k1 + 1)
+                    / (counts[term] + norm)
+                    for term in query_terms
+                    if term in counts
+                )
+            )
+        return scores
+
+
+def rank_texts(query: str, texts: List[str]) -> List[Tuple[int, float]]:
+    """
+    Rank texts by their BM25 relevance to a query.
+
+    Args:
+        query: The query.
+        texts: The texts to rank.
+
+    Returns:
+        The index and score of each text, most relevant first. Ties keep
+        the original order.
+    """
+    scores = BM25([tokenize(text) for text in texts]).scores(tokenize(query))
+    return sorted(enumerate(scores), key=lambda item: (-item[1], item[0]))
+
+
+def select_passages(
+    query: str,
+    text: str,
+    max_words: int = RANK_MAX_WORDS_PER_PAGE,
+    passage_words: int = RANK_PASSAGE_WORDS,
+) -> str:
+    """
+    Keep the passages of a text most relevant to a query, within a word budget.
+
+    Args:
+        query: The query.
+        text: The text of a page.
+        max_words: The maximum number of words kept, 0 for no limit.
+        passage_words: The number of words of a passage.
+
+    Returns:
+        The selected passages in their original order, or the whole text if it
+        fits in the budget.
+    """
+    words = text.split()
+    if max_words <= 0 or len(words) <= max_words:
+        return text
+    passages = [
+        " ".join(words[i : i + passage_words])
+        for i in range(0, len(words), passage_words)
+    ]
+    num_passages = max(1, max_words // passage_words)
+    selected = sorted(index for index, _ in rank_texts(query, passages)[:num_passages])
+    return "\n".join(passages[index] for index in selected)
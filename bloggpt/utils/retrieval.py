@@ -0,0 +1,246 @@
+"""
+Batched retrieval of the context of several blog sections.
+
+The queries of all sections are embedded with one embedding request, and the
+sections whose research is indexed are searched together: with one matrix
+product per namespace in the local store, or with one batched query per
+namespace, in parallel, in Pinecone. The top-k and the score threshold are
+applied by the index, and each section gets its own context pack.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+# Load environment variables from .env file
+load_dotenv()
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "10"))
+# Cosine similarity under which retrieved chunks are not used as context
+RETRIEVAL_SCORE_THRESHOLD = float(os.getenv("RETRIEVAL_SCORE_THRESHOLD", "0.85"))
+# Seconds a section waits after it is added for other sections to share its search
+RETRIEVAL_COALESCE_SECONDS = float(os.getenv("RETRIEVAL_COALESCE_SECONDS", "0.5"))
+
+ScoredDocuments = List[Tuple[Document, float]]
+# Searches each query vector in its namespace, with a top-k and a score threshold
+SearchFn = Callable[
+    [List[List[float]], List[Optional[str]], int, Optional[float]],
+    List[ScoredDocuments],
+]
+
+
+@dataclass
+class ContextPack:
+    """The retrieved context of one blog section."""
+
+    query: str
+    namespace: Optional[str]
+    docs: ScoredDocuments = field(default_factory=list)
+
+    @property
+    def context(self) -> str:
+        return "\n".join(doc.page_content for doc, _ in self.docs)
+
+
+def embed_queries(embeddings: Embeddings, queries: List[str]) -> List[List[float]]:
+    """
+    Embed several queries with a single embedding request.
+
+    Args:
+        embeddings: The embedding model, optionally wrapped by the embedding cache.
+        queries: The queries.
+
+    Returns:
+        The embedding of each query.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries)
+    # OpenAI embeds queries and documents the same way, in batches of requests
+    return embeddings.embed_documents(queries)
+
+
+def _match_document(match: Dict[str, Any], text_key: str) -> Document:
+    metadata = dict(match["metadata"])
+    return Document(page_content=metadata.pop(text_key), metadata=metadata)
+
+
+def search_pinecone(
+    index: Any,
+    vectors: List[List[float]],
+    namespaces: List[Optional[str]],
+    k: int,
+    score_threshold: Optional[float] = None,
+    text_key: str = "text",
+) -> List[ScoredDocuments]:
+    """
+    Search several query vectors in a Pinecone index, each in its namespace.
+
+    The queries of a namespace are sent in one batched request, and the
+    namespaces are queried in parallel.
+
+    Args:
+        index: The pinecone.Index to search.
+        vectors: The query embeddings.
+        namespaces: The namespace to search for each query.
+        k: The maximum number of documents per query.
+        score_threshold: The minimum score of a document, if any.
+        text_key: The metadata field holding the text of a chunk.
+
+    Returns:
+        The documents and their score, most similar first, per query.
+    """
+    by_namespace: Dict[Optional[str], List[int]] = {}
+    for i, namespace in enumerate(namespaces):
+        by_namespace.setdefault(namespace, []).append(i)
+
+    def _query(namespace, indices):
+        response = index.query(
+            queries=[vectors[i] for i in indices],
+            top_k=k,
+            namespace=namespace,
+            include_metadata=True,
+        )
+        return indices, response["results"]
+
+    results: List[ScoredDocuments] = [[] for _ in vectors]
+    with ThreadPoolExecutor(max_workers=max(1, len(by_namespace))) as executor:
+        futures = [
+            executor.submit(_query, namespace, indices)
+            for namespace, indices in by_namespace.items()
+        ]
+        for future in futures:
+            indices, query_results = future.result()
+            for i, query_result in zip(indices, query_results):
+                results[i] = [
+                    (_match_document(match, text_key), match["score"])
+                    for match in query_result["matches"]
+                    if score_threshold is None or match["score"] >= score_threshold
+                ]
+    return results
+
+
+def retrieve_context_packs(
+    search: SearchFn,
+    queries: List[str],
+    vectors: List[List[float]],
+    namespaces: List[Optional[str]],
+    k: int = RETRIEVAL_TOP_K,
+    score_threshold: Optional[float] = RETRIEVAL_SCORE_THRESHOLD,
+) -> List[ContextPack]:
+    """
+    Retrieve the context of several sections with one batched search.
+
+    Args:
+        search: The batched search of the vector store.
+        queries: The query of each section.
+        vectors: The embedding of each query.
+        namespaces: The namespace of each section.
+        k: The maximum number of chunks per section.
+        score_threshold: The minimum score of a chunk, if any.
+
+    Returns:
+        The context pack of each section.
+    """
+    if not queries:
+        return []
+    results = search(vectors, namespaces, k, score_threshold)
+    return [
+        ContextPack(query, namespace, docs)
+        for query, namespace, docs in zip(queries, namespaces, results)
+    ]
+
+
+class BatchedRetriever:
+    """
+    Coalesces the retrievals of the sections that are ready into batched searches.
+
+    Sections are added once their research is indexed. The first section whose
+    context is requested triggers one search for every section added so far,
+    so sections that become ready together share a single search. A section
+    usually requests its context right after it is added, so it first waits
+    coalesce_seconds for other sections to be added; sections that wait for a
+    draft slot in the meantime are searched together anyway.
+    """
+
+    def __init__(
+        self,
+        search: SearchFn,
+        k: int = RETRIEVAL_TOP_K,
+        score_threshold: Optional[float] = RETRIEVAL_SCORE_THRESHOLD,
+        coalesce_seconds: float = RETRIEVAL_COALESCE_SECONDS,
+    ):
+        self.search = search
+        self.k = k
+        self.score_threshold = score_threshold
+        self.coalesce_seconds = coalesce_seconds
+        self.batches = 0
+        self._pending: Dict[Any, Tuple[str, List[float], Optional[str]]] = {}
+        self._added_at: Dict[Any, float] = {}
+        self._packs: Dict[Any, ContextPack] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self, key: Any, query: str, vector: List[float], namespace: Optional[str]
+    ) -> None:
+        """
+        Add a section whose research is indexed.
+
+        Args:
+            key: The key of the section.
+            query: The query of the section.
+            vector: The embedding of the query.
+            namespace: The namespace of the section.
+        """
+        with self._lock:
+            self._pending[key] = (query, vector, namespace)
+            self._added_at[key] = time.monotonic()
+
+    def get(self, key: Any) -> ContextPack:
+        """
+        Get the context pack of a section, searching all the pending sections if needed.
+
+        Args:
+            key: The key of a section that was added.
+
+        Returns:
+            The context pack of the section.
+
+        Raises:
+            KeyError: If the section was not added, or its context was already got.
+        """
+        with self._lock:
+            added_at = self._added_at.get(key)
+        if added_at is not None:
+            delay = added_at + self.coalesce_seconds - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        with self._lock:
+            if key not in self._packs:
+                if key not in self._pending:
+                    raise KeyError(f"No pending retrieval for section {key!r}")
+                keys = list(self._pending)
+                queries, vectors, namespaces = zip(
+                    *(self._pending[pending_key] for pending_key in keys)
+                )
+                packs = retrieve_context_packs(
+                    self.search,
+                    list(queries),
+                    list(vectors),
+                    list(namespaces),
+                    self.k,
+                    self.score_threshold,
+                )
+                # The sections stay pending if the search fails, for the next get
+                for pending_key in keys:
+                    del self._pending[pending_key]
+                    del self._added_at[pending_key]
+                self._packs.update(zip(keys, packs))
+                self.batches += 1
+            return self._packs.pop(key)
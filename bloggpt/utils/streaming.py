@@ -0,0 +1,132 @@
+"""
+Helpers to stream documents through the research pipeline.
+
+The stages of the pipeline (fetch, extract, split, embed) are chained as
+generators. bounded_prefetch runs a producer stage in its own thread and hands
+its items over through a bounded queue, so the producer can work ahead of the
+consumer by at most a few items, and never holds the whole corpus.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Iterable, Iterator, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from utils.context_budget import get_prompt_token_recorder, set_prompt_token_recorder
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of pages a research stage can fetch ahead of the indexing stage
+PAGE_QUEUE_SIZE = int(os.getenv("PAGE_QUEUE_SIZE", "4"))
+# Directory of the per-run spill files of the research corpus, empty to disable them
+RESEARCH_SPILL_DIR = os.getenv("RESEARCH_SPILL_DIR", "")
+
+T = TypeVar("T")
+
+_DONE = object()
+# Seconds between two checks of whether the consumer stopped
+_POLL_SECONDS = 0.1
+
+
+def bounded_prefetch(items: Iterable[T], maxsize: int = PAGE_QUEUE_SIZE) -> Iterator[T]:
+    """
+    Iterate over items produced in a background thread, at most maxsize items ahead.
+
+    The producer blocks while the queue is full (backpressure) and stops as soon
+    as the consumer closes the generator. Errors of the producer are raised in
+    the consumer.
+
+    Args:
+        items: The iterable to produce, e.g. a generator of fetched pages.
+        maxsize: The maximum number of items waiting in the queue.
+
+    Yields:
+        The items, in order.
+    """
+    handoff: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+    stopped = threading.Event()
+    # The producer needs the script context to be able to print to the page,
+    # and the prompt token recorder of the run
+    script_run_ctx = get_script_run_ctx()
+    prompt_token_recorder = get_prompt_token_recorder()
+
+    def _put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                handoff.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+        set_prompt_token_recorder(prompt_token_recorder)
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not _put((item, None)):
+                    return
+            _put((_DONE, None))
+        except BaseException as e:
+            _put((_DONE, e))
+        finally:
+            # Let a generator release its resources (e.g. cancel pending fetches)
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = handoff.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def new_run_id() -> str:
+    """
+    Create a unique id for a run, so that concurrent runs never share files.
+
+    Returns:
+        The start time of the run followed by a random suffix.
+    """
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def spill_pages(
+    pages: Iterable[Tuple[str, str]], path: Optional[str]
+) -> Iterator[Tuple[str, str]]:
+    """
+    Pass pages through, appending their text to a spill file as they stream by.
+
+    Args:
+        pages: The URL and the text of each page.
+        path: The spill file, or None to not write one.
+
+    Yields:
+        The pages, unchanged.
+    """
+    if path is None:
+        yield from pages
+        return
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as f:
+        for url, text in pages:
+            if text:
+                f.write(f"{url}\n{text}\n\n")
+            yield url, text
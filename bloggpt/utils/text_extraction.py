@@ -0,0 +1,134 @@
+import codecs
+import re
+
+import chardet
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    from lxml import etree
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Elements whose text is never part of the page content
+NON_CONTENT_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "canvas",
+    "iframe",
+    # Form controls only: whole pages can be wrapped in a <form> (e.g. ASP.NET)
+    "input",
+    "select",
+    "option",
+    "textarea",
+    "nav",
+    "footer",
+    "aside",
+]
+# Only this many bytes are looked at to find a <meta charset> or detect the encoding
+CHARSET_SNIFF_BYTES = 4 * 1024
+CHARSET_DETECT_BYTES = 64 * 1024
+
+CONTENT_TYPE_CHARSET = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+META_CHARSET = re.compile(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def normalize_whitespace(text):
+    """
+    This function collapses all runs of whitespace into single spaces in one pass.
+
+    Parameters:
+    text (str): The text to normalize.
+
+    Returns:
+    str: The normalized text.
+    """
+    return " ".join(text.split())
+
+
+def _decode_with(content, encoding):
+    try:
+        codecs.lookup(encoding)
+        return content.decode(encoding)
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def decode_content(content, content_type=""):
+    """
+    This function decodes the body of a response, trying the cheapest sources of its encoding first.
+
+    The charset declared in the Content-Type header is used first, then a <meta charset> at the
+    start of the document, then UTF-8. Only if all of them fail is the encoding detected, on a
+    bounded sample of the body.
+
+    Parameters:
+    content (bytes): The body of the response.
+    content_type (str): The Content-Type header of the response.
+
+    Returns:
+    str: The decoded content, or None if it could not be decoded.
+    """
+    declared = CONTENT_TYPE_CHARSET.search(content_type or "")
+    if declared:
+        decoded_content = _decode_with(content, declared.group(1))
+        if decoded_content is not None:
+            return decoded_content
+
+    meta = META_CHARSET.search(content[:CHARSET_SNIFF_BYTES])
+    if meta:
+        decoded_content = _decode_with(content, meta.group(1).decode("ascii"))
+        if decoded_content is not None:
+            return decoded_content
+
+    decoded_content = _decode_with(content, "utf-8")
+    if decoded_content is not None:
+        return decoded_content
+
+    # Detect the encoding of a sample of the response content
+    encoding = chardet.detect(content[:CHARSET_DETECT_BYTES])["encoding"]
+    if encoding is None:
+        return None
+    try:
+        return content.decode(encoding, errors="replace")
+    except LookupError:
+        return None
+
+
+def _lxml_html_to_text(html):
+    try:
+        tree = lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        # lxml rejects empty documents and strings with an encoding declaration
+        return _soup_html_to_text(html)
+    etree.strip_elements(tree, etree.Comment, *NON_CONTENT_TAGS, with_tail=False)
+    return normalize_whitespace(" ".join(tree.itertext()))
+
+
+def _soup_html_to_text(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for element in soup(NON_CONTENT_TAGS):
+        element.decompose()
+    return normalize_whitespace(soup.get_text(" "))
+
+
+def html_to_text(html):
+    """
+    This function extracts the readable text of an HTML document, without its boilerplate elements.
+
+    lxml is used when it is installed, otherwise the pure-Python html.parser backend of BeautifulSoup.
+
+    Parameters:
+    html (str): The HTML document.
+
+    Returns:
+    str: The text of the document, with normalized whitespace.
+    """
+    if HTML_PARSER == "lxml":
+        return _lxml_html_to_text(html)
+    return _soup_html_to_text(html)
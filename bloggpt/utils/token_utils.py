@@ -0,0 +1,238 @@
+import math
+import re
+from functools import lru_cache
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_ENCODING = "cl100k_base"
+# Windows are decoded one by one when they start and end on smaller blocks
+MIN_DECODE_BLOCK_TOKENS = 16
+# Rough number of tokens per word, used when tiktoken is not installed
+TOKENS_PER_WORD = 4 / 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    """
+    Get the tiktoken encoding of a model, or None if tiktoken is not installed.
+
+    Args:
+        model_name: The name of the model.
+
+    Returns:
+        The tiktoken encoding.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """
+    Count the tokens of a text with the tokenizer of a model.
+
+    Args:
+        text: The text to count.
+        model_name: The name of the model.
+
+    Returns:
+        The number of tokens, estimated from the words if tiktoken is missing.
+    """
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return math.ceil(len(text.split()) * TOKENS_PER_WORD)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_text_by_tokens(text: str, chunk_tokens: int, model_name: str) -> List[str]:
+    """
+    Split a text into consecutive chunks of at most chunk_tokens tokens.
+
+    Args:
+        text: The text to split.
+        chunk_tokens: The maximum number of tokens of a chunk.
+        model_name: The name of the model whose tokenizer is used.
+
+    Returns:
+        The chunks, in order.
+    """
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        words = text.split()
+        chunk_words = max(1, int(chunk_tokens / TOKENS_PER_WORD))
+        return [
+            " ".join(words[i : i + chunk_words])
+            for i in range(0, len(words), chunk_words)
+        ]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        encoding.decode(tokens[i : i + chunk_tokens])
+        for i in range(0, len(tokens), chunk_tokens)
+    ]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str) -> str:
+    """
+    Keep the beginning of a text, up to max_tokens tokens.
+
+    Args:
+        text: The text to truncate.
+        max_tokens: The maximum number of tokens kept.
+        model_name: The name of the model whose tokenizer is used.
+
+    Returns:
+        The truncated text, empty if max_tokens is not positive.
+    """
+    if max_tokens <= 0:
+        return ""
+    if get_encoding(model_name) is None:
+        # Slice the text after its last word kept, so its line breaks are kept too
+        max_words = max(1, int(max_tokens / TOKENS_PER_WORD))
+        for i, match in enumerate(re.finditer(r"\S+", text)):
+            if i + 1 == max_words:
+                return text[: match.end()]
+        return text.strip()
+    chunks = split_text_by_tokens(text, max_tokens, model_name)
+    return chunks[0] if chunks else ""
+
+
+@lru_cache(maxsize=None)
+def _special_token_ids(model_name: str) -> np.ndarray:
+    encoding = get_encoding(model_name)
+    return np.array(
+        [encoding.encode_single_token(token) for token in encoding.special_tokens_set],
+        dtype=np.uint32,
+    )
+
+
+def encode_without_special_tokens(text: str, model_name: str) -> np.ndarray:
+    """
+    Encode a text into an array of token ids, dropping its special tokens.
+
+    Special tokens such as <|endoftext|> are recognized by the tokenizer and
+    removed from the ids, instead of being replaced in the text beforehand.
+
+    Args:
+        text: The text to encode.
+        model_name: The name of the model whose tokenizer is used.
+
+    Returns:
+        The token ids.
+    """
+    encoding = get_encoding(model_name)
+    if hasattr(encoding, "encode_to_numpy"):
+        # Available since tiktoken 0.5, avoids building a list of Python ints
+        tokens = encoding.encode_to_numpy(text, allowed_special="all")
+    else:
+        tokens = np.asarray(
+            encoding.encode(text, allowed_special="all"), dtype=np.uint32
+        )
+    return tokens[~np.isin(tokens, _special_token_ids(model_name))]
+
+
+def _stride(chunk_tokens: int, overlap_tokens: int) -> int:
+    if not 0 <= overlap_tokens < chunk_tokens:
+        raise ValueError("The overlap must be smaller than the chunk size")
+    return chunk_tokens - overlap_tokens
+
+
+def split_token_windows(
+    text: str, chunk_tokens: int, overlap_tokens: int, model_name: str
+) -> List[str]:
+    """
+    Split a text into overlapping windows of chunk_tokens tokens.
+
+    The text is encoded once and the windows are slices of the token array.
+    Windows start every chunk_tokens - overlap_tokens tokens, like langchain's
+    TokenTextSplitter, but the overlapping tokens are not decoded twice: the
+    array is decoded to bytes once, in blocks that windows start and end on,
+    and every window joins the bytes of its blocks.
+
+    Args:
+        text: The text to split.
+        chunk_tokens: The number of tokens of a window.
+        overlap_tokens: The number of tokens shared by consecutive windows.
+        model_name: The name of the model whose tokenizer is used.
+
+    Returns:
+        The windows, in order.
+    """
+    stride = _stride(chunk_tokens, overlap_tokens)
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        words = text.split()
+        chunk_words = max(1, int(chunk_tokens / TOKENS_PER_WORD))
+        stride_words = max(1, int(stride / TOKENS_PER_WORD))
+        return [
+            " ".join(words[i : i + chunk_words])
+            for i in range(0, len(words), stride_words)
+        ]
+
+    tokens = encode_without_special_tokens(text, model_name)
+    starts = range(0, len(tokens), stride)
+    block = math.gcd(chunk_tokens, stride)
+    if block < MIN_DECODE_BLOCK_TOKENS:
+        return [encoding.decode(tokens[i : i + chunk_tokens].tolist()) for i in starts]
+
+    blocks = [
+        encoding.decode_bytes(tokens[i : i + block].tolist())
+        for i in range(0, len(tokens), block)
+    ]
+    blocks_per_chunk = chunk_tokens // block
+    return [
+        b"".join(blocks[i // block : i // block + blocks_per_chunk]).decode(
+            "utf-8", errors="replace"
+        )
+        for i in starts
+    ]
+
+
+def iter_token_windows(
+    texts: Iterable[str], chunk_tokens: int, overlap_tokens: int, model_name: str
+) -> Iterator[str]:
+    """
+    Split a stream of texts into overlapping windows of chunk_tokens tokens.
+
+    This is the streaming variant of split_token_windows: the texts are encoded
+    one at a time and only the tokens of the current window are kept in
+    memory, so the corpus never has to be held as one string.
+
+    Args:
+        texts: The texts to split, e.g. the pages of a corpus, as if concatenated.
+        chunk_tokens: The number of tokens of a window.
+        overlap_tokens: The number of tokens shared by consecutive windows.
+        model_name: The name of the model whose tokenizer is used.
+
+    Yields:
+        The windows, in order.
+    """
+    stride = _stride(chunk_tokens, overlap_tokens)
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        for text in texts:
+            yield from split_token_windows(
+                text, chunk_tokens, overlap_tokens, model_name
+            )
+        return
+
+    buffer = np.empty(0, dtype=np.uint32)
+    for text in texts:
+        buffer = np.concatenate(
+            [buffer, encode_without_special_tokens(text, model_name)]
+        )
+        while len(buffer) >= chunk_tokens:
+            yield encoding.decode(buffer[:chunk_tokens].tolist())
+            buffer = buffer[stride:]
+    # The last windows start before the end of the tokens, like TokenTextSplitter
+    for i in range(0, len(buffer), stride):
+        yield encoding.decode(buffer[i : i + chunk_tokens].tolist())
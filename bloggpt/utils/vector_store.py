@@ -0,0 +1,370 @@
+"""
+An in-process vector store that can replace Pinecone in the recurrent RQNA pipeline.
+
+Vectors are kept per namespace in an append-only file of raw float32 rows that
+is memory-mapped, next to a JSON lines file with the texts and metadatas, so a
+persisted store reloads instantly and adding vectors never rewrites the ones
+already stored.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from utils.cache_utils import CACHE_DIR
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(CACHE_DIR, "vectors"))
+# Namespaces with at least this many vectors are searched with an approximate
+# (HNSW) index when hnswlib is installed, the others with an exact search
+LOCAL_ANN_MIN_VECTORS = int(os.getenv("LOCAL_ANN_MIN_VECTORS", "50000"))
+
+DEFAULT_NAMESPACE = ""
+
+
+def namespace_dirname(namespace: str) -> str:
+    """
+    Get the directory name of a namespace, safe for any namespace string.
+
+    Args:
+        namespace: The namespace.
+
+    Returns:
+        A readable slug of the namespace followed by a short hash.
+    """
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", namespace).strip("_")[:40] or "default"
+    digest = hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}"
+
+
+class _Namespace:
+    """The vectors and documents of one namespace."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.docs_path = os.path.join(directory, "docs.jsonl")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.dim: Optional[int] = None
+        self.vectors: Optional[np.ndarray] = None
+        self.docs: List[Dict[str, Any]] = []
+        # The HNSW index and the number of vectors it was built from
+        self.ann_index: Optional[Tuple[int, Any]] = None
+
+        if os.path.exists(self.meta_path) and os.path.exists(self.docs_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+            with open(self.docs_path) as f:
+                self.docs = [json.loads(line) for line in f]
+            num_docs = len(self.docs)
+            self._map_vectors()
+            # Documents without vectors (e.g. the vectors file was deleted) are
+            # dropped, so that the next rows added line up with their documents
+            if len(self.docs) < num_docs:
+                with open(self.docs_path, "w") as f:
+                    for doc in self.docs:
+                        f.write(json.dumps(doc) + "\n")
+
+    def _map_vectors(self) -> None:
+        # Rows are appended before their documents, so a write interrupted in
+        # between leaves extra rows, which are ignored
+        num_rows = 0
+        if os.path.exists(self.vectors_path):
+            num_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        self.docs = self.docs[:num_rows]
+        if not self.docs:
+            self.vectors = None
+            return
+        self.vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(self.docs), self.dim),
+        )
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, vectors: np.ndarray, docs: List[Dict[str, Any]]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        # Only the new rows are written, after dropping the rows of an
+        # interrupted add that have no documents
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(len(self.docs) * 4 * self.dim)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.docs_path, "a") as f:
+            for doc in docs:
+                f.write(json.dumps(doc) + "\n")
+
+        # A new list, so that the documents of a snapshot never change
+        self.docs = self.docs + docs
+        self._map_vectors()
+
+    def snapshot(self) -> Tuple[Optional[np.ndarray], List[Dict[str, Any]]]:
+        """
+        Get the vectors and documents stored so far, which later adds leave as they are.
+
+        Returns:
+            The mapped vectors (None if there are none) and their documents.
+        """
+        return self.vectors, self.docs
+
+    def search(
+        self,
+        vectors: Optional[np.ndarray],
+        queries: np.ndarray,
+        k: int,
+        min_score: Optional[float] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Find the k most similar vectors of each query, all queries at once.
+
+        Args:
+            vectors: The vectors of a snapshot of the namespace.
+            queries: The normalized queries, one per row.
+            k: The maximum number of results per query.
+            min_score: The minimum cosine similarity of a result, if any.
+
+        Returns:
+            The index and score of each result, most similar first, per query.
+        """
+        if vectors is None or not len(vectors):
+            return [[] for _ in queries]
+        num_vectors = len(vectors)
+        k = min(k, num_vectors)
+
+        if hnswlib is not None and num_vectors >= LOCAL_ANN_MIN_VECTORS:
+            ann_index = self.ann_index
+            if ann_index is None or ann_index[0] != num_vectors:
+                index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+                index.init_index(max_elements=num_vectors)
+                index.add_items(np.asarray(vectors))
+                index.set_ef(max(50, 2 * k))
+                ann_index = self.ann_index = (num_vectors, index)
+            labels, distances = ann_index[1].knn_query(queries, k=k)
+            # hnswlib returns 1 - inner product as the distance
+            return [
+                [
+                    (int(label), float(1.0 - distance))
+                    for label, distance in zip(row_labels, row_distances)
+                    if min_score is None or 1.0 - distance >= min_score
+                ]
+                for row_labels, row_distances in zip(labels, distances)
+            ]
+
+        # One matrix product scores every query against every vector
+        scores = queries @ vectors.T
+        results = []
+        for row in scores:
+            candidates = np.arange(len(row))
+            if min_score is not None:
+                candidates = np.flatnonzero(row >= min_score)
+            if len(candidates) > k:
+                top = np.argpartition(-row[candidates], k - 1)[:k]
+                candidates = candidates[top]
+            candidates = candidates[np.argsort(-row[candidates])]
+            results.append([(int(i), float(row[i])) for i in candidates])
+        return results
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    A NumPy-backed vector store with namespaces and cosine similarity scores.
+
+    Vectors are normalized when they are added, so the cosine similarity of a
+    query with every vector of a namespace is a single matrix-vector product.
+    Scores follow Pinecone's cosine metric: higher is more similar.
+    """
+
+    def __init__(self, embedding: Embeddings, persist_directory: str):
+        self.embedding = embedding
+        self.persist_directory = persist_directory
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: Optional[str]) -> _Namespace:
+        namespace = namespace or DEFAULT_NAMESPACE
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = _Namespace(
+                    os.path.join(self.persist_directory, namespace_dirname(namespace))
+                )
+            return self._namespaces[namespace]
+
+    def reset(self) -> None:
+        """Delete every namespace of the store."""
+        with self._lock:
+            self._namespaces = {}
+            shutil.rmtree(self.persist_directory, ignore_errors=True)
+
+    def delete_namespace(self, namespace: Optional[str]) -> None:
+        """Delete the vectors and documents of a namespace."""
+        namespace = namespace or DEFAULT_NAMESPACE
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+            shutil.rmtree(
+                os.path.join(self.persist_directory, namespace_dirname(namespace)),
+                ignore_errors=True,
+            )
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        namespace: Optional[str] = None,
+        embeddings: Optional[List[List[float]]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Embed texts and add them to a namespace.
+
+        Args:
+            texts: The texts to add.
+            metadatas: The metadata of each text.
+            namespace: The namespace to add the texts to.
+            embeddings: Precomputed embeddings of the texts, if any.
+
+        Returns:
+            The ids of the added texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        if embeddings is None:
+            embeddings = self.embedding.embed_documents(texts)
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+
+        store = self._namespace(namespace)
+        with self._lock:
+            start = len(store)
+            ids = [str(start + i) for i in range(len(texts))]
+            store.add(
+                vectors,
+                [
+                    {"id": doc_id, "text": text, "metadata": metadata}
+                    for doc_id, text, metadata in zip(ids, texts, metadatas)
+                ],
+            )
+        return ids
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, namespace: Optional[str] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Find the documents of a namespace most similar to an embedding.
+
+        Args:
+            embedding: The query embedding.
+            k: The number of documents to return.
+            namespace: The namespace to search.
+
+        Returns:
+            The documents and their cosine similarity, most similar first.
+        """
+        return self.batch_similarity_search_by_vector([embedding], [namespace], k)[0]
+
+    def batch_similarity_search_by_vector(
+        self,
+        embeddings: List[List[float]],
+        namespaces: List[Optional[str]],
+        k: int = 4,
+        score_threshold: Optional[float] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the documents most similar to several embeddings, each in its namespace.
+
+        The queries of a namespace are searched together with one matrix
+        product, and only the documents that pass the threshold are returned.
+
+        Args:
+            embeddings: The query embeddings.
+            namespaces: The namespace to search for each query.
+            k: The maximum number of documents per query.
+            score_threshold: The minimum cosine similarity of a document, if any.
+
+        Returns:
+            The documents and their cosine similarity, most similar first, per query.
+        """
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        results: List[List[Tuple[Document, float]]] = [[] for _ in embeddings]
+        by_namespace: Dict[Optional[str], List[int]] = {}
+        for i, namespace in enumerate(namespaces):
+            by_namespace.setdefault(namespace, []).append(i)
+
+        for namespace, indices in by_namespace.items():
+            store = self._namespace(namespace)
+            # Texts added while searching are left out instead of being half seen
+            with self._lock:
+                vectors, docs = store.snapshot()
+            matches = store.search(vectors, queries[indices], k, score_threshold)
+            for i, query_matches in zip(indices, matches):
+                results[i] = [
+                    (
+                        Document(
+                            page_content=docs[j]["text"],
+                            metadata=docs[j]["metadata"],
+                        ),
+                        score,
+                    )
+                    for j, score in query_matches
+                ]
+        return results
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, namespace: Optional[str] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Find the documents of a namespace most similar to a query.
+
+        Args:
+            query: The query text.
+            k: The number of documents to return.
+            namespace: The namespace to search.
+
+        Returns:
+            The documents and their cosine similarity, most similar first.
+        """
+        embedding = self.embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k, namespace)
+
+    def similarity_search(
+        self, query: str, k: int = 4, namespace: Optional[str] = None, **kwargs: Any
+    ) -> List[Document]:
+        docs_and_scores = self.similarity_search_with_score(query, k, namespace)
+        return [doc for doc, _ in docs_and_scores]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        persist_directory: str = VECTOR_STORE_DIR,
+        namespace: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, persist_directory)
+        store.add_texts(texts, metadatas, namespace=namespace)
+        return store
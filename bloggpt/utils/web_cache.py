@@ -0,0 +1,163 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from dotenv import load_dotenv
+
+from utils.cache_utils import CACHE_DIR, DiskLRUCache
+
+# Load environment variables from .env file
+load_dotenv()
+
+WEB_CACHE_ENABLED = os.getenv("WEB_CACHE_ENABLED", "true").lower() == "true"
+# Seconds after which a cached page is revalidated with a conditional GET
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", str(24 * 60 * 60)))
+WEB_CACHE_MAX_BYTES = int(os.getenv("WEB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+TRACKING_PARAMS = {"gclid", "fbclid", "mc_cid", "mc_eid"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so that equivalent URLs share a cache entry.
+
+    The scheme and host are lowercased, default ports, fragments and tracking
+    parameters are removed and the query parameters are sorted.
+
+    Args:
+        url: The URL to normalize.
+
+    Returns:
+        The normalized URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.startswith("utm_") and name not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class WebCache:
+    """
+    A persistent cache of the text extracted from web pages.
+
+    Entries are keyed by normalized URL and keep the ETag and Last-Modified
+    headers of the response, so that stale entries can be revalidated with a
+    conditional GET instead of being downloaded and parsed again.
+    """
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.store = DiskLRUCache(path, max_bytes)
+        self.ttl = ttl
+        # Fresh entries served, pages downloaded and entries revalidated (304)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, url: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Look up the cached document for a URL.
+
+        Args:
+            url: The URL of the document.
+
+        Returns:
+            The cached entry (or None) and whether it is still fresh.
+        """
+        entry, age = self.store.get_with_age(normalize_url(url))
+        fresh = entry is not None and age <= self.ttl
+        if fresh:
+            with self._lock:
+                self.hits += 1
+        return entry, fresh
+
+    def conditional_headers(self, entry: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Build the headers that revalidate a cached entry.
+
+        Args:
+            entry: The cached entry.
+
+        Returns:
+            The If-None-Match and If-Modified-Since headers for the entry.
+        """
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self, url: str, entry: Dict[str, Any]) -> None:
+        """
+        Store the document for a URL.
+
+        Args:
+            url: The URL of the document.
+            entry: The document fields and its validators.
+        """
+        self.store.set(normalize_url(url), entry)
+        with self._lock:
+            self.misses += 1
+
+    def mark_revalidated(self, url: str) -> None:
+        """
+        Mark a cached entry as fresh after the server answered 304 Not Modified.
+
+        Args:
+            url: The URL of the document.
+        """
+        self.store.touch(normalize_url(url))
+        with self._lock:
+            self.revalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the hit, miss and revalidation counts and the size of the cache.
+
+        Returns:
+            A dict with the cache statistics.
+        """
+        store_stats = self.store.stats()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": store_stats["evictions"],
+                "entries": store_stats["entries"],
+                "bytes": store_stats["bytes"],
+            }
+
+
+_web_cache: Optional[WebCache] = None
+_web_cache_lock = threading.Lock()
+
+
+def get_web_cache() -> Optional[WebCache]:
+    """
+    Get the process-wide web cache, creating it on first use.
+
+    Returns:
+        The shared WebCache, or None if the cache is disabled.
+    """
+    global _web_cache
+    if not WEB_CACHE_ENABLED:
+        return None
+    with _web_cache_lock:
+        if _web_cache is None:
+            _web_cache = WebCache(
+                os.path.join(CACHE_DIR, "web.sqlite"),
+                ttl=WEB_CACHE_TTL,
+                max_bytes=WEB_CACHE_MAX_BYTES,
+            )
+        return _web_cache
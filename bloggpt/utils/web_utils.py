@@ -1,14 +1,17 @@
+import json
 import logging
+import math
 import os
 import re
-from io import BytesIO
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from pprint import pprint
+from typing import Callable, Iterator, Optional, Tuple
 
-import chardet
-import PyPDF2
+import httplib2
 import requests
 import streamlit as st
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
 from langchain import LLMChain, OpenAI, PromptTemplate
@@ -16,8 +19,32 @@ from langchain.chains.summarize import load_summarize_chain
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.tools import tool
-
-from utils.main_utils import bprint, gprint, rprint, summarize_text
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from utils.cache_utils import CACHE_DIR, DiskLRUCache
+from utils.context_budget import get_prompt_token_recorder, set_prompt_token_recorder
+from utils.dedup import make_deduplicator
+from utils.document_loader import clean_text, load_document
+from utils.fetch_scheduler import FetchReport, FetchScheduler
+from utils.http_client import HTTP_READ_TIMEOUT
+from utils.main_utils import (
+    SUMMARY_CHUNK_TOKENS,
+    SUMMARY_MAX_CHUNKS,
+    SUMMARY_MODEL,
+    bprint,
+    get_summary_cache,
+    gprint,
+    rprint,
+    summarize_text,
+)
+from utils.ranking import (
+    RANK_CANDIDATES_PER_RESULT,
+    RANK_MAX_WORDS_PER_PAGE,
+    rank_texts,
+    select_passages,
+)
+from utils.token_utils import TOKENS_PER_WORD
+from utils.web_cache import get_web_cache, normalize_url
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,25 +54,19 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_CONTEXT_ID = os.getenv("GOOGLE_CSE_ID")
 PINECONE_ENV = os.getenv("PINECONE_ENV")
+# Number of URLs fetched (and summarized) at the same time
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+# Seconds a Google search result is reused for (0 disables the cache)
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 60 * 60)))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Maximum number of Google result pages (of 10 results) read for one query
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "3"))
 
-
-def clean_text(text):
-    """
-    This function takes a text string as input and returns a cleaned version of the text that is more suitable for a language model.
-
-    Parameters:
-    text (str): The text to clean.
-
-    Returns:
-    str: The cleaned text.
-    """
-    # Remove leading and trailing whitespace
-    text = text.strip()
-    # Replace multiple whitespace characters with a single space
-    text = re.sub(r"\s+", " ", text)
-    # Replace multiple new lines with a single new line
-    text = re.sub(r"\n+", "\n", text)
-    return text
+# Shared Google search client and result cache
+_search_services = {}
+_search_cache = None
+_search_lock = threading.Lock()
+_search_thread_local = threading.local()
 
 
 def get_pdf_text(url):
@@ -60,9 +81,7 @@ def get_pdf_text(url):
     """
     try:
         bprint(f"Fetching content from {url}")
-        response = requests.get(url)
-        # Check if the request was successful
-        response.raise_for_status()
+        document = load_document(url, kind="pdf")
     except requests.exceptions.HTTPError as err:
         # logger.warning(f"HTTP error occurred for {url}: {err}")
         return None
@@ -70,16 +89,7 @@ def get_pdf_text(url):
         # logger.warning(f"Error occurred for {url}: {err}")
         return None
 
-    # Open the PDF file
-    file = BytesIO(response.content)
-    pdf = PyPDF2.PdfReader(file)
-
-    # Extract the text from each page of the PDF
-    text = ""
-    for page in pdf.pages:
-        text += page.extract_text((0, 90))
-
-    return text
+    return document.text if document is not None else None
 
 
 def get_website_text(url):
@@ -94,9 +104,7 @@ def get_website_text(url):
     """
     try:
         print(f"Fetching content from {url}")
-        response = requests.get(url)
-        # Check if the request was successful
-        response.raise_for_status()
+        document = load_document(url)
     except requests.exceptions.HTTPError as err:
         print(f"HTTP error occurred for {url}: {err}")
         return None
@@ -104,48 +112,29 @@ def get_website_text(url):
         print(f"Error occurred for {url}: {err}")
         return None
 
-    print("headers['Content-Type']: ", response.headers["Content-Type"])
-    # Check the Content-Type of the response
-    if "application/pdf" in response.headers["Content-Type"]:
-        # The URL points to a PDF file
-        return get_pdf_text(url)
-
-    # Detect the encoding of the response content
-    encoding = chardet.detect(response.content)["encoding"]
-
-    print("url: ", url)
-    print("encoding: ", encoding)
-
-    # Decode the content using the detected encoding
-    if encoding is None:
+    if document is None:
         return None
 
-    decoded_content = response.content.decode(encoding)
-
-    # Parse the HTML and extract the text
-    soup = BeautifulSoup(decoded_content, "html.parser")
-    lines = soup.get_text().splitlines()
-    cleaned_lines = [clean_text(line) for line in lines]
-    text = " ".join(cleaned_lines)
-
-    return text
+    print(
+        f"Loaded {document.kind} from {url} ({document.byte_size} bytes, "
+        f"fetch {document.fetch_seconds:.2f}s, extract {document.extract_seconds:.2f}s)"
+    )
+    return document.text
 
 
-def get_website_summary(url):
+def get_website_page_text(url):
     """
-    This function takes a URL as input and returns the summary content of the webpage.
+    This function takes a URL as input and returns the cleaned text content of the webpage.
 
     Parameters:
     url (str): The URL of the webpage.
 
     Returns:
-    str: The summary content of the webpage.
+    str: The cleaned text content of the webpage.
     """
     try:
         bprint(f"Fetching content from {url}")
-        response = requests.get(url)
-        # Check if the request was successful
-        response.raise_for_status()
+        document = load_document(url)
     except requests.exceptions.HTTPError as err:
         st.error(f"HTTP error occurred for {url}: {err}... Skipping")
         return None
@@ -153,45 +142,126 @@ def get_website_summary(url):
         st.error(f"Error occurred for {url}: {err}... Skipping")
         return None
 
-    logging.debug("headers['Content-Type']: ", response.headers["Content-Type"])
+    if document is None:
+        return None
 
-    # Check the Content-Type of the response
-    if "application/pdf" in response.headers["Content-Type"]:
-        # The URL points to a PDF file
-        text = get_pdf_text(url)
-        cleaned_text = clean_text(text)
-    else:
-        # Detect the encoding of the response content
-        encoding = chardet.detect(response.content)["encoding"]
+    logging.debug(
+        "Loaded %s from %s (%d bytes, fetch %.2fs, extract %.2fs)",
+        document.kind,
+        url,
+        document.byte_size,
+        document.fetch_seconds,
+        document.extract_seconds,
+    )
 
-        logging.debug("url: ", url)
-        logging.debug("encoding: ", encoding)
+    return clean_text(document.text)
 
-        # Decode the content using the detected encoding
-        if encoding is None:
-            return None
 
-        try:
-            decoded_content = response.content.decode(encoding)
-        except UnicodeDecodeError:
-            return None
+def get_website_summary(url):
+    """
+    This function takes a URL as input and returns the summary content of the webpage.
 
-        # Parse the HTML and extract the text
-        soup = BeautifulSoup(decoded_content, "html.parser")
-        lines = soup.get_text().splitlines()
-        cleaned_lines = [clean_text(line) for line in lines]
-        cleaned_text = " ".join(cleaned_lines)
+    Parameters:
+    url (str): The URL of the webpage.
+
+    Returns:
+    str: The summary content of the webpage.
+    """
+    text = get_website_page_text(url)
+    if text is None:
+        return None
 
     # Summarize the text
-    summary = summarize_text(cleaned_text)
+    return summarize_text(text)
+
 
-    return summary
+def log_cache_stats():
+    """
+    This function logs the hit and miss counts of the web and summary caches.
+    """
+    web_cache = get_web_cache()
+    if web_cache is not None:
+        logging.info("Web cache stats: %s", web_cache.stats())
+    summary_cache = get_summary_cache()
+    if summary_cache is not None:
+        logging.info("Summary cache stats: %s", summary_cache.stats())
+
+
+def get_search_service(api_key):
+    """
+    This function returns the Google Custom Search client for an API key, building it only once per process.
+
+    Parameters:
+    api_key (str): The API key for Google Custom Search JSON API.
+
+    Returns:
+    Resource: The Custom Search client.
+    """
+    with _search_lock:
+        if api_key not in _search_services:
+            _search_services[api_key] = build(
+                "customsearch", "v1", developerKey=api_key, cache_discovery=False
+            )
+        return _search_services[api_key]
+
+
+def get_search_http():
+    """
+    This function returns the HTTP transport of the current thread for Google searches.
+
+    The search client is shared, but httplib2 transports are not thread-safe, so each thread
+    executes its requests with its own transport.
+
+    Returns:
+    httplib2.Http: The transport of the current thread.
+    """
+    if not hasattr(_search_thread_local, "http"):
+        _search_thread_local.http = httplib2.Http(timeout=HTTP_READ_TIMEOUT)
+    return _search_thread_local.http
+
+
+def get_search_cache():
+    """
+    This function returns the process-wide cache of Google search results, creating it on first use.
+
+    Returns:
+    DiskLRUCache: The search result cache, or None if it is disabled.
+    """
+    global _search_cache
+    if SEARCH_CACHE_TTL <= 0:
+        return None
+    with _search_lock:
+        if _search_cache is None:
+            _search_cache = DiskLRUCache(
+                os.path.join(CACHE_DIR, "search.sqlite"), SEARCH_CACHE_MAX_BYTES
+            )
+        return _search_cache
+
+
+def search_cache_key(query, cx_id, start_index, num_results):
+    """
+    This function builds the cache key of a Google search from its normalized query and page.
+
+    Parameters:
+    query (str): The search query.
+    cx_id (str): The cx id for Google Custom Search JSON API.
+    start_index (int): The index of the first result.
+    num_results (int): The number of search results to return.
+
+    Returns:
+    str: The cache key.
+    """
+    normalized_query = " ".join(query.lower().split())
+    return json.dumps([normalized_query, cx_id, start_index, num_results])
 
 
 def search_google(query, api_key, cx_id, start_index, num_results=10):
     """
     This function takes a search query, API key, and cx id as input and returns a list of URLs from a Google search.
 
+    Results are cached on disk for SEARCH_CACHE_TTL seconds, so repeated searches do not use
+    the Custom Search quota.
+
     Parameters:
     query (str): The search query.
     api_key (str): The API key for Google Custom Search JSON API.
@@ -201,48 +271,161 @@ def search_google(query, api_key, cx_id, start_index, num_results=10):
     Returns:
     list: A list of URLs from the Google search.
     """
+    cache = get_search_cache()
+    key = search_cache_key(query, cx_id, start_index, num_results)
+    if cache is not None:
+        urls = cache.get(key, ttl=SEARCH_CACHE_TTL)
+        if urls is not None:
+            bprint(f"Using cached Google results for {query}")
+            return urls
+
     bprint(f"Searching Google for {query}")
-    service = build("customsearch", "v1", developerKey=api_key)
+    service = get_search_service(api_key)
     res = (
         service.cse()
         .list(q=query, cx=cx_id, start=start_index, num=num_results)
-        .execute()
+        .execute(http=get_search_http())
     )
-    urls = [item["link"] for item in res["items"]]
+    # There are no items past the last page of results
+    urls = [item["link"] for item in res.get("items", [])]
+    if cache is not None:
+        cache.set(key, urls)
     return urls
 
 
-def search_and_extract_web_url(query: str) -> str:
-    """Searches the web for the query and extracts relevant texts."""
+def script_thread_initializer() -> Callable[[], None]:
+    """
+    This function gives worker threads the context of the calling thread.
 
-    num_results = 10
-    successful_extractions = 0
-    start_index = 1
-    # Initialize an empty string to store the entire extracted texts
-    web_extracted_texts = ""
-    with open("outputs/web_search_texts.txt", "w") as f:
-        while successful_extractions < num_results:
-            urls = search_google(
-                query, GOOGLE_API_KEY, GOOGLE_CONTEXT_ID, start_index, num_results
-            )
-            for url in urls:
-                print()
-                print(f"Processing URL {successful_extractions+1} of {num_results}")
-                text = get_website_text(url)
-                if text is not None:
-                    f.write(
-                        text + "\n\n"
-                    )  # Write the text to the file, followed by two new lines
-
-                    web_extracted_texts += text + "\n\n"
-
-                    print(f"Saved content of URL {successful_extractions+1}")
-                    successful_extractions += 1
-                    if successful_extractions >= num_results:
-                        break
-            start_index += 10  # Increase the start index for the next Google search
-    print("Finished processing all URLs")
-    return web_extracted_texts
+    Worker threads need the script context to be able to print to the page, and the
+    prompt token recorder of the run.
+
+    Returns:
+    callable: The initializer to call at the start of each worker thread.
+    """
+    script_run_ctx = get_script_run_ctx()
+    prompt_token_recorder = get_prompt_token_recorder()
+
+    def _initialize():
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+        set_prompt_token_recorder(prompt_token_recorder)
+
+    return _initialize
+
+
+def iter_search_urls(
+    query: str, report: FetchReport, max_pages: int = SEARCH_MAX_PAGES
+) -> Iterator[str]:
+    """
+    This function yields the URLs of the Google results for the query, reading at most max_pages pages.
+
+    Pages are only requested when the previous results were all consumed, and URLs that were
+    already yielded are not repeated.
+
+    Parameters:
+    query (str): The search query.
+    report (FetchReport): The report counting the search pages read.
+    max_pages (int): The maximum number of result pages to read.
+
+    Yields:
+    str: The URLs of the results, in search order.
+    """
+    seen = set()
+    for page in range(max_pages):
+        urls = search_google(
+            query, GOOGLE_API_KEY, GOOGLE_CONTEXT_ID, 1 + 10 * page, 10
+        )
+        report.search_pages += 1
+        if not urls:
+            return
+        for url in urls:
+            if normalize_url(url) not in seen:
+                seen.add(normalize_url(url))
+                yield url
+
+
+def iter_search_pages(
+    query: str,
+    num_results: int = 10,
+    skip_url: Optional[Callable[[str], bool]] = None,
+    report: Optional[FetchReport] = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    This function searches the web for the query and yields the text of the first num_results pages.
+
+    Pages are yielded as soon as they are extracted, in search order, so that the caller can
+    process them while the next pages are fetched. The search gives up after SEARCH_MAX_PAGES
+    result pages or RESEARCH_TIME_BUDGET seconds, with the pages extracted by then.
+    URLs for which skip_url returns True are not fetched. They are yielded with an empty text
+    and count towards num_results, since their content is already known to the caller.
+    Near-duplicates of pages already yielded are dropped and replaced by further results. They
+    are checked in yield order, once fetched, so the pages kept do not depend on fetch timings.
+
+    Parameters:
+    query (str): The search query.
+    num_results (int): The number of pages to extract.
+    skip_url (callable): Returns True for the normalized URLs that should not be fetched.
+    report (FetchReport): Filled with the URLs that succeeded, failed, timed out or were skipped.
+
+    Yields:
+    tuple: The normalized URL and the extracted text of each page, in search order.
+    """
+    report = report if report is not None else FetchReport()
+    deduplicator = make_deduplicator()
+
+    def _fetch(url):
+        if skip_url is not None and skip_url(normalize_url(url)):
+            print(f"Skipping already indexed URL {url}")
+            return normalize_url(url), ""
+        text = get_website_text(url)
+        if text is None:
+            return None
+        return normalize_url(url), text
+
+    def _accept(page):
+        url, text = page
+        # Skipped URLs have no text, their content was checked when first indexed
+        if text and deduplicator.is_duplicate(text):
+            print(f"Skipping near-duplicate page {url}")
+            return False
+        return True
+
+    print()
+    print(f"Processing up to {num_results} URLs in parallel")
+    scheduler = FetchScheduler(
+        _fetch,
+        num_results,
+        FETCH_WORKERS,
+        report=report,
+        accept=_accept if deduplicator is not None else None,
+        thread_initializer=script_thread_initializer(),
+    )
+    for num_pages, page in enumerate(scheduler.run(iter_search_urls(query, report))):
+        print(f"Saved content of URL {num_pages + 1}")
+        yield page
+    print(f"Finished processing all URLs: {report.summary()}")
+    if report.timed_out:
+        print(f"Timed out URLs: {report.timed_out}")
+    if deduplicator is not None:
+        print(f"Page deduplication: {deduplicator.stats()}")
+    log_cache_stats()
+
+
+def search_and_extract_web_url(query: str, output_file: Optional[str] = None) -> str:
+    """Searches the web for the query and extracts relevant texts.
+
+    The texts are also written to output_file as they are extracted, unless it is None.
+    """
+    # Collect the texts and join them once, instead of growing a string
+    web_extracted_texts = []
+    with open(output_file or os.devnull, "w") as f:
+        for _, text in iter_search_pages(query):
+            f.write(
+                text + "\n\n"
+            )  # Write the text to the file, followed by two new lines
+
+            web_extracted_texts.append(text + "\n\n")
+    return "".join(web_extracted_texts)
 
 
 @tool("search")
@@ -250,32 +433,73 @@ def search_and_summarize_web_url(query: str) -> str:
     """Searches the web for the query and extracts relevant texts."""
 
     num_results = 4
-    successful_extractions = 0
-    start_index = 1
-    # Initialize an empty string to store the entire extracted texts
-    web_extracted_summaries = ""
-    while successful_extractions < num_results:
-        urls = search_google(
-            query, GOOGLE_API_KEY, GOOGLE_CONTEXT_ID, start_index, num_results
-        )
-        for url in urls:
-            bprint(f"Processing URL {successful_extractions+1}/{num_results}")
-            summary = get_website_summary(url)
-            if summary is not None:
-                # Write the text to the file, followed by two new lines
-                web_extracted_summaries += summary + "\n\n"
-
-                # gprint(f"Saved content of URL {successful_extractions+1}")
-                print("-" * 134)
-                successful_extractions += 1
-                if successful_extractions >= num_results:
-                    break
-        # Increase the start index for the next Google search
-        start_index += 10
-    gprint("Finished processing all URLs")
+    num_candidates = math.ceil(num_results * RANK_CANDIDATES_PER_RESULT)
+    deduplicator = make_deduplicator(SUMMARY_MODEL)
+
+    # Fetch more pages than needed, without summarizing them
+    bprint(f"Fetching up to {num_candidates} candidate URLs in parallel")
+    report = FetchReport()
+
+    def _accept(text):
+        # Near-duplicates are checked in the order the pages are returned
+        return not deduplicator.is_duplicate(text)
+
+    scheduler = FetchScheduler(
+        get_website_page_text,
+        num_candidates,
+        FETCH_WORKERS,
+        report=report,
+        accept=_accept if deduplicator is not None else None,
+        thread_initializer=script_thread_initializer(),
+    )
+    texts = list(scheduler.run(iter_search_urls(query, report)))
+    gprint(f"Finished fetching all URLs: {report.summary()}")
+    if report.timed_out:
+        logging.info(f"Timed out URLs: {report.timed_out}")
+    if deduplicator is not None:
+        logging.info(f"Page deduplication: {deduplicator.stats()}")
+
+    # Only summarize the most relevant pages. Pages longer than the summarizer
+    # reads (SUMMARY_MAX_CHUNKS chunks) are cut to their most relevant passages
+    ranking = rank_texts(query, texts)
+    scores = [round(score, 2) for _, score in ranking[:num_results]]
+    logging.info(f"Page relevance scores: {scores}")
+    max_page_words = RANK_MAX_WORDS_PER_PAGE or int(
+        SUMMARY_CHUNK_TOKENS * SUMMARY_MAX_CHUNKS / TOKENS_PER_WORD
+    )
+
+    bprint(f"Summarizing the {min(num_results, len(ranking))} most relevant pages")
+
+    def _summarize(i):
+        return summarize_text(select_passages(query, texts[i], max_page_words))
+
+    summaries = {}
+    candidates = (i for i, _ in ranking)
+    with ThreadPoolExecutor(
+        max_workers=max(1, num_results), initializer=script_thread_initializer()
+    ) as executor:
+        running = {
+            executor.submit(_summarize, i): i for i in islice(candidates, num_results)
+        }
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                summaries[i] = future.result()
+                if not summaries[i]:
+                    # A page that could not be summarized is replaced by the next one
+                    replacement = next(candidates, None)
+                    if replacement is not None:
+                        running[executor.submit(_summarize, replacement)] = replacement
+
+    web_extracted_summaries = "".join(
+        summaries[i] + "\n\n" for i, _ in ranking if summaries.get(i)
+    )
+    gprint("Finished summarizing all pages")
+    log_cache_stats()
     return web_extracted_summaries
 
 
 if __name__ == "__main__":
     query = "Pick a ripe watermelon"
-    search_and_extract_web_url(query)
+    search_and_extract_web_url(query, "outputs/web_search_texts.txt")